@@ -1,4 +1,7 @@
+import collections
 import logging
+import struct
+import threading
 import time
 
 import serial
@@ -6,39 +9,258 @@ import serial
 
 log = logging.getLogger(__name__)
 
+# Binary stream frames: sync bytes, then little endian sequence number and raw
+# red, green, blue, and clear counts, then XOR checksum of those 10 bytes.
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_FORMAT = '<HHHHHB'
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+
+# Integration time in seconds and gain multiplier the sketch configures the
+# sensor with.
+INTEGRATION = (0.700, 1)
+
+# Seconds the Arduino takes to reset and start the sketch after DTR is asserted.
+RESET_DELAY = 3.0
+
+# Seconds to wait for an answer when checking if the sketch is already running.
+# The sketch answers after reading the sensor, which takes a full integration.
+PROBE_TIMEOUT = max(1.0, INTEGRATION[0] + 0.5)
+
+# Seconds a port found not to stream is remembered in the probe cache, after
+# which it's checked again in case the sketch was updated.
+STREAM_CACHE_SECONDS = 24*60*60.0
+
+# A reading from the sensor.  Color is a tuple of RGB floats (0-1.0) divided by
+# the clear channel, counts is a tuple of raw RGBC counts when known.
+Sample = collections.namedtuple('Sample', ['time', 'sequence', 'color', 'counts'])
+
+
+def _parse_line(line):
+	"""Parse a comma separated line of red, green, blue values into a tuple."""
+	if line is None:
+		raise RuntimeError('Received no data from serial readline().')
+	components = line.decode('ascii', 'replace').strip().split(',')
+	if components is None or len(components) != 3:
+		raise RuntimeError('Error parsing response line: {0}'.format(line))
+	return (float(components[0]), float(components[1]), float(components[2]))
+
+
+def _parse_frame(payload):
+	"""Return tuple of sequence number and raw red, green, blue, and clear counts
+	of a binary frame after its sync bytes, or None if the checksum is wrong."""
+	sequence, r, g, b, c, checksum = struct.unpack(FRAME_FORMAT, payload)
+	check = 0
+	for byte in bytearray(payload[:-1]):
+		check ^= byte
+	if check != checksum:
+		return None
+	return (sequence, r, g, b, c)
+
 
 class ArduinoHardware(object):
-	"""Communicate with color sensor attached to an Arduino on a serial port."""
-
-	def __init__(self, port):
-		# Open the serial connection.
-		self.serial = serial.Serial(port, 115200, timeout=5)
-		# Wait a few seconds for the Arduino to reset and swallow any data
-		# received.  This is necessary because the color sensor Arduino library
-		# writes some data to serial on startup and will interfere with later calls.
-		time.sleep(3.0)
+	"""Communicate with color sensor attached to an Arduino on a serial port.
+
+	By default each reading is requested with a '?' command.  With stream set the
+	Arduino is asked once to push readings continuously, as text lines or as
+	binary frames with raw counts and a sequence number if binary is also set.
+	Streamed readings are collected by a background thread into a ring buffer of
+	the most recent buffer_size samples.  If the Arduino doesn't start streaming
+	(an older sketch) the '?' command is used instead.
+
+	The port is opened without asserting DTR so a board that's already running
+	isn't reset, and the fixed reset wait is skipped if it answers a '?' command
+	straight away.  Set reset to always wait.  If a ProbeCache is given, ports
+	found not to stream are remembered for STREAM_CACHE_SECONDS so later runs
+	don't wait for a stream that never comes."""
+
+	def __init__(self, port, stream=False, binary=False, buffer_size=16, timeout=5.0, reset=False, cache=None):
+		self.port = port
+		self.timeout = timeout
+		self.samples = collections.deque(maxlen=buffer_size)
+		self.stream = False
+		# Raw red, green, blue, and clear counts of the last reading, when known.
+		self.last_counts = None
+		self.integration = INTEGRATION
+		self._condition = threading.Condition()
+		self._reader = None
+		self._stopping = False
+		# Open the serial connection, with DTR low since on most Arduinos it
+		# triggers a reset.
+		started = time.time()
+		self.serial = serial.Serial()
+		self.serial.port = port
+		self.serial.baudrate = 115200
+		self.serial.timeout = timeout
+		self.serial.dtr = False
+		self.serial.open()
+		if reset or not self._responding(PROBE_TIMEOUT):
+			# Wait for the Arduino to reset and swallow any data received.  This is
+			# necessary because the color sensor Arduino library writes some data to
+			# serial on startup and will interfere with later calls.
+			time.sleep(max(0.0, RESET_DELAY - (time.time() - started)))
+			self.serial.flushInput()
+		else:
+			log.info('Arduino at {0} already running, skipped reset wait.'.format(port))
+		if stream:
+			key = 'arduino-stream {0}'.format(port)
+			cached = cache.get(key) if cache is not None else None
+			if isinstance(cached, dict) and 0.0 <= time.time() - cached.get('checked', 0.0) < STREAM_CACHE_SECONDS:
+				log.info('Arduino at {0} is known not to stream, polling it.'.format(port))
+			else:
+				self._start_stream(binary)
+				if cache is not None and self.stream:
+					cache.discard(key)
+				elif cache is not None:
+					cache.set(key, {'stream': False, 'checked': time.time()})
+
+	def _responding(self, timeout):
+		"""Return True if the Arduino answers a '?' command within timeout seconds."""
+		self.serial.timeout = timeout
+		try:
+			self.serial.flushInput()
+			self.serial.write(b'?')
+			self.serial.flush()
+			_parse_line(self.serial.readline())
+			return True
+		except (RuntimeError, ValueError):
+			return False
+		finally:
+			self.serial.timeout = self.timeout
+
+	def _start_stream(self, binary):
+		"""Subscribe to streamed readings, falling back to '?' commands if none arrive."""
+		self.serial.write(b'b' if binary else b's')
+		self.serial.flush()
+		self.stream = True
+		self._stopping = False
+		self._reader = threading.Thread(target=self._read_frames if binary else self._read_lines,
+			name='ArduinoHardware-reader')
+		self._reader.daemon = True
+		self._reader.start()
+		with self._condition:
+			if not self.samples:
+				self._condition.wait(self.timeout)
+			if self.samples:
+				log.info('Receiving streamed readings.')
+				return
+		log.warning('No streamed readings received, falling back to polling.')
+		self._stop_stream()
 		self.serial.flushInput()
 
+	def _stop_stream(self):
+		"""Unsubscribe from streamed readings and stop the reader thread."""
+		self._stopping = True
+		self.serial.write(b'x')
+		self.serial.flush()
+		if self._reader is not None:
+			self._reader.join()
+			self._reader = None
+		self.stream = False
+
+	def _add_sample(self, sample):
+		with self._condition:
+			self.samples.append(sample)
+			self._condition.notify_all()
+
+	def _read_lines(self):
+		sequence = 0
+		while not self._stopping:
+			line = self.serial.readline()
+			if not line:
+				continue
+			try:
+				color = _parse_line(line)
+			except (RuntimeError, ValueError) as e:
+				log.warning(str(e))
+				continue
+			self._add_sample(Sample(time.time(), sequence, color, None))
+			sequence = (sequence + 1) & 0xFFFF
+
+	def _read_frames(self):
+		buffer = b''
+		while not self._stopping:
+			data = self.serial.read(max(1, self.serial.inWaiting()))
+			if not data:
+				continue
+			buffer += data
+			while len(buffer) >= len(FRAME_SYNC) + FRAME_SIZE:
+				# Resynchronize on the start of a frame.
+				start = buffer.find(FRAME_SYNC)
+				if start < 0:
+					buffer = buffer[-1:]
+					break
+				buffer = buffer[start:]
+				if len(buffer) < len(FRAME_SYNC) + FRAME_SIZE:
+					break
+				frame = _parse_frame(buffer[len(FRAME_SYNC):len(FRAME_SYNC) + FRAME_SIZE])
+				if frame is None:
+					# Not a real frame, skip the sync bytes and search again.
+					buffer = buffer[len(FRAME_SYNC):]
+					continue
+				buffer = buffer[len(FRAME_SYNC) + FRAME_SIZE:]
+				sequence, r, g, b, c = frame
+				if c == 0:
+					log.warning('Received reading with no clear channel light.')
+					continue
+				color = (float(r)/float(c), float(g)/float(c), float(b)/float(c))
+				self._add_sample(Sample(time.time(), sequence, color, (r, g, b, c)))
+
+	@property
+	def max_read_seconds(self):
+		"""Longest get_color or get_counts can take to return or raise, the serial
+		read timeout."""
+		return self.timeout
+
 	def get_color(self):
 		"""Return tuple of RGB color (with float components, 0-1.0) read from Arduino."""
+		if self.stream:
+			# Return the newest streamed reading, as long as it's recent.
+			with self._condition:
+				sample = self.samples[-1] if self.samples else None
+			if sample is None or time.time() - sample.time > self.timeout:
+				raise RuntimeError('No recent streamed reading received from Arduino.')
+			self.last_counts = sample.counts
+			return sample.color
 		# Clear input buffer and send a question mark character.
 		self.serial.flushInput()
-		self.serial.write('?')
+		self.serial.write(b'?')
 		self.serial.flush()
 		log.info('Sent question command.')
 		# Parse the response line for 3 color components.
-		line = self.serial.readline()
-		if line is None:
-			raise RuntimeError('Received no data from serial readline().')
-		components = line.strip().split(',')
-		if components is None or len(components) != 3:
-			raise RuntimeError('Error parsing response line: {0}'.format(line))
-		# Return RGB values.
-		r = float(components[0])
-		g = float(components[1])
-		b = float(components[2])
-		return (r, g, b)
+		return _parse_line(self.serial.readline())
+
+	def get_counts(self):
+		"""Return tuple of raw red, green, blue, and clear counts read from Arduino.
+		Needs binary streaming, or a sketch that answers the 'c' command."""
+		if self.stream:
+			with self._condition:
+				sample = self.samples[-1] if self.samples else None
+			if sample is None or time.time() - sample.time > self.timeout:
+				raise RuntimeError('No recent streamed reading received from Arduino.')
+			if sample.counts is None:
+				raise RuntimeError('Streamed text readings have no raw counts, stream binary frames instead.')
+			self.last_counts = sample.counts
+			return sample.counts
+		# Ask for one binary frame.
+		self.serial.flushInput()
+		self.serial.write(b'c')
+		self.serial.flush()
+		data = self.serial.read(len(FRAME_SYNC) + FRAME_SIZE)
+		if len(data) != len(FRAME_SYNC) + FRAME_SIZE or not data.startswith(FRAME_SYNC):
+			raise RuntimeError('Error reading counts frame: {0!r}'.format(data))
+		frame = _parse_frame(data[len(FRAME_SYNC):])
+		if frame is None:
+			raise RuntimeError('Bad checksum in counts frame: {0!r}'.format(data))
+		self.last_counts = frame[1:]
+		return self.last_counts
+
+	def recent(self):
+		"""Return list of the most recent streamed samples, oldest first."""
+		with self._condition:
+			return list(self.samples)
 
 	def close(self):
 		"""Close the connection with the sensor hardware."""
+		if self.stream:
+			self._stop_stream()
 		self.serial.close()
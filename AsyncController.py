@@ -0,0 +1,147 @@
+import asyncio
+import logging
+
+import AutoColorTemp
+import Metrics
+
+
+log = logging.getLogger(__name__)
+
+
+class Sensor(object):
+	"""Color sensor hardware read by the controller.  Weight sets how much its
+	readings count when fused with other sensors."""
+
+	def __init__(self, hardware, weight=1.0):
+		self.hardware = hardware
+		self.weight = weight
+		# Latest color, or raw counts when the controller has a sensor matrix.
+		self.color = None
+		# Number of new readings taken, so displays can tell when it changes.
+		self.version = 0
+
+
+class Display(object):
+	"""Gamma adjustment object driven by the controller from the readings of the
+	sensors with the given indexes, or all sensors if sensors is None."""
+
+	def __init__(self, gamma, sensors=None):
+		self.gamma = gamma
+		self.sensors = sensors
+
+
+class AsyncController(object):
+	"""Drive several color sensors and displays concurrently with asyncio.  Each
+	sensor is read on its own task every delay seconds, with the blocking read
+	run in an executor thread.  Each display has its own task which, whenever one
+	of its sensors has a new reading, fuses the latest readings of its sensors
+	with a weighted average and updates the display.  A slow sensor or display
+	only holds up itself.
+
+	Sensors are read like AutoColorTemp reads its sensor, skipping reads while
+	the light is unchanged.  With a sensor matrix raw counts are read, fused,
+	and converted to color temperature with it."""
+
+	def __init__(self, sensors, displays, delay, white_table=None, deadband=0.0, deadband_delta_e=0.0, executor=None,
+		sensor_matrix=None):
+		self.sensors = [s if isinstance(s, Sensor) else Sensor(s) for s in sensors]
+		self.displays = [d if isinstance(d, Display) else Display(d) for d in displays]
+		self.delay = float(delay)
+		self.executor = executor
+		self.sensor_matrix = sensor_matrix
+		# Each display gets its own color temperature logic so deadbands and
+		# update counts are tracked per display.
+		for display in self.displays:
+			display.main = AutoColorTemp.AutoColorTemp(None, display.gamma, white_table,
+				deadband=deadband, deadband_delta_e=deadband_delta_e, sensor_matrix=sensor_matrix)
+		self._readings = None
+		self._tasks = []
+
+	def fuse(self, indexes=None):
+		"""Return weighted average of the latest color of the sensors with the given
+		indexes (or all sensors), or None if none have been read yet."""
+		sensors = self.sensors if indexes is None else [self.sensors[i] for i in indexes]
+		total = 0.0
+		fused = None
+		for sensor in sensors:
+			if sensor.color is None or sensor.weight <= 0.0:
+				continue
+			if fused is None:
+				fused = [0.0] * len(sensor.color)
+			total += sensor.weight
+			for c in range(len(fused)):
+				fused[c] += sensor.weight * sensor.color[c]
+		if total == 0.0:
+			return None
+		return tuple(v / total for v in fused)
+
+	def _versions(self, indexes):
+		"""Return tuple of reading versions of the sensors with the given indexes (or
+		all sensors)."""
+		sensors = self.sensors if indexes is None else [self.sensors[i] for i in indexes]
+		return tuple(sensor.version for sensor in sensors)
+
+	async def _run_sensor(self, index):
+		loop = asyncio.get_event_loop()
+		sensor = self.sensors[index]
+		while True:
+			try:
+				color = await loop.run_in_executor(self.executor, AutoColorTemp.sample, sensor.hardware,
+					self.sensor_matrix is not None)
+			except Exception as e:
+				log.error('Error reading sensor {0}: {1}'.format(index, e))
+				Metrics.registry.inc('updates_failed_total')
+			else:
+				if color is not None:
+					sensor.color = color
+					async with self._readings:
+						sensor.version += 1
+						self._readings.notify_all()
+				elif not getattr(sensor.hardware, 'connected', True):
+					# A disconnected sensor is left out of fused colors until it has
+					# a reading again.
+					sensor.color = None
+			await asyncio.sleep(self.delay)
+
+	async def _run_display(self, display):
+		loop = asyncio.get_event_loop()
+		versions = self._versions(display.sensors)
+		while True:
+			# Only wake up for new readings of this display's own sensors.
+			async with self._readings:
+				await self._readings.wait_for(lambda: self._versions(display.sensors) != versions)
+				versions = self._versions(display.sensors)
+			color = self.fuse(display.sensors)
+			if color is None:
+				continue
+			try:
+				result = display.main.process(color)
+			except ZeroDivisionError:
+				log.warning('Divide by zero while updating color temp.  Waiting for next update to try again.')
+				Metrics.registry.inc('updates_failed_total')
+				continue
+			if result is not None:
+				await loop.run_in_executor(self.executor, display.main.apply, *result)
+
+	async def run(self):
+		"""Read sensors and update displays until cancelled."""
+		self._readings = asyncio.Condition()
+		self._tasks = [asyncio.ensure_future(self._run_sensor(i)) for i in range(len(self.sensors))]
+		self._tasks += [asyncio.ensure_future(self._run_display(d)) for d in self.displays]
+		try:
+			await asyncio.gather(*self._tasks)
+		finally:
+			for task in self._tasks:
+				task.cancel()
+
+	def stop(self):
+		"""Cancel the running sensor and display tasks."""
+		for task in self._tasks:
+			task.cancel()
+
+	def close(self):
+		"""Restore gamma of all displays and close all sensors."""
+		for display in self.displays:
+			display.main.close()
+		for sensor in self.sensors:
+			sensor.hardware.close()
@@ -1,17 +1,59 @@
 from __future__ import print_function
 import logging
 import math
+import time
 
-from colormath.color_objects import RGBColor, xyYColor
+import numpy
+
+import Metrics
 
 
 log = logging.getLogger(__name__)
 
+# Range of color temperatures supported by the Planckian locus approximation.
+TEMP_MIN = 1667.0
+TEMP_MAX = 25000.0
+_MIRED_MAX = 1e6 / TEMP_MIN
+_MIRED_MIN = 1e6 / TEMP_MAX
+
+# sRGB (D65) working space matrices, as row vector multipliers, and Bradford
+# chromatic adaptation matrix.  Values match those used by colormath so the
+# array conversions below agree with the scalar ones.
+_SRGB_TO_XYZ = numpy.array((
+	(0.412424, 0.212656, 0.0193324),
+	(0.357579, 0.715158, 0.119193),
+	(0.180464, 0.0721856, 0.950444)))
+_XYZ_TO_SRGB = numpy.array((
+	( 3.24071,  -0.969258,  0.0556352),
+	(-1.53726,   1.87599,  -0.203996),
+	(-0.498571,  0.0415557, 1.05707)))
+_BRADFORD = numpy.array((
+	( 0.8951, -0.7502,  0.0389),
+	( 0.2664,  1.7135, -0.0685),
+	(-0.1614,  0.0367,  1.0296)))
+_D50 = numpy.array((0.96422, 1.00000, 0.82521))
+_D65 = numpy.array((0.95047, 1.00000, 1.08883))
+
+def _adaptation_matrix(source, target):
+	"""Return Bradford matrix adapting XYZ row vectors from source to target white."""
+	cone_source = numpy.dot(source, _BRADFORD)
+	cone_target = numpy.dot(target, _BRADFORD)
+	return numpy.dot(numpy.dot(_BRADFORD, numpy.diag(cone_target / cone_source)), numpy.linalg.inv(_BRADFORD))
+
+# White points computed at full brightness in D50 xyY and converted to D65 sRGB.
+_XYZ_D50_TO_SRGB = numpy.dot(_adaptation_matrix(_D50, _D65), _XYZ_TO_SRGB)
+
 
 def _rgb_to_temp(r, g, b):
 	"""Convert RGB color (with float components, 0-1.0) to color temperature."""
+	# colormath is slow to import, so load it only when first needed.
+	from colormath.color_objects import RGBColor
 	# First convert RGB to xyY color space.
 	x, y, Y = RGBColor(r, g, b).convert_to('xyy').get_value_tuple()
+	return xy_to_temp(x, y)
+
+def xy_to_temp(x, y):
+	"""Convert CIE xy chromaticity to color temperature."""
 	# Assume 3k - 50k Kelvin range and solve equation to convert xyY to color
 	# temperature.  Equation from:
 	#   http://en.wikipedia.org/wiki/Color_temperature#Approximation
@@ -47,47 +89,332 @@ def _temp_to_white(t):
 	elif 4000.0 < t and t <= 25000.0:
 		yc =  3.0817580*math.pow(xc, 3.0) - 5.87338670*math.pow(xc, 2.0) + 3.75112997*xc - 0.37001483
 	# Covert from full bright xyY color space to RGB (sRGB default) for white point at specified temp.
+	from colormath.color_objects import xyYColor
 	white = xyYColor(xc, yc, 1.0).convert_to('rgb').get_value_tuple()
 	# Return values normalized to 0-1.0 range.
 	return (white[0] / 255.0, white[1] / 255.0, white[2] / 255.0)
 
+def rgb_to_temp_array(rgb):
+	"""Convert an Nx3 array of RGB colors (with float components, 0-1.0) to an
+	array of N color temperatures.  Equivalent to calling _rgb_to_temp on each
+	row."""
+	# Components are scaled and linearized the same way colormath treats the
+	# values passed in by _rgb_to_temp.
+	rgb = numpy.asarray(rgb, dtype=float).reshape(-1, 3) / 255.0
+	linear = numpy.where(rgb > 0.04045, numpy.power((rgb + 0.055) / 1.055, 2.4), rgb / 12.92)
+	xyz = numpy.dot(linear, _SRGB_TO_XYZ)
+	total = numpy.sum(xyz, axis=1)
+	x = xyz[:, 0] / total
+	y = xyz[:, 1] / total
+	n = (x - 0.3366)/(y - 0.1735)
+	return -949.86315 + 6253.80338*numpy.exp(-n/0.92159) + 28.70599*numpy.exp(-n/0.20039) + 0.00004*numpy.exp(-n/0.07125)
+
+def temp_to_white_array(temps):
+	"""Convert an array of N color temperatures to an Nx3 array of sRGB white
+	points.  Equivalent to calling _temp_to_white on each value, except results
+	aren't quantized to 8 bits."""
+	t = numpy.asarray(temps, dtype=float).reshape(-1)
+	if numpy.any(t < TEMP_MIN) or numpy.any(t > TEMP_MAX):
+		raise ValueError('Temperature must be between 1667K and 25000K.')
+	# Planckian locus approximation, as in _temp_to_white.
+	t1 = 1e3 / t
+	t2 = t1 * t1
+	t3 = t2 * t1
+	xc = numpy.where(t <= 4000.0,
+		-0.2661239*t3 - 0.2343580*t2 + 0.8776956*t1 + 0.179910,
+		-3.0258469*t3 + 2.1070379*t2 + 0.2226347*t1 + 0.240390)
+	x2 = xc * xc
+	x3 = x2 * xc
+	yc = numpy.where(t <= 2222.0,
+		-1.1063814*x3 - 1.34811020*x2 + 2.18555832*xc - 0.20219683,
+		numpy.where(t <= 4000.0,
+			-0.9549476*x3 - 1.37418593*x2 + 2.09137015*xc - 0.16748867,
+			 3.0817580*x3 - 5.87338670*x2 + 3.75112997*xc - 0.37001483))
+	# Convert full bright xyY to XYZ and then to companded sRGB.
+	xyz = numpy.column_stack((xc / yc, numpy.ones_like(yc), (1.0 - xc - yc) / yc))
+	linear = numpy.dot(xyz, _XYZ_D50_TO_SRGB)
+	white = numpy.where(linear > 0.0031308, 1.055*numpy.power(numpy.maximum(linear, 0.0031308), 1.0/2.4) - 0.055, linear*12.92)
+	return numpy.clip(white, 0.0, 1.0)
+
+def _counts_to_color(counts):
+	"""Return red, green, and blue counts divided by the clear count."""
+	if not counts[3]:
+		return (0.0, 0.0, 0.0)
+	return (counts[0] / float(counts[3]), counts[1] / float(counts[3]), counts[2] / float(counts[3]))
+
+def _white_to_lab(white):
+	"""Convert sRGB white point tuple to CIE L*a*b* relative to D65."""
+	linear = []
+	for c in white:
+		linear.append(math.pow((c + 0.055)/1.055, 2.4) if c > 0.04045 else c/12.92)
+	xyz = numpy.dot(linear, _SRGB_TO_XYZ) / _D65
+	f = [math.pow(v, 1.0/3.0) if v > 216.0/24389.0 else (24389.0/27.0*v + 16.0)/116.0 for v in xyz]
+	return (116.0*f[1] - 16.0, 500.0*(f[0] - f[1]), 200.0*(f[1] - f[2]))
+
+def _white_delta_e(white1, white2):
+	"""Return CIE76 color difference between two sRGB white point tuples."""
+	lab1 = _white_to_lab(white1)
+	lab2 = _white_to_lab(white2)
+	return math.sqrt(sum((a - b)*(a - b) for a, b in zip(lab1, lab2)))
+
 def gamma_table_gen(size, white, gamma):
 	"""Generator function to build a gamma ramp of the given size, white point, and gamma."""
 	for i in range(size):
 		yield math.pow(float(i)/float(size-1), 1.0/float(gamma)) * float(white)
 
 
+class WhitePointTable(object):
+	"""Precomputed table of white points across the supported color temperature
+	range.  Lookups interpolate linearly between entries, which avoids a full
+	colormath conversion on every update.  Entries are evenly spaced in mireds
+	(one million divided by kelvin) because the white point changes much faster
+	per kelvin at low temperatures than at high ones."""
+
+	def __init__(self, step=1.0, temps=None, whites=None):
+		self.step = float(step)
+		if temps is None or whites is None:
+			# Build the table from the exact conversion, with entries no further
+			# apart than the requested step in mireds and both range endpoints
+			# included.
+			count = int(math.ceil((_MIRED_MAX - _MIRED_MIN) / self.step)) + 1
+			temps = 1e6 / numpy.linspace(_MIRED_MAX, _MIRED_MIN, count)
+			temps[0] = TEMP_MIN
+			temps[-1] = TEMP_MAX
+			whites = temp_to_white_array(temps)
+		self.temps = numpy.asarray(temps, dtype=float)
+		self.whites = numpy.asarray(whites, dtype=float)
+		# Keep plain Python copies for fast scalar lookups.
+		self._spacing = (_MIRED_MAX - _MIRED_MIN) / float(len(self.temps) - 1)
+		self._rows = self.whites.tolist()
+
+	@classmethod
+	def load(cls, path, step=1.0):
+		"""Load table from cache file at path.  The table is built and saved to
+		path if the file is missing, unreadable, or was built with another step."""
+		try:
+			with numpy.load(path) as data:
+				if float(data['step']) == float(step):
+					return cls(step, data['temps'], data['whites'])
+			log.info('White point table cache {0} has a different step, rebuilding.'.format(path))
+		except (IOError, OSError, KeyError, ValueError):
+			log.info('Could not read white point table cache {0}, rebuilding.'.format(path))
+		table = cls(step)
+		try:
+			table.save(path)
+		except (IOError, OSError) as e:
+			log.warning('Could not save white point table cache: {0}'.format(e))
+		return table
+
+	def save(self, path):
+		"""Save table to a cache file at path."""
+		with open(path, 'wb') as f:
+			numpy.savez(f, step=self.step, temps=self.temps, whites=self.whites)
+
+	def white(self, t):
+		"""Return interpolated sRGB white point tuple for color temperature t."""
+		if t < TEMP_MIN or t > TEMP_MAX:
+			raise ValueError('Temperature must be between 1667K and 25000K.')
+		pos = (_MIRED_MAX - 1e6/t) / self._spacing
+		i = min(int(pos), len(self._rows) - 2)
+		frac = pos - i
+		lo = self._rows[i]
+		hi = self._rows[i+1]
+		return (lo[0] + (hi[0] - lo[0])*frac,
+				lo[1] + (hi[1] - lo[1])*frac,
+				lo[2] + (hi[2] - lo[2])*frac)
+
+	def white_array(self, temps):
+		"""Return an Nx3 array of interpolated white points for an array of N color
+		temperatures."""
+		temps = numpy.asarray(temps, dtype=float)
+		if numpy.any(temps < TEMP_MIN) or numpy.any(temps > TEMP_MAX):
+			raise ValueError('Temperature must be between 1667K and 25000K.')
+		# Interpolate on mireds, flipped so they increase as numpy.interp requires.
+		mireds = 1e6 / temps
+		table_mireds = 1e6 / self.temps[::-1]
+		whites = self.whites[::-1]
+		return numpy.column_stack([numpy.interp(mireds, table_mireds, whites[:, c]) for c in range(3)])
+
+	def max_error(self):
+		"""Return the largest per-channel difference between the table and the exact
+		_temp_to_white result, measured halfway between table entries."""
+		mids = 2e6 / (1e6/self.temps[:-1] + 1e6/self.temps[1:])
+		exact = numpy.array([_temp_to_white(t) for t in mids])
+		return float(numpy.max(numpy.abs(self.white_array(mids) - exact)))
+
+
+_default_white_table = None
+
+def default_white_table():
+	"""Return the shared white point table, building it on first use."""
+	global _default_white_table
+	if _default_white_table is None:
+		_default_white_table = WhitePointTable()
+	return _default_white_table
+
+
+def sample(hardware, counts=False):
+	"""Query color sensor hardware and return measured color, or raw counts if
+	counts is True.  Returns None if the hardware reports the light hasn't
+	changed since it was last read or has no reading available."""
+	light_changed = getattr(hardware, 'light_changed', None)
+	if light_changed is not None and not light_changed():
+		log.info('Light unchanged since last reading.')
+		Metrics.registry.inc('samples_unchanged_total')
+		return None
+	with Metrics.registry.time('get_color_seconds'):
+		if counts:
+			measured = hardware.get_counts()
+		else:
+			measured = hardware.get_color()
+	if measured is None:
+		# Hardware has no reading right now, leave the display as it is.
+		log.info('No reading available from hardware.')
+		Metrics.registry.inc('samples_missing_total')
+		return None
+	if log.isEnabledFor(logging.INFO):
+		if counts:
+			log.info('Read counts from hardware: red={0:.0f} green={1:.0f} blue={2:.0f} clear={3:.0f}'.format(*measured))
+		else:
+			log.info('Read color from hardware: red={0:0.3f} green={1:0.3f} blue={2:0.3f}'.format(measured[0], measured[1], measured[2]))
+	return measured
+
+
 class AutoColorTemp(object):
 	"""Main logic to query the color sensor and update monitor color temperature."""
 	
-	def __init__(self, hardware, gamma):
+	def __init__(self, hardware, gamma, white_table=None, deadband=0.0, deadband_delta_e=0.0, recorder=None, publisher=None,
+		sensor_matrix=None):
 		self.hardware = hardware
 		self.gamma = gamma
+		# Optional Recorder.Recorder which logs every reading taken by update.
+		self.recorder = recorder
+		# Optional Fleet.Publisher which sends every applied update to other hosts.
+		self.publisher = publisher
+		# Optional SensorMatrix.SensorMatrix.  When set raw counts are read with
+		# hardware.get_counts() and converted with it instead of colormath.
+		self.sensor_matrix = sensor_matrix
+		self.measured_lux = None
+		self.white_table = white_table if white_table is not None else default_white_table()
+		# Updates that change the temperature by less than deadband kelvin, or the
+		# white point by less than deadband_delta_e, are skipped.
+		self.deadband = deadband
+		self.deadband_delta_e = deadband_delta_e
+		self.measured_temp = None
+		self.last_temp = None
+		self.last_white = None
+		self.applied_updates = 0
+		self.skipped_updates = 0
+
+	def sample(self):
+		"""Query color sensor hardware and return measured color, or None if the
+		hardware reports the light hasn't changed since it was last read or has no
+		reading available."""
+		return sample(self.hardware, self.sensor_matrix is not None)
+
+	def process(self, measured):
+		"""Compute the color temperature and white point of a measured color, or raw
+		counts if a sensor matrix is set.  Returns a tuple of temperature and white
+		point, or None if the monitor shouldn't be adjusted."""
+		# Compute temperature of measured color.
+		if self.sensor_matrix is not None:
+			with Metrics.registry.time('counts_to_temp_seconds'):
+				temp = self.sensor_matrix.temp(measured)
+			# Auto ranging hardware may have changed range since the reading was
+			# taken, so use the range it was taken with when known.
+			integration = getattr(self.hardware, 'last_integration', None)
+			if integration is None:
+				integration = getattr(self.hardware, 'integration', None)
+			if integration is not None:
+				self.measured_lux = self.sensor_matrix.lux(measured, *integration)
+				Metrics.registry.set('measured_lux', self.measured_lux)
+		else:
+			with Metrics.registry.time('rgb_to_temp_seconds'):
+				temp = _rgb_to_temp(measured[0], measured[1], measured[2])
+		print('Measured color temperature: {0:,.0f} kelvin'.format(temp))
+		self.measured_temp = temp
+		Metrics.registry.set('measured_temp_kelvin', temp)
+		return self.process_temp(temp)
+
+	def process_temp(self, temp):
+		"""Compute the white point of a target color temperature, from a sensor or
+		any other source.  Returns a tuple of temperature and white point, or None
+		if the monitor shouldn't be adjusted."""
+		# Adjust monitor color temperature if within range of allowed temps.
+		if temp < TEMP_MIN or temp > TEMP_MAX:
+			log.warning('Measured color temperature outside bounds of allowed temperatures.  No monitor gamma adjustment made.')
+			Metrics.registry.inc('updates_out_of_range_total')
+			return None
+		if self.last_temp is not None and abs(temp - self.last_temp) < self.deadband:
+			log.info('Temperature change within deadband.  No monitor gamma adjustment made.')
+			self.skipped_updates += 1
+			Metrics.registry.inc('updates_skipped_total')
+			return None
+		with Metrics.registry.time('temp_to_white_seconds'):
+			white = self.white_table.white(temp)
+		if log.isEnabledFor(logging.INFO):
+			log.info('Computed white point: red={0:0.3f} green={1:0.3f} blue={2:0.3f}'.format(white[0], white[1], white[2]))
+		if self.last_white is not None and self.deadband_delta_e > 0.0 and \
+			_white_delta_e(white, self.last_white) < self.deadband_delta_e:
+			log.info('White point change within deadband.  No monitor gamma adjustment made.')
+			self.skipped_updates += 1
+			Metrics.registry.inc('updates_skipped_total')
+			return None
+		return (temp, white)
+
+	def apply(self, temp, white):
+		"""Update monitor gamma to the white point computed for a temperature."""
+		with Metrics.registry.time('adjust_white_point_seconds'):
+			self.gamma.adjust_white_point(white)
+		if self.publisher is not None:
+			self.publisher.publish(temp, white)
+		self.last_temp = temp
+		self.last_white = white
+		self.applied_updates += 1
+		Metrics.registry.inc('updates_applied_total')
+		Metrics.registry.set('applied_temp_kelvin', temp)
 
 	def update(self):
 		"""Query color sensor hardware and update monitor color temperature."""
-		# First measure the color from the sensor.
+		started = time.time()
+		measured = white = None
 		try:
-			measured = self.hardware.get_color()
-			log.info('Read color from hardware: red={0:0.3f} green={1:0.3f} blue={2:0.3f}'.format(measured[0], measured[1], measured[2]))
-			# Compute temperature of measured color.
-			temp = _rgb_to_temp(measured[0], measured[1], measured[2])
-			print('Measured color temperature: {0:,.0f} kelvin'.format(temp))
-			# Adjust monitor color temperature if within range of allowed temps.
-			if 1667.0 <= temp and temp <= 25000.0:
-				white = _temp_to_white(temp)
-				log.info('Computed white point: red={0:0.3f} green={1:0.3f} blue={2:0.3f}'.format(white[0], white[1], white[2]))
-				self.gamma.adjust_white_point(white)
-			else:
-				log.warning('Measured color temperature outside bounds of allowed temperatures.  No monitor gamma adjustment made.')
+			with Metrics.registry.time('update_seconds'):
+				measured = self.sample()
+				if measured is None:
+					return
+				self.measured_temp = None
+				result = self.process(measured)
+				if result is not None:
+					self.apply(*result)
+					white = result[1]
 		except ZeroDivisionError:
 			# Handle in some rare cases a divide by zero. Ignore the update and try
 			# again with the next update opportunity.
 			log.warning('Divide by zero while updating color temp.  Waiting for next update to try again.')
+			Metrics.registry.inc('updates_failed_total')
+		except Exception:
+			Metrics.registry.inc('updates_failed_total')
+			raise
+		finally:
+			if self.recorder is not None and measured is not None:
+				color = _counts_to_color(measured) if self.sensor_matrix is not None else measured
+				self.recorder.record(started, color, getattr(self.hardware, 'last_counts', None),
+					self.measured_temp, white, time.time() - started)
 
 	def close(self):
 		"""Restore gamma to original value and close hardware connection."""
+		log.info('Applied {0} gamma updates and skipped {1}.'.format(self.applied_updates, self.skipped_updates))
 		log.info('Restoring gamma.')
 		self.gamma.restore()
-		log.info('Closing hardware connection.')
-		self.hardware.close()
+		# Gamma adjustment objects that aren't backends may have nothing to close.
+		close = getattr(self.gamma, 'close', None)
+		if close is not None:
+			close()
+		if self.hardware is not None:
+			log.info('Closing hardware connection.')
+			self.hardware.close()
+		if self.recorder is not None:
+			self.recorder.close()
+		if self.publisher is not None:
+			self.publisher.close()
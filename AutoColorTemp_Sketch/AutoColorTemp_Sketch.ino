@@ -2,37 +2,97 @@
 // Arduino Sketch
 // Copyright 2014 Tony DiCola (tony@tonydicola.com)
 // Released under an MIT license (http://opensource.org/licenses/MIT)
+//
+// Serial commands:
+//   ?  Send one reading as a comma separated line of red, green, blue values
+//      divided by the clear channel.
+//   c  Send one reading as a binary frame with raw counts.
+//   s  Start streaming readings as text lines, one per integration cycle.
+//   b  Start streaming readings as binary frames, one per integration cycle.
+//   x  Stop streaming.
+//
+// Binary frames are 13 bytes: sync bytes 0xA5 0x5A, then a 16-bit sequence
+// number and raw 16-bit red, green, blue, and clear counts (all little endian),
+// then an XOR checksum of the 10 bytes after the sync bytes.
 
 #include <Wire.h>
 #include "Adafruit_TCS34725.h"
 
+#define STREAM_OFF    0
+#define STREAM_TEXT   1
+#define STREAM_BINARY 2
+
 // Configure color sensor for longer (more accurate) integration time with low gain.
 Adafruit_TCS34725 tcs = Adafruit_TCS34725(TCS34725_INTEGRATIONTIME_700MS, TCS34725_GAIN_1X);
 
+uint8_t streamMode = STREAM_OFF;
+uint16_t sequence = 0;
+
 void setup(void) {
   // Initialize serial connection and color sensor.
   Serial.begin(115200);
   tcs.begin();
 }
 
+void sendText(uint16_t r, uint16_t g, uint16_t b, uint16_t c) {
+  float red = r/float(c);
+  float green = g/float(c);
+  float blue = b/float(c);
+  // Send reading as a comma separated line.
+  Serial.print(red, 5);
+  Serial.print(",");
+  Serial.print(green, 5);
+  Serial.print(",");
+  Serial.println(blue, 5);
+}
+
+void sendBinary(uint16_t r, uint16_t g, uint16_t b, uint16_t c) {
+  uint8_t frame[13];
+  uint16_t values[5] = { sequence++, r, g, b, c };
+  frame[0] = 0xA5;
+  frame[1] = 0x5A;
+  uint8_t checksum = 0;
+  for (int i = 0; i < 5; ++i) {
+    frame[2 + i*2] = values[i] & 0xFF;
+    frame[3 + i*2] = values[i] >> 8;
+    checksum ^= frame[2 + i*2] ^ frame[3 + i*2];
+  }
+  frame[12] = checksum;
+  Serial.write(frame, sizeof(frame));
+}
+
 void loop(void) {
-  // Wait for a command to be sent on the serial port.
+  uint16_t r, g, b, c;
+  // Handle any command sent on the serial port.
   if (Serial.available() > 0) {
     char command = Serial.read();
     if (command == '?') {
       // Take a light reading and send it to the PC.
-      uint16_t r, g, b, c;
       tcs.getRawData(&r, &g, &b, &c);
-      float red = r/float(c);
-      float green = g/float(c);
-      float blue = b/float(c);
-      // Send reading as a comma separated line.
-      Serial.print(red, 5);
-      Serial.print(",");
-      Serial.print(green, 5);
-      Serial.print(",");
-      Serial.println(blue, 5);
-    } 
+      sendText(r, g, b, c);
+    }
+    else if (command == 'c') {
+      tcs.getRawData(&r, &g, &b, &c);
+      sendBinary(r, g, b, c);
+    }
+    else if (command == 's') {
+      streamMode = STREAM_TEXT;
+    }
+    else if (command == 'b') {
+      streamMode = STREAM_BINARY;
+    }
+    else if (command == 'x') {
+      streamMode = STREAM_OFF;
+    }
+  }
+  // Push a reading every integration cycle while streaming.  getRawData waits
+  // for the integration to finish, so no extra delay is needed.
+  if (streamMode == STREAM_TEXT) {
+    tcs.getRawData(&r, &g, &b, &c);
+    sendText(r, g, b, c);
+  }
+  else if (streamMode == STREAM_BINARY) {
+    tcs.getRawData(&r, &g, &b, &c);
+    sendBinary(r, g, b, c);
   }
-  delay(10);
 }
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import struct
+
+import numpy
+
+
+log = logging.getLogger(__name__)
+
+# ICC profile reference:
+#  http://www.color.org/specification/ICC1v43_2010-12.pdf
+# The vcgt (video card gamma table) tag is an Apple private tag:
+#  https://developer.apple.com/library/archive/technotes/tn2035/_index.html
+ICC_HEADER_SIZE = 128
+VCGT_TABLE = 0
+VCGT_FORMULA = 1
+
+
+class Calibration(object):
+	"""Measured response correction of a display, as a curve for each of the red,
+	green, and blue channels mapping a wanted output level (0-1.0, evenly spaced
+	along the curve) to the level to send to the display.  Curves can have any
+	number of points and are resampled to the gamma ramp size as needed."""
+
+	def __init__(self, red, green, blue, name=None):
+		if len(set(len(c) for c in (red, green, blue))) != 1:
+			raise ValueError('Calibration curves must all have the same number of points.')
+		if len(red) < 2:
+			raise ValueError('Calibration curves must have at least 2 points each.')
+		self.curves = numpy.clip(numpy.array([red, green, blue], dtype=float), 0.0, 1.0)
+		self.name = name
+		# Identifies the curves in ramp cache keys.
+		self.key = hashlib.sha1(self.curves.tobytes()).hexdigest()
+		self._positions = numpy.linspace(0.0, 1.0, self.curves.shape[1])
+
+	def apply(self, channel, levels):
+		"""Return array of corrected levels for an array of wanted levels (0-1.0) of
+		a channel (0 red, 1 green, 2 blue)."""
+		return numpy.interp(levels, self._positions, self.curves[channel])
+
+
+def load_lut(path):
+	"""Load calibration from a text file with one line of red, green, and blue
+	values (separated by spaces or commas) per point, from black to white.
+	Values are 0-1.0, or 0-65535 if any value is above 1.  Lines starting with
+	# are ignored."""
+	rows = []
+	with open(path) as f:
+		for line in f:
+			line = line.split('#', 1)[0].strip()
+			if not line:
+				continue
+			values = line.replace(',', ' ').split()
+			if len(values) != 3:
+				raise ValueError('Expected red, green, and blue values in {0}: {1}'.format(path, line))
+			rows.append([float(v) for v in values])
+	table = numpy.array(rows, dtype=float).reshape(-1, 3)
+	if table.size and table.max() > 1.0:
+		table /= 65535.0
+	return Calibration(table[:, 0], table[:, 1], table[:, 2], os.path.basename(path))
+
+
+def _s15fixed16(data, offset):
+	return struct.unpack_from('>i', data, offset)[0] / 65536.0
+
+
+def load_icc(path, points=256):
+	"""Load calibration from the vcgt tag of an ICC profile.  Formula based tags
+	are sampled at the given number of points."""
+	with open(path, 'rb') as f:
+		data = f.read()
+	if len(data) < ICC_HEADER_SIZE + 4 or data[36:40] != b'acsp':
+		raise ValueError('{0} is not an ICC profile.'.format(path))
+	count = struct.unpack_from('>I', data, ICC_HEADER_SIZE)[0]
+	if len(data) < ICC_HEADER_SIZE + 4 + 12*count:
+		raise ValueError('Truncated tag table in {0}.'.format(path))
+	for i in range(count):
+		signature, offset, size = struct.unpack_from('>4sII', data, ICC_HEADER_SIZE + 4 + 12*i)
+		if signature == b'vcgt':
+			break
+	else:
+		raise ValueError('{0} has no vcgt calibration tag.'.format(path))
+	# Type, reserved, and kind fields come before the table or formula.
+	if size < 12 or offset + size > len(data) or data[offset:offset + 4] != b'vcgt':
+		raise ValueError('Bad vcgt tag in {0}.'.format(path))
+	end = offset + size
+	kind = struct.unpack_from('>I', data, offset + 8)[0]
+	name = os.path.basename(path)
+	if kind == VCGT_TABLE:
+		if offset + 18 > end:
+			raise ValueError('Bad vcgt tag in {0}.'.format(path))
+		channels, entries, entry_size = struct.unpack_from('>HHH', data, offset + 12)
+		if channels not in (1, 3) or entry_size not in (1, 2):
+			raise ValueError('Unsupported vcgt table in {0}.'.format(path))
+		if offset + 18 + channels*entries*entry_size > end:
+			raise ValueError('Bad vcgt tag in {0}.'.format(path))
+		dtype = '>u2' if entry_size == 2 else 'u1'
+		table = numpy.frombuffer(data, dtype=dtype, count=channels*entries, offset=offset + 18)
+		table = table.reshape(channels, entries) / float(2**(8*entry_size) - 1)
+		if channels == 1:
+			table = numpy.repeat(table, 3, axis=0)
+		return Calibration(table[0], table[1], table[2], name)
+	if kind == VCGT_FORMULA:
+		if offset + 12 + 36 > end:
+			raise ValueError('Bad vcgt tag in {0}.'.format(path))
+		x = numpy.linspace(0.0, 1.0, points)
+		curves = []
+		for c in range(3):
+			base = offset + 12 + 12*c
+			gamma, low, high = [_s15fixed16(data, base + 4*i) for i in range(3)]
+			curves.append(low + (high - low) * numpy.power(x, gamma))
+		return Calibration(curves[0], curves[1], curves[2], name)
+	raise ValueError('Unknown vcgt type {0} in {1}.'.format(kind, path))
+
+
+def load(path):
+	"""Load calibration from an ICC profile (.icc or .icm) or a LUT text file."""
+	if os.path.splitext(path)[1].lower() in ('.icc', '.icm'):
+		return load_icc(path)
+	return load_lut(path)
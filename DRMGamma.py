@@ -0,0 +1,336 @@
+from ctypes import *
+import fcntl
+import glob
+import logging
+import os
+
+import numpy
+
+from GammaBackend import GammaBackend
+from GammaRamp import GammaRamp
+
+
+log = logging.getLogger(__name__)
+
+# DRM/KMS references:
+#  https://www.kernel.org/doc/html/latest/gpu/drm-uapi.html
+#  https://www.kernel.org/doc/html/latest/gpu/drm-kms.html#color-management-properties
+#  include/uapi/drm/drm.h and include/uapi/drm/drm_mode.h in the kernel source
+
+DRM_CLIENT_CAP_ATOMIC = 3
+DRM_MODE_OBJECT_CRTC = 0xcccccccc
+
+
+class drm_set_client_cap(Structure):
+	_fields_ = [('capability', c_uint64),
+				('value', c_uint64)]
+
+class drm_mode_card_res(Structure):
+	_fields_ = [('fb_id_ptr', c_uint64),
+				('crtc_id_ptr', c_uint64),
+				('connector_id_ptr', c_uint64),
+				('encoder_id_ptr', c_uint64),
+				('count_fbs', c_uint32),
+				('count_crtcs', c_uint32),
+				('count_connectors', c_uint32),
+				('count_encoders', c_uint32),
+				('min_width', c_uint32),
+				('max_width', c_uint32),
+				('min_height', c_uint32),
+				('max_height', c_uint32)]
+
+class drm_mode_modeinfo(Structure):
+	_fields_ = [('clock', c_uint32),
+				('hdisplay', c_uint16),
+				('hsync_start', c_uint16),
+				('hsync_end', c_uint16),
+				('htotal', c_uint16),
+				('hskew', c_uint16),
+				('vdisplay', c_uint16),
+				('vsync_start', c_uint16),
+				('vsync_end', c_uint16),
+				('vtotal', c_uint16),
+				('vscan', c_uint16),
+				('vrefresh', c_uint32),
+				('flags', c_uint32),
+				('type', c_uint32),
+				('name', c_char * 32)]
+
+class drm_mode_crtc(Structure):
+	_fields_ = [('set_connectors_ptr', c_uint64),
+				('count_connectors', c_uint32),
+				('crtc_id', c_uint32),
+				('fb_id', c_uint32),
+				('x', c_uint32),
+				('y', c_uint32),
+				('gamma_size', c_uint32),
+				('mode_valid', c_uint32),
+				('mode', drm_mode_modeinfo)]
+
+class drm_mode_crtc_lut(Structure):
+	_fields_ = [('crtc_id', c_uint32),
+				('gamma_size', c_uint32),
+				('red', c_uint64),
+				('green', c_uint64),
+				('blue', c_uint64)]
+
+class drm_mode_get_property(Structure):
+	_fields_ = [('values_ptr', c_uint64),
+				('enum_blob_ptr', c_uint64),
+				('prop_id', c_uint32),
+				('flags', c_uint32),
+				('name', c_char * 32),
+				('count_values', c_uint32),
+				('count_enum_blobs', c_uint32)]
+
+class drm_mode_get_blob(Structure):
+	_fields_ = [('blob_id', c_uint32),
+				('length', c_uint32),
+				('data', c_uint64)]
+
+class drm_mode_atomic(Structure):
+	_fields_ = [('flags', c_uint32),
+				('count_objs', c_uint32),
+				('objs_ptr', c_uint64),
+				('count_props_ptr', c_uint64),
+				('props_ptr', c_uint64),
+				('prop_values_ptr', c_uint64),
+				('reserved', c_uint64),
+				('user_data', c_uint64)]
+
+class drm_mode_create_blob(Structure):
+	_fields_ = [('data', c_uint64),
+				('length', c_uint32),
+				('blob_id', c_uint32)]
+
+class drm_mode_destroy_blob(Structure):
+	_fields_ = [('blob_id', c_uint32)]
+
+class drm_mode_obj_get_properties(Structure):
+	_fields_ = [('props_ptr', c_uint64),
+				('prop_values_ptr', c_uint64),
+				('count_props', c_uint32),
+				('obj_id', c_uint32),
+				('obj_type', c_uint32)]
+
+
+def _ioc(direction, nr, struct):
+	return (direction << 30) | (sizeof(struct) << 16) | (ord('d') << 8) | nr
+
+def _iow(nr, struct):
+	return _ioc(1, nr, struct)
+
+def _iowr(nr, struct):
+	return _ioc(3, nr, struct)
+
+DRM_IOCTL_SET_CLIENT_CAP = _iow(0x0d, drm_set_client_cap)
+DRM_IOCTL_MODE_GETRESOURCES = _iowr(0xa0, drm_mode_card_res)
+DRM_IOCTL_MODE_GETCRTC = _iowr(0xa1, drm_mode_crtc)
+DRM_IOCTL_MODE_GETGAMMA = _iowr(0xa4, drm_mode_crtc_lut)
+DRM_IOCTL_MODE_SETGAMMA = _iowr(0xa5, drm_mode_crtc_lut)
+DRM_IOCTL_MODE_GETPROPERTY = _iowr(0xaa, drm_mode_get_property)
+DRM_IOCTL_MODE_GETPROPBLOB = _iowr(0xac, drm_mode_get_blob)
+DRM_IOCTL_MODE_OBJ_GETPROPERTIES = _iowr(0xb9, drm_mode_obj_get_properties)
+DRM_IOCTL_MODE_ATOMIC = _iowr(0xbc, drm_mode_atomic)
+DRM_IOCTL_MODE_CREATEPROPBLOB = _iowr(0xbd, drm_mode_create_blob)
+DRM_IOCTL_MODE_DESTROYPROPBLOB = _iowr(0xbe, drm_mode_destroy_blob)
+
+
+def find_device():
+	"""Return path of the first DRM card device."""
+	devices = sorted(glob.glob('/dev/dri/card*'))
+	if not devices:
+		raise RuntimeError('Could not find a DRM device in /dev/dri.')
+	return devices[0]
+
+
+def _address(array):
+	return addressof(array) if array is not None else 0
+
+
+class _AtomicCrtc(object):
+	"""Gamma of one CRTC set through its GAMMA_LUT property."""
+
+	def __init__(self, drm, crtc, lut_property, lut_size, old_blob):
+		self.drm = drm
+		self.crtc = crtc
+		self.name = 'crtc-{0}'.format(crtc)
+		self.lut_property = lut_property
+		self.ramp_size = lut_size
+		# Copy of the LUT set at startup, or None if the CRTC had no LUT.
+		self.old_lut = drm._read_blob(old_blob) if old_blob else None
+
+	def blob(self, ramp):
+		"""Return ID of a new property blob holding ramp as an array of
+		drm_color_lut entries (red, green, blue, and reserved shorts)."""
+		lut = numpy.zeros((ramp.size, 4), dtype=numpy.uint16)
+		lut[:, 0:3] = ramp.array.T
+		return self.drm._create_blob(lut.tobytes())
+
+	def old_blob(self):
+		"""Return ID of a new blob holding the startup LUT, or 0 for no LUT."""
+		return self.drm._create_blob(self.old_lut) if self.old_lut is not None else 0
+
+
+class _LegacyCrtc(object):
+	"""Gamma of one CRTC set with the legacy SETGAMMA ioctl."""
+
+	def __init__(self, drm, crtc, ramp_size):
+		self.drm = drm
+		self.crtc = crtc
+		self.name = 'crtc-{0}'.format(crtc)
+		self.ramp_size = ramp_size
+		# Save current gamma ramps.
+		self.old_ramp = GammaRamp(ramp_size)
+		drm._lut(DRM_IOCTL_MODE_GETGAMMA, crtc, self.old_ramp)
+
+	def set_ramp(self, ramp):
+		self.drm._lut(DRM_IOCTL_MODE_SETGAMMA, self.crtc, ramp)
+
+	def restore(self):
+		self.set_ramp(self.old_ramp)
+
+
+class DRMGamma(GammaBackend):
+	"""Adjust color temperature of all displays driven by a DRM/KMS device, for
+	Linux without an X server.  Each active CRTC is adjusted separately.  Where
+	the driver supports atomic modesetting all CRTCs are updated in one commit
+	through their GAMMA_LUT property, otherwise the legacy per-CRTC gamma ioctl
+	is used.  Setting gamma needs DRM master, so this only works when no display
+	server owns the device.
+
+	Ioctl is called as ioctl(fd, request, structure) and defaults to fcntl.ioctl,
+	it can be replaced along with fd to test without a GPU."""
+
+	name = 'drm'
+	per_output = True
+
+	def __init__(self, device=None, atomic=True, ioctl=None, fd=None):
+		super(DRMGamma, self).__init__()
+		self.ioctl = ioctl if ioctl is not None else fcntl.ioctl
+		self.device = device if device is not None else find_device()
+		self._close_fd = fd is None
+		self.fd = os.open(self.device, os.O_RDWR | getattr(os, 'O_CLOEXEC', 0)) if fd is None else fd
+		self.atomic = False
+		try:
+			crtcs = self._active_crtcs()
+			if atomic:
+				self.atomic = self._find_atomic_crtcs(crtcs)
+			if not self.atomic:
+				self._find_legacy_crtcs(crtcs)
+		except (IOError, OSError) as e:
+			self.close()
+			raise RuntimeError('Could not read DRM gamma from {0}: {1}'.format(self.device, e))
+		if not self.outputs:
+			self.close()
+			raise RuntimeError('Could not find a CRTC with adjustable gamma on {0}.'.format(self.device))
+		for output in self.outputs:
+			log.info('Found {0} with gamma ramp size {1}{2}'.format(output.name, output.ramp_size,
+				' (atomic)' if self.atomic else ''))
+
+	def _call(self, request, structure):
+		self.ioctl(self.fd, request, structure)
+		return structure
+
+	def _active_crtcs(self):
+		"""Return list of IDs and legacy gamma sizes of CRTCs with a mode set."""
+		res = self._call(DRM_IOCTL_MODE_GETRESOURCES, drm_mode_card_res())
+		ids = (c_uint32 * res.count_crtcs)()
+		res = self._call(DRM_IOCTL_MODE_GETRESOURCES, drm_mode_card_res(crtc_id_ptr=_address(ids),
+			count_crtcs=res.count_crtcs))
+		crtcs = []
+		for crtc in ids[:res.count_crtcs]:
+			info = self._call(DRM_IOCTL_MODE_GETCRTC, drm_mode_crtc(crtc_id=crtc))
+			if info.mode_valid:
+				crtcs.append((crtc, info.gamma_size))
+		return crtcs
+
+	def _properties(self, crtc):
+		"""Return dict of property name to (property ID, value) of a CRTC."""
+		query = drm_mode_obj_get_properties(obj_id=crtc, obj_type=DRM_MODE_OBJECT_CRTC)
+		count = self._call(DRM_IOCTL_MODE_OBJ_GETPROPERTIES, query).count_props
+		ids = (c_uint32 * count)()
+		values = (c_uint64 * count)()
+		self._call(DRM_IOCTL_MODE_OBJ_GETPROPERTIES, drm_mode_obj_get_properties(props_ptr=_address(ids),
+			prop_values_ptr=_address(values), count_props=count, obj_id=crtc, obj_type=DRM_MODE_OBJECT_CRTC))
+		properties = {}
+		for prop, value in zip(ids, values):
+			info = self._call(DRM_IOCTL_MODE_GETPROPERTY, drm_mode_get_property(prop_id=prop))
+			properties[info.name.decode('ascii', 'replace')] = (prop, value)
+		return properties
+
+	def _find_atomic_crtcs(self, crtcs):
+		"""Add an atomic output for each CRTC with a GAMMA_LUT property.  Returns
+		False if the driver doesn't support atomic gamma updates."""
+		try:
+			self._call(DRM_IOCTL_SET_CLIENT_CAP, drm_set_client_cap(DRM_CLIENT_CAP_ATOMIC, 1))
+		except (IOError, OSError):
+			log.info('DRM atomic modesetting not available, falling back to legacy gamma.')
+			return False
+		outputs = []
+		for crtc, _ in crtcs:
+			properties = self._properties(crtc)
+			if 'GAMMA_LUT' not in properties or 'GAMMA_LUT_SIZE' not in properties:
+				return False
+			lut_property, old_blob = properties['GAMMA_LUT']
+			outputs.append(_AtomicCrtc(self, crtc, lut_property, properties['GAMMA_LUT_SIZE'][1], old_blob))
+		self.outputs = outputs
+		return True
+
+	def _find_legacy_crtcs(self, crtcs):
+		"""Add a legacy output for each CRTC with a gamma ramp."""
+		self.outputs = [_LegacyCrtc(self, crtc, size) for crtc, size in crtcs if size > 0]
+
+	def _lut(self, request, crtc, ramp):
+		self._call(request, drm_mode_crtc_lut(crtc, ramp.size,
+			addressof(ramp.red), addressof(ramp.green), addressof(ramp.blue)))
+
+	def _read_blob(self, blob):
+		"""Return contents of a property blob as bytes."""
+		length = self._call(DRM_IOCTL_MODE_GETPROPBLOB, drm_mode_get_blob(blob_id=blob)).length
+		data = create_string_buffer(length)
+		self._call(DRM_IOCTL_MODE_GETPROPBLOB, drm_mode_get_blob(blob, length, addressof(data)))
+		return data.raw
+
+	def _create_blob(self, data):
+		"""Return ID of a new property blob holding data (bytes)."""
+		buffer = create_string_buffer(data, len(data))
+		return self._call(DRM_IOCTL_MODE_CREATEPROPBLOB, drm_mode_create_blob(addressof(buffer), len(data))).blob_id
+
+	def _commit(self, updates):
+		"""Set GAMMA_LUT of each output to a blob, given a list of output and blob ID,
+		in one atomic commit.  The blobs are released afterwards, the CRTCs keep
+		their own references."""
+		count = len(updates)
+		objs = (c_uint32 * count)(*[output.crtc for output, _ in updates])
+		count_props = (c_uint32 * count)(*([1] * count))
+		props = (c_uint32 * count)(*[output.lut_property for output, _ in updates])
+		values = (c_uint64 * count)(*[blob for _, blob in updates])
+		try:
+			self._call(DRM_IOCTL_MODE_ATOMIC, drm_mode_atomic(count_objs=count, objs_ptr=addressof(objs),
+				count_props_ptr=addressof(count_props), props_ptr=addressof(props), prop_values_ptr=addressof(values)))
+		finally:
+			for _, blob in updates:
+				if blob:
+					self._call(DRM_IOCTL_MODE_DESTROYPROPBLOB, drm_mode_destroy_blob(blob))
+
+	def set_ramps(self, updates):
+		"""Set gamma ramps given a list of output and GammaRamp, in one atomic commit
+		when possible."""
+		if self.atomic:
+			self._commit([(output, output.blob(ramp)) for output, ramp in updates])
+		else:
+			super(DRMGamma, self).set_ramps(updates)
+
+	def restore(self, name=None):
+		"""Restore gamma back to original value, for all outputs or just the named one."""
+		if self.atomic:
+			self._commit([(output, output.old_blob()) for output in self.outputs if name is None or output.name == name])
+		else:
+			super(DRMGamma, self).restore(name)
+
+	def close(self):
+		"""Close the DRM device."""
+		if self._close_fd and self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
@@ -0,0 +1,251 @@
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+try:
+	import socketserver
+except ImportError:
+	import SocketServer as socketserver
+
+import Filters
+import Metrics
+
+
+log = logging.getLogger(__name__)
+
+
+def default_socket_path():
+	"""Return default path of the control socket, in the user's runtime directory."""
+	base = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+	return os.path.join(base, 'autocolortemp-{0}.sock'.format(os.getuid()))
+
+
+def send_command(command, path=None, timeout=5.0, **args):
+	"""Send a command with arguments to a running daemon's control socket and
+	return its response as a dict.  Raises RuntimeError if the daemon reports an
+	error."""
+	request = dict(args, command=command)
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	client.settimeout(timeout)
+	try:
+		client.connect(path if path is not None else default_socket_path())
+		client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+		response = client.makefile('rb').readline()
+	finally:
+		client.close()
+	if not response:
+		raise RuntimeError('No response from daemon.')
+	response = json.loads(response.decode('utf-8'))
+	if not response.get('ok'):
+		raise RuntimeError(response.get('error', 'Unknown error.'))
+	return response
+
+
+class _ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+
+class Daemon(object):
+	"""Run AutoColorTemp updates every delay seconds while serving a control API on
+	a Unix domain socket.  Clients send one JSON object per line with a command
+	name and its arguments, and get one JSON object back with ok set, plus either
+	the results or an error message.  Settings changed over the socket take effect
+	without reopening the sensor or gamma backend.
+
+	Commands:
+	  status                   current temperatures, white point, and settings
+	  metrics                  contents of the metrics registry
+	  pin kelvin               hold the display at a temperature, null to unpin
+	  delay seconds            change the time between updates
+	  filter name [size]       change the sensor reading filter ('none' for off)
+	  pause / resume           stop or restart updates, leaving the display as is
+	  update                   update now instead of waiting for the delay
+	  stop                     shut down the daemon"""
+
+	def __init__(self, main, delay, path=None, filter_name='none', filter_size=5):
+		self.main = main
+		self.delay = float(delay)
+		self.path = path if path is not None else default_socket_path()
+		self.paused = False
+		self.pinned = None
+		self.filter_name = filter_name
+		self.filter_size = filter_size
+		# The sensor is always read through a filter wrapper so the filter can be
+		# swapped at runtime.
+		if not isinstance(main.hardware, Filters.FilteredHardware):
+			main.hardware = Filters.FilteredHardware(main.hardware, Filters.create_filter(filter_name, filter_size))
+		self.server = None
+		self._stopping = False
+		# Serializes gamma changes from updates and from commands.
+		self._update_lock = threading.Lock()
+		# Wakes the update loop early when settings change.
+		self._wake = threading.Condition()
+		self._commands = {
+			'status': self._status,
+			'metrics': self._metrics,
+			'pin': self._pin,
+			'delay': self._set_delay,
+			'filter': self._set_filter,
+			'pause': self._pause,
+			'resume': self._resume,
+			'update': self._update,
+			'stop': self._stop,
+		}
+
+	def handle(self, request):
+		"""Run a command request (dict with command name and arguments) and return
+		the response dict."""
+		try:
+			args = dict(request)
+			command = self._commands.get(args.pop('command', None))
+			if command is None:
+				raise ValueError('Unknown command: {0}'.format(request.get('command')))
+			response = command(**args) or {}
+		except (ValueError, TypeError, RuntimeError) as e:
+			return {'ok': False, 'error': str(e)}
+		except Exception as e:
+			# Anything else is a bug, but report it rather than drop the connection.
+			log.exception('Error running command {0}'.format(request.get('command')))
+			return {'ok': False, 'error': 'Internal error: {0}'.format(e)}
+		response['ok'] = True
+		return response
+
+	def _status(self):
+		main = self.main
+		return {
+			'measured_temp': main.measured_temp,
+			'temp': main.last_temp,
+			'white': list(main.last_white) if main.last_white is not None else None,
+			'pinned': self.pinned,
+			'paused': self.paused,
+			# Only supervised hardware can tell if it's disconnected.
+			'connected': getattr(main.hardware, 'connected', True),
+			'delay': self.delay,
+			'filter': self.filter_name,
+			'filter_size': self.filter_size,
+			'applied_updates': main.applied_updates,
+			'skipped_updates': main.skipped_updates,
+		}
+
+	def _metrics(self):
+		return {'metrics': Metrics.registry.to_dict()}
+
+	def _pin(self, kelvin=None):
+		with self._update_lock:
+			if kelvin is not None:
+				kelvin = float(kelvin)
+				# Raises ValueError for temperatures outside the supported range.
+				white = self.main.white_table.white(kelvin)
+				self.main.apply(kelvin, white)
+				log.info('Pinned color temperature at {0:.0f} kelvin.'.format(kelvin))
+			self.pinned = kelvin
+		self._notify()
+
+	def _set_delay(self, seconds):
+		seconds = float(seconds)
+		if seconds <= 0.0:
+			raise ValueError('Delay must be greater than 0 seconds.')
+		self.delay = seconds
+		self._notify()
+
+	def _set_filter(self, name, size=None):
+		size = int(size) if size is not None else self.filter_size
+		self.main.hardware.filter = Filters.create_filter(name, size)
+		self.filter_name = name
+		self.filter_size = size
+
+	def _pause(self):
+		self.paused = True
+
+	def _resume(self):
+		self.paused = False
+		self._notify()
+
+	def _update(self):
+		self._notify()
+
+	def _stop(self):
+		self.stop()
+
+	def _notify(self):
+		with self._wake:
+			self._wake.notify_all()
+
+	def start(self):
+		"""Start serving the control socket from a background thread."""
+		daemon = self
+
+		class Handler(socketserver.StreamRequestHandler):
+			def handle(self):
+				for line in self.rfile:
+					try:
+						request = json.loads(line.decode('utf-8'))
+						if not isinstance(request, dict):
+							raise ValueError('Request must be a JSON object.')
+					except ValueError as e:
+						response = {'ok': False, 'error': 'Bad request: {0}'.format(e)}
+					else:
+						response = daemon.handle(request)
+					self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+		self._remove_stale_socket()
+		self.server = _ControlServer(self.path, Handler)
+		os.chmod(self.path, 0o600)
+		thread = threading.Thread(target=self.server.serve_forever, name='Daemon-control')
+		thread.daemon = True
+		thread.start()
+		log.info('Listening for commands on {0}'.format(self.path))
+
+	def _remove_stale_socket(self):
+		"""Remove a socket left behind by a daemon that didn't shut down cleanly, but
+		refuse to start if another daemon is still listening on it."""
+		if not os.path.exists(self.path):
+			return
+		client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			client.connect(self.path)
+		except socket.error as e:
+			if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+				raise
+			os.unlink(self.path)
+			return
+		finally:
+			client.close()
+		raise RuntimeError('Another daemon is already listening on {0}'.format(self.path))
+
+	def run(self):
+		"""Serve the control socket and update color temperature until stopped."""
+		if self.server is None:
+			self.start()
+		try:
+			while not self._stopping:
+				with self._update_lock:
+					if not self.paused and self.pinned is None:
+						try:
+							self.main.update()
+						except Exception as e:
+							# Keep serving and try again at the next update.
+							log.error('Error updating color temperature: {0}'.format(e))
+				with self._wake:
+					if not self._stopping:
+						self._wake.wait(self.delay)
+		finally:
+			self.close()
+
+	def stop(self):
+		"""Stop the update loop."""
+		self._stopping = True
+		self._notify()
+
+	def close(self):
+		"""Stop serving the control socket and remove it."""
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+			try:
+				os.unlink(self.path)
+			except OSError:
+				pass
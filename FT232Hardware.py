@@ -1,12 +1,19 @@
+import collections
+import logging
 import struct
 import time
 
 from mpsse import *
 
+
+log = logging.getLogger(__name__)
+
 # Constants for the TCS 34725 sensor ported from Adafruit library:
 #   https://github.com/adafruit/Adafruit_TCS34725
 TCS34725_ADDRESS          = 0x29
 TCS34725_COMMAND_BIT      = 0x80
+TCS34725_COMMAND_AUTO_INC = 0x20    # Auto-increment register address for block reads
+TCS34725_COMMAND_CLEAR_INT = 0x66   # Special function to clear the RGBC interrupt
 TCS34725_ENABLE           = 0x00
 TCS34725_ENABLE_AIEN      = 0x10    # RGBC Interrupt Enable
 TCS34725_ENABLE_WEN       = 0x08    # Wait enable - Writing 1 activates the wait timer
@@ -66,36 +73,156 @@ TCS34725_GAIN_4X                = 0x01 # 2x gain
 TCS34725_GAIN_16X               = 0x02 # 16x gain
 TCS34725_GAIN_60X               = 0x03 # 60x gain
 
+# Integration time register values with their duration in seconds and max count.
+INTEGRATION_TIMES = ((TCS34725_INTEGRATIONTIME_2_4MS, 0.0024, 1024),
+					 (TCS34725_INTEGRATIONTIME_24MS,  0.024,  10240),
+					 (TCS34725_INTEGRATIONTIME_50MS,  0.050,  20480),
+					 (TCS34725_INTEGRATIONTIME_101MS, 0.101,  43008),
+					 (TCS34725_INTEGRATIONTIME_154MS, 0.154,  65535),
+					 (TCS34725_INTEGRATIONTIME_700MS, 0.700,  65535))
+
+# Gain register values with their multiplier.
+GAINS = ((TCS34725_GAIN_1X, 1), (TCS34725_GAIN_4X, 4), (TCS34725_GAIN_16X, 16), (TCS34725_GAIN_60X, 60))
+GAIN_MULTIPLIERS = dict(GAINS)
+
+# Combination of integration time and gain settings.  Sensitivity is proportional
+# to the count measured for a given light level.
+SensorRange = collections.namedtuple('SensorRange', ['atime', 'duration', 'max_count', 'gain', 'sensitivity'])
+
+def _build_ranges():
+	"""Return list of sensor ranges sorted by increasing sensitivity, keeping only
+	the shortest integration time for each sensitivity."""
+	ranges = {}
+	for atime, duration, max_count in INTEGRATION_TIMES:
+		for gain, multiplier in GAINS:
+			sensitivity = round(duration * multiplier, 4)
+			if sensitivity not in ranges or duration < ranges[sensitivity].duration:
+				ranges[sensitivity] = SensorRange(atime, duration, max_count, gain, sensitivity)
+	return [ranges[sensitivity] for sensitivity in sorted(ranges)]
+
+SENSOR_RANGES = _build_ranges()
+
+# Default range of 700ms integration time and 1x gain.
+DEFAULT_RANGE = [r.atime == TCS34725_INTEGRATIONTIME_700MS and r.gain == TCS34725_GAIN_1X for r in SENSOR_RANGES].index(True)
+
 # Bus speed for I2C communication with sensor.
 # Arduino default is 100khz, but the sensor can support up to 400khz.
 I2C_BUS_HZ = 100000
+I2C_FAST_BUS_HZ = 400000
 
 
 class FT232Hardware(object):
-	"""Communicate with color sensor using FTDI FT232H or compatible hardware."""
+	"""Communicate with color sensor using FTDI FT232H or compatible hardware.
+	Set bus_hz to I2C_FAST_BUS_HZ to talk to the sensor at 400khz, and wait_valid
+	to start a new integration and wait for the sensor to report it completed
+	before each reading.
+
+	With auto_range set the integration time and gain are picked from
+	SENSOR_RANGES to use the shortest integration that keeps the clear channel
+	between the fractions of its max count given by range_band, and are changed
+	whenever a reading falls outside that band.
 
-	def __init__(self):
+	With threshold set the sensor's clear channel interrupt thresholds are
+	programmed to that fraction above and below each reading, and light_changed()
+	reports whether the light has since moved outside those thresholds for
+	persistence integration cycles.  The interrupt is checked by reading the
+	status register, since the FT232H has no interrupt line from the sensor."""
+
+	def __init__(self, bus_hz=I2C_BUS_HZ, wait_valid=False, timeout=2.0, auto_range=False, range_band=(0.1, 0.8),
+		threshold=None, persistence=TCS34725_PERS_3_CYCLE):
+		self.wait_valid = wait_valid
+		self.timeout = timeout
+		self.auto_range = auto_range
+		self.range_band = range_band
+		self.threshold = threshold
+		self.persistence = persistence
+		# Raw red, green, blue, and clear counts of the last reading, and the
+		# integration time and gain multiplier it was taken with.
+		self.last_counts = None
+		self.last_integration = None
 		# Manually calculate I2C read and write addresses for device.
 		# This is necessary because the MPSSE is a low level interface
 		# to the I2C bus so you need to do most of the I2C protocol manually.
 		self.write_addr = TCS34725_ADDRESS << 1
 		self.read_addr = self.write_addr + 1
 		# Initialize MPSSE for I2C communication.
-		self.mpsse = MPSSE(I2C, I2C_BUS_HZ, MSB)
+		self.mpsse = MPSSE(I2C, bus_hz, MSB)
 		# TODO: Support multiple devices and selecting one.
 		# Check communication by reading the ID of the chip.
 		chip_id = self._read8(TCS34725_ID)
 		if chip_id != 0x44:
 			raise RuntimeError('Unexpected chip ID: 0x{0:X}'.format(chip_id))
-		# Set integration time to max.
-		self._write8(TCS34725_ATIME, TCS34725_INTEGRATIONTIME_700MS)
-		# Set gain to 1x.
-		self._write8(TCS34725_CONTROL, TCS34725_GAIN_1X)
-		# Bring the chip out of low power mode and enable the color ADCs.
+		# Set integration time to max and gain to 1x, then bring the chip out of
+		# low power mode and enable the color ADCs.
+		self._set_range(DEFAULT_RANGE)
+
+	def _set_range(self, index):
+		"""Change integration time and gain to the specified entry of SENSOR_RANGES
+		and restart integration."""
+		self.range_index = index
+		self.range = SENSOR_RANGES[index]
+		self._write8(TCS34725_ATIME, self.range.atime)
+		self._write8(TCS34725_CONTROL, self.range.gain)
+		# Power on with the ADCs disabled, then enable them to start integrating.
+		# Thresholds are in counts of the old range so wait for the next reading
+		# to set them again.
+		self.armed = False
+		self._restart_integration()
+
+	def _restart_integration(self):
+		"""Disable and enable the color ADCs to start a new integration cycle.  This
+		also clears AVALID, which otherwise stays set once the first cycle
+		completes."""
+		enable = TCS34725_ENABLE_PON | TCS34725_ENABLE_AEN
+		if self.armed:
+			enable |= TCS34725_ENABLE_AIEN
 		self._write8(TCS34725_ENABLE, TCS34725_ENABLE_PON);
 		time.sleep(0.003)
-		self._write8(TCS34725_ENABLE, TCS34725_ENABLE_PON | TCS34725_ENABLE_AEN);
-		
+		self._write8(TCS34725_ENABLE, enable);
+
+	def _arm(self, c):
+		"""Set clear channel interrupt thresholds around clear count c and enable the
+		interrupt."""
+		low = max(0, int(c * (1.0 - self.threshold)))
+		high = min(0xFFFF, int(c * (1.0 + self.threshold)))
+		# Low and high thresholds are consecutive registers, set them together.
+		self._write_block(TCS34725_AILTL, struct.pack('<HH', low, high))
+		if not self.armed:
+			self._write8(TCS34725_PERS, self.persistence)
+			self._write8(TCS34725_ENABLE, TCS34725_ENABLE_PON | TCS34725_ENABLE_AEN | TCS34725_ENABLE_AIEN)
+		self._clear_interrupt()
+		self.armed = True
+
+	def _clear_interrupt(self):
+		"""Clear the clear channel interrupt flag."""
+		self.mpsse.Start()
+		self.mpsse.Write(struct.pack('BB', self.write_addr, TCS34725_COMMAND_BIT | TCS34725_COMMAND_CLEAR_INT))
+		self.mpsse.Stop()
+
+	def _choose_range(self, c):
+		"""Return index of the sensor range to use after reading clear count c with
+		the current range."""
+		low, high = self.range_band
+		if low*self.range.max_count <= c <= high*self.range.max_count:
+			return self.range_index
+		if c >= self.range.max_count:
+			# Saturated so the real level is unknown, go to the least sensitive
+			# range which is also the quickest to integrate.
+			return 0
+		if c == 0:
+			return len(SENSOR_RANGES) - 1
+		# Predict the count for each range and pick the shortest integration that
+		# lands in the band.  If none do, use the range that gets closest.
+		best = None
+		for i, r in enumerate(SENSOR_RANGES):
+			predicted = c * r.sensitivity / self.range.sensitivity
+			if low*r.max_count <= predicted <= high*r.max_count:
+				if best is None or r.duration < SENSOR_RANGES[best].duration:
+					best = i
+		if best is None:
+			best = 0 if c > high*self.range.max_count else len(SENSOR_RANGES) - 1
+		return best
+
 	def _write8(self, reg, val):
 		"""Write a byte to the specified color sensor register."""
 		if reg < 0 or reg > 127:
@@ -107,6 +234,15 @@ class FT232Hardware(object):
 		self.mpsse.Write(struct.pack('BBB', self.write_addr, TCS34725_COMMAND_BIT | reg, val))
 		self.mpsse.Stop()
 
+	def _write_block(self, reg, data):
+		"""Write bytes to consecutive color sensor registers starting at the specified
+		register, in one I2C transaction."""
+		if reg < 0 or reg + len(data) > 128:
+			raise ValueError('Registers must be between 0 and 127.')
+		self.mpsse.Start()
+		self.mpsse.Write(struct.pack('BB', self.write_addr, TCS34725_COMMAND_BIT | TCS34725_COMMAND_AUTO_INC | reg) + data)
+		self.mpsse.Stop()
+
 	def _read8(self, reg):
 		"""Read a byte from the specified color sensor register."""
 		if reg < 0 or reg > 127:
@@ -141,14 +277,102 @@ class FT232Hardware(object):
 		self.mpsse.Stop()
 		return struct.unpack('H', value)[0]
 
+	def _read_block(self, reg, count):
+		"""Read count bytes from consecutive color sensor registers starting at the
+		specified register, in one I2C transaction."""
+		if reg < 0 or reg + count > 128:
+			raise ValueError('Registers must be between 0 and 127.')
+		# Make I2C combined write and read with register auto-increment.
+		self.mpsse.SendAcks()
+		self.mpsse.Start()
+		self.mpsse.Write(struct.pack('BB', self.write_addr, TCS34725_COMMAND_BIT | TCS34725_COMMAND_AUTO_INC | reg))
+		self.mpsse.Start()
+		self.mpsse.Write(struct.pack('B', self.read_addr))
+		value = self.mpsse.Read(count)
+		# Make unacknowledged read to stop.
+		self.mpsse.SendNacks()
+		self.mpsse.Read(1)
+		self.mpsse.Stop()
+		return value
+
+	def _wait_for_valid(self):
+		"""Wait until the sensor reports a completed integration cycle, started by
+		_restart_integration."""
+		end = time.time() + self.timeout
+		while not self._read8(TCS34725_STATUS) & TCS34725_STATUS_AVALID:
+			if time.time() > end:
+				raise RuntimeError('Timed out waiting for color sensor integration.')
+			time.sleep(0.0024)
+
+	def _read_counts(self, wait_valid):
+		"""Return tuple of raw clear, red, green, and blue counts."""
+		if wait_valid:
+			self._wait_for_valid()
+		# Read clear, red, green, and blue data registers in one transaction.
+		return struct.unpack('<HHHH', self._read_block(TCS34725_CDATAL, 8))
+
+	@property
+	def integration(self):
+		"""Tuple of integration time in seconds and gain multiplier of the current
+		sensor range, used from the next reading.  See last_integration for the
+		range of the last reading."""
+		return (self.range.duration, GAIN_MULTIPLIERS[self.range.gain])
+
+	@property
+	def max_read_seconds(self):
+		"""Longest get_counts or get_color can take to return or raise.  Each wait for
+		a completed integration gives up after timeout seconds, and auto ranging
+		can read again up to 3 times."""
+		waits = 1 if self.wait_valid else 0
+		if self.auto_range:
+			waits += 3
+		return waits * self.timeout
+
+	def get_counts(self):
+		"""Return tuple of raw red, green, blue, and clear counts read from sensor."""
+		if self.wait_valid:
+			# Wait for a cycle that starts now, not one that finished a while ago.
+			self._restart_integration()
+		c, r, g, b = self._read_counts(self.wait_valid)
+		# Range the returned counts were taken with, auto ranging may change it.
+		read_range = self.range
+		if self.auto_range:
+			# Each pass either settles on the current range or moves to a new one,
+			# so a few passes are enough to find the right range.
+			for _ in range(3):
+				index = self._choose_range(c)
+				if index == self.range_index:
+					break
+				unusable = c == 0 or c >= self.range.max_count
+				self._set_range(index)
+				log.info('Changed sensor range to {0:.1f}ms integration with {1}x gain.'.format(
+					self.range.duration * 1000.0, GAIN_MULTIPLIERS[self.range.gain]))
+				if not unusable:
+					# Color ratios don't depend on range, so this reading is still
+					# good and the new range is used from the next reading.
+					break
+				c, r, g, b = self._read_counts(True)
+				read_range = self.range
+		if self.threshold is not None and read_range is self.range:
+			# Counts from the old range would arm the wrong thresholds, leave them
+			# for the next reading after a range change.
+			self._arm(c)
+		self.last_counts = (r, g, b, c)
+		self.last_integration = (read_range.duration, GAIN_MULTIPLIERS[read_range.gain])
+		return self.last_counts
+
 	def get_color(self):
 		"""Return tuple of RGB color (with float components, 0-1.0) read from sensor."""
-		c = self._read16(TCS34725_CDATAL);
-		r = self._read16(TCS34725_RDATAL);
-		g = self._read16(TCS34725_GDATAL);
-		b = self._read16(TCS34725_BDATAL);
+		r, g, b, c = self.get_counts()
 		return (float(r)/float(c), float(g)/float(c), float(b)/float(c))
 
+	def light_changed(self):
+		"""Return True if the light may have changed since the last reading.  Always
+		True unless threshold is set."""
+		if self.threshold is None or not self.armed:
+			return True
+		return bool(self._read8(TCS34725_STATUS) & TCS34725_STATUS_AINT)
+
 	def close(self):
 		"""Close the connection with the sensor hardware."""
 		self.mpsse.Close()
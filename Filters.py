@@ -0,0 +1,137 @@
+import bisect
+import collections
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class EMAFilter(object):
+	"""Exponential moving average of each color channel.  Alpha is the weight of
+	each new sample, between 0 and 1."""
+
+	def __init__(self, alpha=0.3):
+		self.alpha = alpha
+		self.value = None
+
+	def filter(self, color):
+		"""Add a color sample and return the filtered color."""
+		if self.value is None:
+			self.value = tuple(color)
+		else:
+			self.value = tuple(v + self.alpha*(c - v) for v, c in zip(self.value, color))
+		return self.value
+
+	def reset(self):
+		"""Forget all previous samples."""
+		self.value = None
+
+
+class MedianFilter(object):
+	"""Median of each color channel over the last size samples.  Samples are kept
+	in a ring buffer along with a sorted copy of each channel, so adding a sample
+	costs the same no matter how many have been seen."""
+
+	def __init__(self, size=5):
+		self.size = size
+		self.reset()
+
+	def filter(self, color):
+		"""Add a color sample and return the filtered color."""
+		if len(self.samples) == self.size:
+			oldest = self.samples[0]
+			for channel, value in zip(self.sorted, oldest):
+				del channel[bisect.bisect_left(channel, value)]
+		if self.sorted is None:
+			self.sorted = tuple([] for _ in color)
+		self.samples.append(tuple(color))
+		for channel, value in zip(self.sorted, color):
+			bisect.insort(channel, value)
+		middle = len(self.samples) // 2
+		if len(self.samples) % 2:
+			return tuple(channel[middle] for channel in self.sorted)
+		return tuple((channel[middle - 1] + channel[middle]) / 2.0 for channel in self.sorted)
+
+	def reset(self):
+		"""Forget all previous samples."""
+		self.samples = collections.deque(maxlen=self.size)
+		self.sorted = None
+
+
+class KalmanFilter(object):
+	"""One dimensional Kalman filter of each color channel, treating the true color
+	as a constant that drifts by process_variance between samples and is measured
+	with measurement_variance noise."""
+
+	def __init__(self, process_variance=1e-5, measurement_variance=1e-3):
+		self.process_variance = process_variance
+		self.measurement_variance = measurement_variance
+		self.reset()
+
+	def filter(self, color):
+		"""Add a color sample and return the filtered color."""
+		if self.value is None:
+			self.value = list(color)
+			self.error = [self.measurement_variance] * len(self.value)
+			return tuple(self.value)
+		for i, measured in enumerate(color):
+			# Predict, then correct with the new measurement.
+			error = self.error[i] + self.process_variance
+			gain = error / (error + self.measurement_variance)
+			self.value[i] += gain * (measured - self.value[i])
+			self.error[i] = (1.0 - gain) * error
+		return tuple(self.value)
+
+	def reset(self):
+		"""Forget all previous samples."""
+		self.value = None
+		self.error = None
+
+
+FILTERS = ('ema', 'median', 'kalman')
+
+def create_filter(name, size=5):
+	"""Create filter by name.  Size is the median window, or the number of samples
+	an EMA filter roughly averages over.  Returns None for name 'none'."""
+	if name == 'none':
+		return None
+	if name == 'ema':
+		return EMAFilter(2.0 / (size + 1.0))
+	if name == 'median':
+		return MedianFilter(size)
+	if name == 'kalman':
+		return KalmanFilter()
+	raise ValueError('Unknown filter: {0}'.format(name))
+
+
+class FilteredHardware(object):
+	"""Wrap color sensor hardware so each color, or raw counts, it returns are
+	passed through a filter first."""
+
+	def __init__(self, hardware, filter):
+		self.hardware = hardware
+		self.filter = filter
+
+	def __getattr__(self, name):
+		# Expose anything else the wrapped hardware provides.
+		if name == 'hardware':
+			raise AttributeError(name)
+		return getattr(self.hardware, name)
+
+	def get_color(self):
+		"""Return filtered tuple of RGB color (with float components, 0-1.0)."""
+		measured = self.hardware.get_color()
+		if self.filter is None or measured is None:
+			return measured
+		return self.filter.filter(measured)
+
+	def get_counts(self):
+		"""Return filtered tuple of red, green, blue, and clear counts."""
+		measured = self.hardware.get_counts()
+		if self.filter is None or measured is None:
+			return measured
+		return self.filter.filter(measured)
+
+	def close(self):
+		"""Close the connection with the sensor hardware."""
+		self.hardware.close()
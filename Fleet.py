@@ -0,0 +1,237 @@
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+# Updates are sent to this UDP multicast group and port unless another address
+# is given.  239.255.0.0/16 is the organization local multicast scope.  Also
+# given in the run.py help, which doesn't import this module.
+DEFAULT_GROUP = '239.255.67.84'
+DEFAULT_PORT = 4267
+
+# Each update is one datagram of magic bytes, random ID of the sending process,
+# sequence number, send time, color temperature, and RGB white point.
+MAGIC = b'ACT1'
+MESSAGE_FORMAT = '<4sIIdf3f'
+MESSAGE_SIZE = struct.calcsize(MESSAGE_FORMAT)
+
+
+def parse_address(address):
+	"""Parse 'HOST:PORT', 'HOST', or ':PORT' into a host and port tuple, using the
+	default group and port for missing parts."""
+	if address is None:
+		return (DEFAULT_GROUP, DEFAULT_PORT)
+	host, _, port = address.rpartition(':') if ':' in address else (address, None, None)
+	try:
+		port = int(port) if port else DEFAULT_PORT
+	except ValueError:
+		port = -1
+	if not 0 < port <= 65535:
+		raise ValueError('Bad address, expected HOST:PORT with a port of 1-65535: {0}'.format(address))
+	return (host or DEFAULT_GROUP, port)
+
+
+def _is_multicast(host):
+	try:
+		return 224 <= int(host.split('.')[0]) <= 239
+	except ValueError:
+		return False
+
+
+def pack(sender, sequence, timestamp, temp, white):
+	"""Return datagram bytes of an update."""
+	return struct.pack(MESSAGE_FORMAT, MAGIC, sender, sequence, timestamp, temp, white[0], white[1], white[2])
+
+
+def unpack(data):
+	"""Return tuple of sender, sequence, time, temperature, and white point of an
+	update datagram, or None if it isn't one."""
+	if len(data) != MESSAGE_SIZE or not data.startswith(MAGIC):
+		return None
+	_, sender, sequence, timestamp, temp, r, g, b = struct.unpack(MESSAGE_FORMAT, data)
+	return (sender, sequence, timestamp, temp, (r, g, b))
+
+
+class Publisher(object):
+	"""Broadcast color temperature updates from the host that owns the sensor.
+	Updates are coalesced so at most one is sent every min_interval seconds, a
+	burst of readings only sends the newest.  The last update is sent again every
+	heartbeat seconds so subscribers that start later, or lost a datagram, catch
+	up."""
+
+	def __init__(self, address=(DEFAULT_GROUP, DEFAULT_PORT), min_interval=0.5, heartbeat=10.0, ttl=1):
+		self.address = address
+		self.min_interval = min_interval
+		self.heartbeat = heartbeat
+		self.sender = random.getrandbits(32)
+		self.sequence = 0
+		self.sent = 0
+		self.coalesced = 0
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		if _is_multicast(address[0]):
+			self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+			self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+		self._condition = threading.Condition()
+		self._pending = None
+		self._last = None
+		self._last_time = 0.0
+		self._stopping = False
+		self._thread = threading.Thread(target=self._run, name='Fleet-publisher')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def publish(self, temp, white):
+		"""Queue an update of color temperature and white point to send."""
+		with self._condition:
+			if self._pending is not None:
+				self.coalesced += 1
+			self._pending = (float(temp), tuple(white))
+			self._condition.notify_all()
+
+	def _send(self, update):
+		self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+		try:
+			self.socket.sendto(pack(self.sender, self.sequence, time.time(), update[0], update[1]), self.address)
+			self.sent += 1
+		except (IOError, OSError) as e:
+			log.warning('Could not send update: {0}'.format(e))
+		self._last = update
+		self._last_time = time.time()
+
+	def _run(self):
+		with self._condition:
+			while not self._stopping:
+				since = time.time() - self._last_time
+				if self._pending is not None:
+					if since >= self.min_interval:
+						update, self._pending = self._pending, None
+						self._send(update)
+					else:
+						self._condition.wait(self.min_interval - since)
+				elif self._last is not None and self.heartbeat:
+					if since >= self.heartbeat:
+						self._send(self._last)
+					else:
+						self._condition.wait(self.heartbeat - since)
+				else:
+					self._condition.wait()
+
+	def close(self):
+		"""Send any pending update, then stop publishing."""
+		with self._condition:
+			if self._pending is not None:
+				update, self._pending = self._pending, None
+				self._send(update)
+			self._stopping = True
+			self._condition.notify_all()
+		self._thread.join()
+		self.socket.close()
+
+
+class Subscriber(object):
+	"""Apply color temperature updates from a Publisher to a gamma adjustment
+	object, for hosts without their own sensor.  Updates that arrive while one is
+	being applied are coalesced so only the newest is applied, and updates older
+	than the last applied one from the same publisher are ignored.  Updates with
+	the same temperature and white point as the last applied one, like the
+	publisher's heartbeats, are not applied again."""
+
+	def __init__(self, gamma, address=(DEFAULT_GROUP, DEFAULT_PORT), timeout=0.5):
+		self.gamma = gamma
+		self.received = 0
+		self.applied = 0
+		self.coalesced = 0
+		self.stale = 0
+		self.unchanged = 0
+		self.timeout = timeout
+		self.temp = None
+		self.white = None
+		self._last = None
+		self._stopping = False
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		host, port = address
+		if _is_multicast(host):
+			self.socket.bind(('', port))
+			membership = struct.pack('4s4s', socket.inet_aton(host), socket.inet_aton('0.0.0.0'))
+			self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+		else:
+			self.socket.bind((host, port))
+		self.address = (host, self.socket.getsockname()[1])
+		self.socket.settimeout(timeout)
+
+	def _newer(self, update, previous):
+		"""Return True if update should replace the previous one."""
+		if previous is None or update[0] != previous[0]:
+			# First update, or from a new or restarted publisher.
+			return True
+		# Compare sequence numbers allowing for wraparound.
+		return 0 < ((update[1] - previous[1]) & 0xFFFFFFFF) < 0x80000000
+
+	def receive(self):
+		"""Wait for updates and return the newest, or None if none arrived before the
+		timeout."""
+		try:
+			data = self.socket.recv(MESSAGE_SIZE + 1)
+		except socket.timeout:
+			return None
+		newest = None
+		# Drain everything else already waiting without blocking.
+		self.socket.setblocking(False)
+		try:
+			while True:
+				update = unpack(data)
+				if update is None:
+					log.debug('Ignoring datagram that is not an update.')
+				elif not self._newer(update, newest if newest is not None else self._last):
+					self.stale += 1
+				else:
+					if newest is not None:
+						self.coalesced += 1
+					newest = update
+				self.received += 1
+				try:
+					data = self.socket.recv(MESSAGE_SIZE + 1)
+				except (IOError, OSError):
+					break
+		finally:
+			self.socket.settimeout(self.timeout)
+		return newest
+
+	def update(self):
+		"""Receive and apply the newest update.  Returns True if one was applied."""
+		update = self.receive()
+		if update is None:
+			return False
+		self._last = update
+		if update[3] == self.temp and update[4] == self.white:
+			self.unchanged += 1
+			return False
+		self.temp = update[3]
+		self.white = update[4]
+		log.info('Received color temperature {0:.0f} kelvin.'.format(self.temp))
+		self.gamma.adjust_white_point(self.white)
+		self.applied += 1
+		return True
+
+	def run(self):
+		"""Apply updates until stopped."""
+		while not self._stopping:
+			self.update()
+
+	def stop(self):
+		"""Stop after the current receive times out."""
+		self._stopping = True
+
+	def close(self):
+		"""Stop listening and restore gamma to original value."""
+		self.socket.close()
+		self.gamma.restore()
+		close = getattr(self.gamma, 'close', None)
+		if close is not None:
+			close()
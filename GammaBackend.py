@@ -0,0 +1,213 @@
+import importlib
+import logging
+import os
+import platform
+
+from GammaRamp import ramp_builder
+
+
+log = logging.getLogger(__name__)
+
+# Entry point group third party backends register under.  Each entry point
+# name is the backend name and its object is the GammaBackend subclass.
+ENTRY_POINT_GROUP = 'autocolortemp.gamma_backends'
+
+
+class GammaBackend(object):
+	"""Base class of gamma adjustment backends.
+
+	Class attributes describe what the backend can do:
+	  name            name the backend is registered under
+	  ramp_based      sets gamma ramps (lookup tables) through outputs
+	  formula_based   takes min, max, and gamma of each channel rather than ramps
+	  per_output      each display output can be set to its own white point
+	  calibrated      a Calibration can be fused into the ramps
+	  probe_cache     constructor takes a ProbeCache with cache=
+	  default_gamma   RGB gamma used unless set_gamma is called
+
+	Callers restore and then close a backend when they're done with it.
+
+	Ramp based backends fill self.outputs with objects that have name, ramp_size,
+	set_ramp(ramp), and restore() members.  The shared adjust_white_point then
+	builds each ramp with the shared RampBuilder and hands them all to
+	set_ramps, which backends can override to send them in one call.  Formula
+	based backends override adjust_white_point and restore instead."""
+
+	name = None
+	ramp_based = True
+	formula_based = False
+	per_output = False
+	calibrated = True
+	probe_cache = False
+	default_gamma = (1.0, 1.0, 1.0)
+
+	def __init__(self):
+		self.outputs = []
+		self.gamma = self.default_gamma
+		# Calibration of each output by name, None applies to all outputs.
+		self.calibrations = {}
+
+	@property
+	def ramp_sizes(self):
+		"""List of gamma ramp size of each output."""
+		return [output.ramp_size for output in self.outputs]
+
+	def set_gamma(self, gamma):
+		"""Change RGB gamma value used in computation of gamma ramp. Should be a tuple
+		of three values (one for each channel)."""
+		if len(gamma) != 3:
+			raise ValueError('Gamma must have a red, green, and blue value.')
+		self.gamma = tuple(float(g) for g in gamma)
+
+	def set_calibration(self, calibration, name=None):
+		"""Correct ramps of the named output, or all outputs without their own
+		calibration, with a Calibration.  A calibration of None removes it."""
+		if not self.calibrated:
+			raise RuntimeError('The {0} gamma backend does not support calibration.'.format(self.name))
+		if name is not None and name not in [output.name for output in self.outputs]:
+			raise ValueError('Unknown output: {0}'.format(name))
+		if calibration is None:
+			self.calibrations.pop(name, None)
+		else:
+			self.calibrations[name] = calibration
+
+	def calibration(self, output):
+		"""Return Calibration of an output, or None."""
+		return self.calibrations.get(output.name, self.calibrations.get(None))
+
+	def adjust_white_point(self, white):
+		"""Change the white point of the monitors to the specified value (tuple of
+		RGB floats, 0-1.0).  For backends with per_output set, white can also be a
+		dict of output name to white point tuple to adjust outputs separately,
+		outputs not in the dict are unchanged."""
+		# Build ramps for every output first.  Outputs with the same ramp size
+		# and white point share the same cached ramp.
+		updates = []
+		for output in self.outputs:
+			output_white = white.get(output.name) if isinstance(white, dict) else white
+			if output_white is not None:
+				updates.append((output, ramp_builder.build(output.ramp_size, output_white, self.gamma,
+					self.calibration(output))))
+		self.set_ramps(updates)
+
+	def set_ramps(self, updates):
+		"""Set gamma ramps given a list of output and GammaRamp."""
+		for output, ramp in updates:
+			output.set_ramp(ramp)
+		self.flush()
+
+	def restore(self, name=None):
+		"""Restore gamma back to original value, for all outputs or just the named one."""
+		for output in self.outputs:
+			if name is None or output.name == name:
+				output.restore()
+		self.flush()
+
+	def flush(self):
+		"""Send any buffered gamma changes to the display."""
+		pass
+
+	def close(self):
+		"""Release the display connection or device, after restore."""
+		pass
+
+
+class _Registration(object):
+	"""A registered backend, imported on first use."""
+
+	def __init__(self, name, target, platforms, priority, available):
+		self.name = name
+		self.target = target
+		self.platforms = platforms
+		self.priority = priority
+		self.available = available
+
+	def load(self):
+		if isinstance(self.target, str):
+			module, _, cls = self.target.partition(':')
+			self.target = getattr(importlib.import_module(module), cls)
+		elif hasattr(self.target, 'load') and not isinstance(self.target, type):
+			# Entry point.
+			self.target = self.target.load()
+		return self.target
+
+
+_registry = {}
+_entry_points_loaded = False
+
+
+def register(name, target, platforms=(), priority=0, available=None):
+	"""Register a backend.  Target is the GammaBackend subclass, or a 'module:Class'
+	string so the module (and the native libraries it loads) is only imported
+	when the backend is used.  The backend is picked automatically on the given
+	platform.system() values, highest priority first, when available (a function
+	returning True if it can work in this environment) says so."""
+	_registry[name] = _Registration(name, target, tuple(platforms), priority, available)
+
+
+def _load_entry_points():
+	"""Register backends published by installed packages under ENTRY_POINT_GROUP.
+	Only their names are read, each is imported when first used."""
+	global _entry_points_loaded
+	if _entry_points_loaded:
+		return
+	_entry_points_loaded = True
+	try:
+		from importlib import metadata
+	except ImportError:
+		return
+	try:
+		entry_points = metadata.entry_points()
+		if hasattr(entry_points, 'select'):
+			entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+		else:
+			entry_points = entry_points.get(ENTRY_POINT_GROUP, [])
+	except Exception as e:
+		log.warning('Could not read gamma backend entry points: {0}'.format(e))
+		return
+	for entry_point in entry_points:
+		if entry_point.name not in _registry:
+			register(entry_point.name, entry_point)
+
+
+def names():
+	"""Return sorted list of registered backend names, including installed plugins."""
+	_load_entry_points()
+	return sorted(_registry)
+
+
+def get(name):
+	"""Return the backend class registered under name, importing it if needed."""
+	registration = _registry.get(name)
+	if registration is None:
+		_load_entry_points()
+		registration = _registry.get(name)
+	if registration is None:
+		raise ValueError('Unknown gamma backend: {0}'.format(name))
+	return registration.load()
+
+
+def default_name(system=None):
+	"""Return name of the backend to use on a platform.system() value, by default
+	the current one."""
+	system = system if system is not None else platform.system()
+	log.info('Detected system as: {0}'.format(system))
+	candidates = [r for r in _registry.values() if system in r.platforms and (r.available is None or r.available())]
+	if not candidates:
+		raise RuntimeError('Could not find gamma adjustment for platform: {0}'.format(system))
+	return max(candidates, key=lambda r: r.priority).name
+
+
+def create(name=None, **kwargs):
+	"""Create the named backend, or the default for this platform, passing it the
+	keyword arguments."""
+	name = name if name is not None else default_name()
+	log.info('Using {0} gamma backend.'.format(name))
+	return get(name)(**kwargs)
+
+
+register('x11', 'X11Gamma:X11Gamma', ('Linux',), priority=10, available=lambda: bool(os.environ.get('DISPLAY')))
+register('drm', 'DRMGamma:DRMGamma', ('Linux',), priority=5)
+register('macosx', 'MacOSXGamma:MacOSXGamma', ('Darwin',))
+register('win32', 'Win32Gamma:Win32Gamma', ('Windows',))
+register('simulated', 'Simulated:SimulatedGamma')
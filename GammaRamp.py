@@ -0,0 +1,88 @@
+from ctypes import *
+import collections
+import logging
+
+import numpy
+
+import Metrics
+
+
+log = logging.getLogger(__name__)
+
+USHORT_MAX = 65535
+
+
+class GammaRamp(object):
+	"""Red, green, and blue gamma ramps stored back to back in one ctypes buffer
+	of unsigned shorts.  The buffer can be passed directly to APIs that take all
+	three ramps at once, and each channel is also available as its own ctypes
+	array view for APIs that take them separately."""
+
+	def __init__(self, size):
+		self.size = size
+		self.buffer = (c_ushort * (3 * size))()
+		channel = c_ushort * size
+		self.red = channel.from_buffer(self.buffer, 0)
+		self.green = channel.from_buffer(self.buffer, sizeof(channel))
+		self.blue = channel.from_buffer(self.buffer, 2 * sizeof(channel))
+		# NumPy view of the same memory, one row per channel.
+		self.array = numpy.frombuffer(self.buffer, dtype=numpy.uint16).reshape(3, size)
+
+
+class RampBuilder(object):
+	"""Build gamma ramps for a white point and per channel gamma.  The normalized
+	gamma curve for each ramp size and gamma is computed once, and finished ramps
+	are kept in a least recently used cache keyed by the white point quantized to
+	the given step.  A display's Calibration can be fused into the ramp so the
+	scaled gamma curve and the calibration are set in one driver call."""
+
+	def __init__(self, cache_size=64, quantum=1.0/4096.0):
+		self.cache_size = cache_size
+		self.quantum = quantum
+		self._curves = {}
+		self._ramps = collections.OrderedDict()
+
+	def curve(self, size, gamma):
+		"""Return array of size values following i/(size-1)^(1/gamma)."""
+		key = (size, float(gamma))
+		curve = self._curves.get(key)
+		if curve is None:
+			curve = numpy.power(numpy.arange(size) / float(size - 1), 1.0 / float(gamma))
+			self._curves[key] = curve
+		return curve
+
+	def build(self, size, white, gamma, calibration=None):
+		"""Return GammaRamp of the given size for the white point (tuple of RGB floats,
+		0-1.0) and gamma (tuple of three values, one for each channel), corrected by
+		calibration if given.  Returned ramps are shared with the cache and must not
+		be modified."""
+		levels = tuple(int(round(float(w) / self.quantum)) for w in white)
+		gamma = tuple(float(g) for g in gamma)
+		key = (size, gamma, levels, calibration.key if calibration is not None else None)
+		ramp = self._ramps.pop(key, None)
+		if ramp is None:
+			with Metrics.registry.time('ramp_build_seconds'):
+				ramp = GammaRamp(size)
+				for c in range(3):
+					values = self.curve(size, gamma[c]) * (levels[c] * self.quantum)
+					if calibration is not None:
+						values = calibration.apply(c, values)
+					# Assigning into the unsigned short view truncates like int().
+					ramp.array[c] = values * USHORT_MAX
+			Metrics.registry.inc('ramp_cache_misses_total')
+		else:
+			Metrics.registry.inc('ramp_cache_hits_total')
+		# Reinsert to mark as most recently used, then drop the oldest ramps.
+		self._ramps[key] = ramp
+		while len(self._ramps) > self.cache_size:
+			self._ramps.popitem(last=False)
+		return ramp
+
+	def clear(self):
+		"""Drop all cached curves and ramps."""
+		self._curves.clear()
+		self._ramps.clear()
+
+
+# Builder shared by all gamma backends.
+ramp_builder = RampBuilder()
@@ -2,6 +2,8 @@ from ctypes import *
 from ctypes.util import find_library
 import logging
 
+from GammaBackend import GammaBackend
+
 
 log = logging.getLogger(__name__)
 
@@ -10,21 +12,21 @@ log = logging.getLogger(__name__)
 quartz = CDLL(find_library('ApplicationServices'))
 
 
-class MacOSXGamma(object):
+class MacOSXGamma(GammaBackend):
 	"""Adjust color temperature of main display on MacOS X."""
 
+	name = 'macosx'
+	ramp_based = False
+	formula_based = True
+	calibrated = False
+	default_gamma = (1.8, 1.8, 1.8)
+
 	def __init__(self):
+		super(MacOSXGamma, self).__init__()
 		# Save the current display ID.
 		self.display = quartz.CGMainDisplayID()
 		log.info('CGMainDisplayID returned display ID: {0}'.format(self.display))
 		# TODO: Support multiple monitors.
-		# Default to gamma of 1.8.
-		self.gamma = (1.8, 1.8, 1.8)
-
-	def set_gamma(self, gamma):
-		"""Change RGB gamma value used in computation of gamma ramp. Should be a tuple
-		of three float values (one for each channel).  Default gamma is 1.8."""
-		self.gamma = gamma
 
 	def adjust_white_point(self, white):
 		"""Change the white point of the monitor to the specified value (tuple of 
@@ -47,6 +49,6 @@ class MacOSXGamma(object):
 		if result != 0:
 			raise RuntimeError('Error calling CGSetDisplayTransferByFormula with error code: {0}'.format(result))
 
-	def restore(self):
+	def restore(self, name=None):
 		"""Restore gamma back to original value."""
 		quartz.CGDisplayRestoreColorSyncSettings()
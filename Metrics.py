@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import threading
+import timeit
+
+
+log = logging.getLogger(__name__)
+
+PREFIX = 'autocolortemp_'
+
+# Python 2 has no os.replace, its os.rename replaces an existing file on POSIX.
+_replace = getattr(os, 'replace', os.rename)
+
+# Upper bounds in seconds of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Histogram(object):
+	"""Count of observed values in fixed buckets, with their total and count."""
+
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value):
+		"""Add an observed value."""
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				break
+		else:
+			i = len(self.buckets)
+		self.counts[i] += 1
+		self.count += 1
+		self.sum += value
+
+
+class _Timer(object):
+	"""Context manager which adds its elapsed time to a histogram."""
+
+	def __init__(self, histogram):
+		self.histogram = histogram
+
+	def __enter__(self):
+		self.start = timeit.default_timer()
+		return self
+
+	def __exit__(self, *exc):
+		self.histogram.observe(timeit.default_timer() - self.start)
+		return False
+
+
+class _NullTimer(object):
+	"""Context manager which does nothing, used while metrics are disabled."""
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry(object):
+	"""Named counters, gauges, and latency histograms.  Everything is a no-op until
+	enabled, so instrumented code costs little more than a method call when
+	metrics aren't wanted."""
+
+	def __init__(self, enabled=False):
+		self.enabled = enabled
+		self.counters = {}
+		self.gauges = {}
+		self.histograms = {}
+		self._lock = threading.Lock()
+
+	def time(self, name):
+		"""Return context manager timing the code it wraps into the named histogram."""
+		if not self.enabled:
+			return _NULL_TIMER
+		histogram = self.histograms.get(name)
+		if histogram is None:
+			with self._lock:
+				histogram = self.histograms.setdefault(name, Histogram())
+		return _Timer(histogram)
+
+	def inc(self, name, amount=1):
+		"""Increase the named counter."""
+		if self.enabled:
+			with self._lock:
+				self.counters[name] = self.counters.get(name, 0) + amount
+
+	def set(self, name, value):
+		"""Set the named gauge to a value."""
+		if self.enabled:
+			self.gauges[name] = value
+
+	def reset(self):
+		"""Clear all metrics."""
+		with self._lock:
+			self.counters.clear()
+			self.gauges.clear()
+			self.histograms.clear()
+
+	def to_dict(self):
+		"""Return all metrics as a dict suitable for JSON."""
+		with self._lock:
+			return {
+				'counters': dict(self.counters),
+				'gauges': dict(self.gauges),
+				'histograms': dict((name, {
+					'buckets': list(h.buckets),
+					'counts': list(h.counts),
+					'count': h.count,
+					'sum': h.sum,
+				}) for name, h in self.histograms.items()),
+			}
+
+	def to_prometheus(self):
+		"""Return all metrics in the Prometheus text exposition format."""
+		lines = []
+		with self._lock:
+			for name in sorted(self.counters):
+				lines.append('# TYPE {0}{1} counter'.format(PREFIX, name))
+				lines.append('{0}{1} {2}'.format(PREFIX, name, self.counters[name]))
+			for name in sorted(self.gauges):
+				lines.append('# TYPE {0}{1} gauge'.format(PREFIX, name))
+				lines.append('{0}{1} {2!r}'.format(PREFIX, name, float(self.gauges[name])))
+			for name in sorted(self.histograms):
+				h = self.histograms[name]
+				lines.append('# TYPE {0}{1} histogram'.format(PREFIX, name))
+				total = 0
+				for bound, count in zip(h.buckets, h.counts):
+					total += count
+					lines.append('{0}{1}_bucket{{le="{2!r}"}} {3}'.format(PREFIX, name, bound, total))
+				lines.append('{0}{1}_bucket{{le="+Inf"}} {2}'.format(PREFIX, name, h.count))
+				lines.append('{0}{1}_sum {2!r}'.format(PREFIX, name, h.sum))
+				lines.append('{0}{1}_count {2}'.format(PREFIX, name, h.count))
+		return '\n'.join(lines) + '\n'
+
+
+# Registry used by all instrumented code.
+registry = Registry()
+
+
+class MetricsServer(object):
+	"""Serve the registry in Prometheus text format over HTTP from a background
+	thread, on localhost by default."""
+
+	def __init__(self, port, host='127.0.0.1', metrics=None):
+		# Imported here since the HTTP server modules are slow to load and most
+		# runs don't serve metrics.
+		try:
+			from http.server import BaseHTTPRequestHandler, HTTPServer
+		except ImportError:
+			from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+		metrics = metrics if metrics is not None else registry
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = metrics.to_prometheus().encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				log.debug(format % args)
+
+		self.server = HTTPServer((host, port), Handler)
+		self.port = self.server.server_address[1]
+		self._thread = threading.Thread(target=self.server.serve_forever, name='MetricsServer')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def close(self):
+		"""Stop serving metrics."""
+		self.server.shutdown()
+		self.server.server_close()
+
+
+class JsonDumper(object):
+	"""Write the registry as JSON to a file every interval seconds from a background
+	thread.  The file is replaced atomically so readers never see partial data."""
+
+	def __init__(self, path, interval=60.0, metrics=None):
+		self.path = path
+		self.interval = interval
+		self.metrics = metrics if metrics is not None else registry
+		self._stopping = threading.Event()
+		self._thread = threading.Thread(target=self._run, name='JsonDumper')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def dump(self):
+		"""Write metrics to the file now."""
+		temp_path = self.path + '.tmp'
+		with open(temp_path, 'w') as f:
+			json.dump(self.metrics.to_dict(), f, indent=2, sort_keys=True)
+		_replace(temp_path, self.path)
+
+	def _run(self):
+		while not self._stopping.wait(self.interval):
+			try:
+				self.dump()
+			except (IOError, OSError) as e:
+				log.warning('Could not write metrics: {0}'.format(e))
+
+	def close(self):
+		"""Stop dumping metrics, writing them one last time."""
+		self._stopping.set()
+		self._thread.join()
+		self.dump()
@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+import Metrics
+
+
+log = logging.getLogger(__name__)
+
+
+class Pipeline(object):
+	"""Run the sample, process, and apply stages of AutoColorTemp on separate
+	threads connected by single slot queues.  The sensor is sampled every delay
+	seconds regardless of how long processing and gamma updates take, and a stage
+	that falls behind only ever sees the newest item from the one before it, older
+	items are dropped."""
+
+	def __init__(self, main, delay):
+		self.main = main
+		self.delay = float(delay)
+		self.dropped_samples = 0
+		self.dropped_whites = 0
+		self.error = None
+		self._samples = queue.Queue(maxsize=1)
+		self._whites = queue.Queue(maxsize=1)
+		self._stopping = threading.Event()
+		self._threads = []
+
+	def _put_latest(self, items, item):
+		"""Put item in a single slot queue, dropping any stale item.  Returns number of
+		items dropped."""
+		dropped = 0
+		while True:
+			try:
+				items.put_nowait(item)
+				return dropped
+			except queue.Full:
+				try:
+					items.get_nowait()
+					dropped += 1
+				except queue.Empty:
+					pass
+
+	def _get(self, items):
+		"""Wait for the next item in a queue, or return None when stopping."""
+		while not self._stopping.is_set():
+			try:
+				return items.get(timeout=0.1)
+			except queue.Empty:
+				pass
+		return None
+
+	def _sample_loop(self):
+		while not self._stopping.is_set():
+			start = time.time()
+			measured = self.main.sample()
+			if measured is not None:
+				self.dropped_samples += self._put_latest(self._samples, measured)
+			self._stopping.wait(max(0.0, self.delay - (time.time() - start)))
+
+	def _process_loop(self):
+		while True:
+			measured = self._get(self._samples)
+			if measured is None:
+				return
+			try:
+				result = self.main.process(measured)
+			except ZeroDivisionError:
+				log.warning('Divide by zero while updating color temp.  Waiting for next update to try again.')
+				Metrics.registry.inc('updates_failed_total')
+				continue
+			if result is not None:
+				self.dropped_whites += self._put_latest(self._whites, result)
+
+	def _apply_loop(self):
+		while True:
+			result = self._get(self._whites)
+			if result is None:
+				return
+			self.main.apply(*result)
+
+	def _guard(self, loop):
+		"""Run a stage loop, stopping the whole pipeline if it fails."""
+		try:
+			loop()
+		except Exception as e:
+			Metrics.registry.inc('updates_failed_total')
+			self.error = e
+			self._stopping.set()
+
+	def start(self):
+		"""Start the pipeline threads."""
+		self._stopping.clear()
+		for name, loop in (('sample', self._sample_loop), ('process', self._process_loop), ('apply', self._apply_loop)):
+			thread = threading.Thread(target=self._guard, args=(loop,), name='Pipeline-' + name)
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	def stop(self):
+		"""Stop the pipeline threads and wait for them to finish."""
+		self._stopping.set()
+		for thread in self._threads:
+			thread.join()
+		self._threads = []
+
+	def run(self):
+		"""Run the pipeline until interrupted.  Errors raised by any stage stop the
+		pipeline and are raised again here."""
+		self.start()
+		try:
+			while not self._stopping.wait(1.0):
+				pass
+		finally:
+			self.stop()
+		if self.error is not None:
+			raise self.error
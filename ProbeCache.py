@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+
+
+log = logging.getLogger(__name__)
+
+# Python 2 has no os.replace, its os.rename replaces an existing file on POSIX.
+_replace = getattr(os, 'replace', os.rename)
+
+
+def default_path():
+	"""Return default location of the probe cache file, in the user's cache directory."""
+	base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(base, 'autocolortemp', 'probe.json')
+
+
+class ProbeCache(object):
+	"""Small JSON file remembering what was discovered about sensors and displays
+	on a previous run, so startup can skip probing that gives the same answer
+	every time.  Values must be JSON serializable.  A missing or corrupt file is
+	treated as empty, and cached values should always be checked before use since
+	the hardware may have changed since they were saved."""
+
+	def __init__(self, path=None):
+		self.path = path if path is not None else default_path()
+		self.values = {}
+		self.dirty = False
+		try:
+			with open(self.path) as f:
+				values = json.load(f)
+			if isinstance(values, dict):
+				self.values = values
+		except (IOError, OSError, ValueError):
+			log.info('No usable probe cache at {0}.'.format(self.path))
+
+	def get(self, key, default=None):
+		"""Return cached value for key, or default if there isn't one."""
+		return self.values.get(key, default)
+
+	def set(self, key, value):
+		"""Cache a value for key.  Call save to write changes to the file."""
+		if self.values.get(key) != value:
+			self.values[key] = value
+			self.dirty = True
+
+	def discard(self, key):
+		"""Forget the cached value for key."""
+		if self.values.pop(key, None) is not None:
+			self.dirty = True
+
+	def save(self):
+		"""Write the cache to its file if anything changed.  Failures are logged and
+		otherwise ignored since the cache is only an optimization."""
+		if not self.dirty:
+			return
+		try:
+			directory = os.path.dirname(self.path)
+			if directory and not os.path.isdir(directory):
+				os.makedirs(directory)
+			temp_path = self.path + '.tmp'
+			with open(temp_path, 'w') as f:
+				json.dump(self.values, f, indent=2, sort_keys=True)
+			_replace(temp_path, self.path)
+			self.dirty = False
+		except (IOError, OSError) as e:
+			log.warning('Could not save probe cache: {0}'.format(e))
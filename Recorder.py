@@ -0,0 +1,119 @@
+import logging
+import os
+import struct
+import time
+
+import numpy
+
+
+log = logging.getLogger(__name__)
+
+# Files start with a header of magic bytes, format version, and record size,
+# followed by fixed size little endian records.
+MAGIC = b'ACTLOG\x00\x00'
+VERSION = 1
+HEADER_FORMAT = '<8sII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Each record holds the time of the reading, raw red, green, blue, and clear
+# counts (all 0 if the sensor doesn't report them), measured RGB color, color
+# temperature in kelvin, white point applied (NaN if the update was skipped),
+# and seconds from reading the sensor to finishing the update.  Temperature is
+# NaN if it couldn't be computed.
+RECORD_FORMAT = '<d4H3ff3ff'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_DTYPE = numpy.dtype([
+	('time', '<f8'),
+	('counts', '<u2', (4,)),
+	('color', '<f4', (3,)),
+	('kelvin', '<f4'),
+	('white', '<f4', (3,)),
+	('latency', '<f4'),
+])
+
+_NAN = float('nan')
+_NO_COUNTS = (0, 0, 0, 0)
+_NO_WHITE = (_NAN, _NAN, _NAN)
+
+
+class Recorder(object):
+	"""Append measurements to a binary log file of fixed size records.  Writes
+	are buffered and flushed to disk with fsync at most every fsync_interval
+	seconds, so a crash loses at most that much history.  A record cut short by
+	a crash is ignored when the file is read."""
+
+	def __init__(self, path, fsync_interval=10.0):
+		self.path = path
+		self.fsync_interval = fsync_interval
+		# Check an existing file is a measurement log before opening it to append.
+		if os.path.exists(path) and os.path.getsize(path) > 0:
+			_check_header(path)
+		self.file = open(path, 'ab')
+		if self.file.tell() == 0:
+			self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_SIZE))
+		else:
+			# Drop any partial record left by a crash so new records stay aligned.
+			extra = (self.file.tell() - HEADER_SIZE) % RECORD_SIZE
+			if extra:
+				log.warning('Truncating partial record at end of {0}.'.format(path))
+				self.file.truncate(self.file.tell() - extra)
+				self.file.seek(0, os.SEEK_END)
+		self.records = 0
+		self._last_sync = time.time()
+
+	def record(self, timestamp, color, counts=None, kelvin=None, white=None, latency=0.0):
+		"""Append a measurement.  Counts, kelvin, and white may be None if unknown."""
+		if counts is None:
+			counts = _NO_COUNTS
+		if white is None:
+			white = _NO_WHITE
+		self.file.write(struct.pack(RECORD_FORMAT, timestamp,
+			counts[0], counts[1], counts[2], counts[3],
+			color[0], color[1], color[2],
+			kelvin if kelvin is not None else _NAN,
+			white[0], white[1], white[2],
+			latency))
+		self.records += 1
+		if time.time() - self._last_sync >= self.fsync_interval:
+			self.sync()
+
+	def sync(self):
+		"""Flush buffered records to disk."""
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self._last_sync = time.time()
+
+	def close(self):
+		"""Flush buffered records and close the file."""
+		self.sync()
+		self.file.close()
+
+
+def _check_header(path):
+	"""Raise ValueError if the file at path isn't a log of this record format."""
+	with open(path, 'rb') as f:
+		header = f.read(HEADER_SIZE)
+	if len(header) < HEADER_SIZE:
+		raise ValueError('{0} is too short to be a measurement log.'.format(path))
+	magic, version, record_size = struct.unpack(HEADER_FORMAT, header)
+	if magic != MAGIC:
+		raise ValueError('{0} is not a measurement log.'.format(path))
+	if version != VERSION or record_size != RECORD_SIZE:
+		raise ValueError('{0} has unsupported log format version {1}.'.format(path, version))
+
+
+def read(path):
+	"""Return the records of a log file as a read only NumPy structured array with
+	the fields of RECORD_DTYPE.  The file is memory mapped rather than read, so
+	only the parts of it used are loaded from disk."""
+	_check_header(path)
+	count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_SIZE
+	if count == 0:
+		return numpy.zeros(0, dtype=RECORD_DTYPE)
+	return numpy.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+def replay_samples(records):
+	"""Return list of the measured RGB colors of records, for replaying them
+	through Simulated.SimulatedHardware."""
+	return [tuple(float(c) for c in color) for color in records['color']]
@@ -0,0 +1,184 @@
+import logging
+import math
+import time
+
+import AutoColorTemp
+
+
+log = logging.getLogger(__name__)
+
+# Seconds between Unix epoch and the J2000 epoch (2000-01-01 12:00 UTC).
+J2000 = 946728000.0
+
+
+def _mireds(kelvin):
+	return 1e6 / kelvin
+
+
+def _check_temp(kelvin):
+	if kelvin < AutoColorTemp.TEMP_MIN or kelvin > AutoColorTemp.TEMP_MAX:
+		raise ValueError('Temperature must be between 1667K and 25000K.')
+	return float(kelvin)
+
+
+class KelvinSource(object):
+	"""Color temperature as a function of time, for running without a sensor.
+	Subclasses implement temp(timestamp) for Unix timestamps."""
+
+	def temp(self, timestamp):
+		"""Return color temperature in kelvin at a Unix timestamp."""
+		raise NotImplementedError
+
+	def next_change(self, timestamp, step=1.0, resolution=60.0, horizon=86400.0):
+		"""Return seconds from timestamp until the temperature has moved step mireds
+		or more from its value at timestamp, searching resolution second steps up
+		to horizon seconds ahead then narrowing down to the second.  Returns horizon
+		if the temperature doesn't change that much."""
+		start = _mireds(self.temp(timestamp))
+		previous = 0.0
+		offset = resolution
+		while offset <= horizon:
+			if abs(_mireds(self.temp(timestamp + offset)) - start) >= step:
+				# Bisect between the last time within step and this one.
+				low, high = previous, offset
+				while high - low > 1.0:
+					middle = (low + high) / 2.0
+					if abs(_mireds(self.temp(timestamp + middle)) - start) >= step:
+						high = middle
+					else:
+						low = middle
+				return high
+			previous = offset
+			offset += resolution
+		return horizon
+
+
+class Schedule(KelvinSource):
+	"""Color temperature following a daily schedule of local times and
+	temperatures, changing linearly (in mireds) from each point to the next and
+	wrapping around at midnight."""
+
+	def __init__(self, points):
+		if not points:
+			raise ValueError('Schedule needs at least one time and temperature.')
+		self.points = sorted((float(seconds) % 86400.0, _check_temp(kelvin)) for seconds, kelvin in points)
+
+	@classmethod
+	def parse(cls, spec):
+		"""Create schedule from a string of comma separated HH:MM=KELVIN entries,
+		like '06:30=3400,08:00=6500,20:00=6500,22:00=2700'."""
+		points = []
+		for entry in spec.split(','):
+			try:
+				clock, kelvin = entry.strip().split('=')
+				hours, minutes = clock.split(':')
+				hours, minutes, kelvin = int(hours), int(minutes), float(kelvin)
+			except ValueError:
+				raise ValueError('Bad schedule entry, expected HH:MM=KELVIN: {0}'.format(entry))
+			if not 0 <= hours <= 23 or not 0 <= minutes <= 59:
+				raise ValueError('Bad schedule time, hours must be 0-23 and minutes 0-59: {0}'.format(entry))
+			points.append((hours*3600 + minutes*60, kelvin))
+		return cls(points)
+
+	def temp(self, timestamp):
+		local = time.localtime(timestamp)
+		seconds = local.tm_hour*3600 + local.tm_min*60 + local.tm_sec + (timestamp % 1.0)
+		return self.temp_at(seconds)
+
+	def temp_at(self, seconds):
+		"""Return color temperature at a number of seconds after midnight."""
+		points = self.points
+		if len(points) == 1:
+			return points[0][1]
+		# Find the points before and after, wrapping around midnight.
+		after = 0
+		while after < len(points) and points[after][0] <= seconds:
+			after += 1
+		before_time, before_temp = points[after - 1]
+		after_time, after_temp = points[after % len(points)]
+		if after_time <= before_time:
+			after_time += 86400.0
+		if seconds < before_time:
+			seconds += 86400.0
+		fraction = (seconds - before_time) / (after_time - before_time)
+		return 1e6 / (_mireds(before_temp) + (_mireds(after_temp) - _mireds(before_temp))*fraction)
+
+
+def sun_elevation(timestamp, latitude, longitude):
+	"""Return elevation in degrees of the sun above the horizon at a Unix timestamp
+	and location (degrees, north and east positive).  Uses the US Naval
+	Observatory's approximate solar coordinates, good to about a degree."""
+	d = (timestamp - J2000) / 86400.0
+	g = math.radians(357.529 + 0.98560028*d)
+	q = 280.459 + 0.98564736*d
+	ecliptic = math.radians(q + 1.915*math.sin(g) + 0.020*math.sin(2.0*g))
+	obliquity = math.radians(23.439 - 0.00000036*d)
+	right_ascension = math.atan2(math.cos(obliquity)*math.sin(ecliptic), math.cos(ecliptic))
+	declination = math.asin(math.sin(obliquity)*math.sin(ecliptic))
+	sidereal = math.radians((18.697374558 + 24.06570982441908*d) * 15.0 + longitude)
+	hour_angle = sidereal - right_ascension
+	lat = math.radians(latitude)
+	return math.degrees(math.asin(math.sin(lat)*math.sin(declination) +
+		math.cos(lat)*math.cos(declination)*math.cos(hour_angle)))
+
+
+class SunSchedule(KelvinSource):
+	"""Color temperature following the sun at a location: night temperature while
+	the sun is below the low elevation (degrees), day temperature above the high
+	elevation, and changing linearly (in mireds) with elevation in between."""
+
+	def __init__(self, latitude, longitude, day=6500.0, night=2700.0, low=-6.0, high=6.0):
+		if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+			raise ValueError('Latitude must be between -90 and 90 and longitude between -180 and 180 degrees.')
+		self.latitude = latitude
+		self.longitude = longitude
+		self.day = _check_temp(day)
+		self.night = _check_temp(night)
+		self.low = low
+		self.high = high
+
+	def temp(self, timestamp):
+		elevation = sun_elevation(timestamp, self.latitude, self.longitude)
+		fraction = min(max((elevation - self.low) / (self.high - self.low), 0.0), 1.0)
+		return 1e6 / (_mireds(self.night) + (_mireds(self.day) - _mireds(self.night))*fraction)
+
+
+class Scheduler(object):
+	"""Drive AutoColorTemp from a KelvinSource instead of a sensor.  After each
+	update it sleeps until the temperature will have moved step mireds, but no
+	longer than max_sleep seconds so clock changes are picked up."""
+
+	def __init__(self, main, source, step=1.0, max_sleep=3600.0, clock=time.time, sleep=time.sleep):
+		self.main = main
+		self.source = source
+		self.step = step
+		self.max_sleep = max_sleep
+		self.clock = clock
+		self.sleep = sleep
+		self._stopping = False
+
+	def update(self):
+		"""Set the display to the current scheduled temperature and return seconds
+		until the next update is needed."""
+		now = self.clock()
+		temp = self.source.temp(now)
+		log.info('Scheduled color temperature: {0:.0f} kelvin'.format(temp))
+		result = self.main.process_temp(temp)
+		if result is not None:
+			self.main.apply(*result)
+		return max(1.0, self.source.next_change(now, self.step, horizon=self.max_sleep))
+
+	def run(self):
+		"""Update the display whenever the scheduled temperature changes, until stopped."""
+		while not self._stopping:
+			wait = self.update()
+			log.info('Next color temperature change in {0:.0f} seconds.'.format(wait))
+			self.sleep(wait)
+
+	def stop(self):
+		"""Stop after the current sleep."""
+		self._stopping = True
+
+	def close(self):
+		"""Restore gamma to original value."""
+		self.main.close()
@@ -0,0 +1,118 @@
+import logging
+
+import numpy
+
+import AutoColorTemp
+
+
+log = logging.getLogger(__name__)
+
+# Lux and color temperature coefficients for the TCS34725 from ams design note
+# DN40, "Lux and CCT Calculations using ams Color Sensors".
+DN40_R_COEF = 0.136
+DN40_G_COEF = 1.000
+DN40_B_COEF = -0.444
+DN40_CT_COEF = 3810.0
+DN40_CT_OFFSET = 1391.0
+DN40_DEVICE_FACTOR = 310.0
+
+# Sensor red, green, and blue counts to CIE XYZ, one row each for X, Y, and Z.
+# From the TAOS application note on calculating color temperature with its RGB
+# sensors.  Good enough to start with, fit a matrix to reference measurements
+# of the actual sensor and diffuser for accurate results.
+DEFAULT_MATRIX = (
+	(-0.14282, 1.54924, -0.95641),
+	(-0.32466, 1.57837, -0.73191),
+	(-0.68202, 0.77073,  0.56332))
+
+
+def ir_reject(counts):
+	"""Return red, green, blue, and clear counts with the infrared component,
+	estimated as in DN40 from how much more the clear channel sees than the sum
+	of the others, removed."""
+	r, g, b, c = [float(v) for v in counts]
+	ir = max(0.0, (r + g + b - c) / 2.0)
+	return (r - ir, g - ir, b - ir, c - ir)
+
+
+def dn40_lux(counts, integration_time, gain, glass_attenuation=1.0):
+	"""Return illuminance in lux of raw counts read with an integration time (in
+	seconds) and gain multiplier.  Glass attenuation is the factor the light is
+	reduced by anything covering the sensor."""
+	r, g, b, _ = ir_reject(counts)
+	counts_per_lux = (integration_time * 1000.0 * gain) / (glass_attenuation * DN40_DEVICE_FACTOR)
+	return max(0.0, DN40_R_COEF*r + DN40_G_COEF*g + DN40_B_COEF*b) / counts_per_lux
+
+
+def dn40_temp(counts):
+	"""Return color temperature in kelvin of raw counts from the ratio of blue to
+	red.  Raises ZeroDivisionError if no red is left once infrared is removed."""
+	r, _, b, _ = ir_reject(counts)
+	if r <= 0.0:
+		raise ZeroDivisionError('No red light measured to compute color temperature.')
+	return DN40_CT_COEF * b / r + DN40_CT_OFFSET
+
+
+class SensorMatrix(object):
+	"""Convert raw sensor counts to CIE XYZ and color temperature with a 3x3
+	matrix, replacing the assumption that the sensor sees sRGB.  Counts have
+	infrared removed first unless ir_rejection is False."""
+
+	def __init__(self, matrix=DEFAULT_MATRIX, ir_rejection=True):
+		matrix = numpy.array(matrix, dtype=float)
+		if matrix.shape != (3, 3):
+			raise ValueError('Sensor matrix must have 3 rows of 3 values.')
+		self.matrix = tuple(tuple(row) for row in matrix.tolist())
+		self.ir_rejection = ir_rejection
+
+	def xyz(self, counts):
+		"""Return CIE XYZ tuple of raw red, green, blue, and clear counts."""
+		r, g, b, _ = ir_reject(counts) if self.ir_rejection else counts
+		return tuple(row[0]*r + row[1]*g + row[2]*b for row in self.matrix)
+
+	def temp(self, counts):
+		"""Return color temperature in kelvin of raw red, green, blue, and clear counts.
+		Falls back to the DN40 blue to red ratio when the matrix gives no usable
+		chromaticity, like for dim light that is mostly infrared."""
+		X, Y, Z = self.xyz(counts)
+		total = X + Y + Z
+		if total <= 0.0:
+			return dn40_temp(counts)
+		return AutoColorTemp.xy_to_temp(X / total, Y / total)
+
+	def lux(self, counts, integration_time, gain):
+		"""Return illuminance in lux of raw counts, see dn40_lux."""
+		return dn40_lux(counts, integration_time, gain)
+
+	@classmethod
+	def fit(cls, counts, references, ir_rejection=True):
+		"""Fit a matrix by least squares to a list of raw counts measured under
+		lights of known CIE XYZ (from a colorimeter), given in the same order.
+		Needs at least 3 different lights, more give a better fit."""
+		if len(counts) != len(references) or len(counts) < 3:
+			raise ValueError('Need counts and reference XYZ of at least 3 lights.')
+		rgb = numpy.array([(ir_reject(c) if ir_rejection else c)[:3] for c in counts], dtype=float)
+		solution = numpy.linalg.lstsq(rgb, numpy.array(references, dtype=float), rcond=None)[0]
+		return cls(solution.T, ir_rejection)
+
+	@classmethod
+	def load(cls, path):
+		"""Load matrix from a text file of 3 lines of 3 values (separated by spaces or
+		commas), for X, Y, and Z.  Lines starting with # are ignored."""
+		rows = []
+		with open(path) as f:
+			for line in f:
+				line = line.split('#', 1)[0].strip()
+				if line:
+					rows.append([float(v) for v in line.replace(',', ' ').split()])
+		try:
+			return cls(rows)
+		except ValueError:
+			raise ValueError('Expected 3 lines of 3 values in sensor matrix file: {0}'.format(path))
+
+	def save(self, path):
+		"""Save matrix to a text file that load can read."""
+		with open(path, 'w') as f:
+			f.write('# Sensor red, green, blue to CIE X, Y, Z\n')
+			for row in self.matrix:
+				f.write('{0!r} {1!r} {2!r}\n'.format(*row))
@@ -0,0 +1,110 @@
+import collections
+import logging
+import math
+import random
+import time
+
+import AutoColorTemp
+from GammaBackend import GammaBackend
+from GammaRamp import ramp_builder
+
+
+log = logging.getLogger(__name__)
+
+
+def daylight_curve(period=86400.0, low=2700.0, high=6500.0):
+	"""Return function of elapsed seconds to color temperature, rising from low to
+	high and back again once every period seconds."""
+	def curve(t):
+		return low + (high - low) * 0.5 * (1.0 - math.cos(2.0 * math.pi * t / period))
+	return curve
+
+
+class SimulatedHardware(object):
+	"""Color sensor that replays recorded readings or follows a synthetic light
+	curve, for testing and benchmarking without hardware.
+
+	Samples is a list of RGB tuples returned in order (and repeated), otherwise
+	curve is a function of elapsed seconds to color temperature and readings are
+	the sRGB white of that temperature.  Each reading waits latency seconds and
+	has gaussian noise with standard deviation noise added to each channel."""
+
+	def __init__(self, samples=None, curve=None, latency=0.0, noise=0.0, seed=None, clock=time.time):
+		self.samples = list(samples) if samples is not None else None
+		self.curve = curve if curve is not None else daylight_curve()
+		self.latency = latency
+		self.noise = noise
+		self.clock = clock
+		self.start = clock()
+		self.reads = 0
+		self.closed = False
+		self._random = random.Random(seed)
+
+	def get_color(self):
+		"""Return tuple of RGB color (with float components, 0-1.0)."""
+		if self.latency > 0.0:
+			time.sleep(self.latency)
+		if self.samples is not None:
+			color = self.samples[self.reads % len(self.samples)]
+		else:
+			temp = min(max(self.curve(self.clock() - self.start), AutoColorTemp.TEMP_MIN), AutoColorTemp.TEMP_MAX)
+			color = AutoColorTemp.temp_to_white_array([temp])[0]
+		self.reads += 1
+		if self.noise > 0.0:
+			return tuple(min(max(c + self._random.gauss(0.0, self.noise), 0.0), 1.0) for c in color)
+		return tuple(float(c) for c in color)
+
+	def close(self):
+		"""Close the simulated sensor."""
+		self.closed = True
+
+
+class SimulatedGamma(GammaBackend):
+	"""Gamma adjustment that builds ramps like a real backend and records them
+	instead of sending them to a display.  Each update waits latency seconds to
+	stand in for the driver call.  The last history updates are kept as tuples of
+	time, white point, and GammaRamp."""
+
+	name = 'simulated'
+
+	def __init__(self, ramp_size=256, latency=0.0, history=100, builder=ramp_builder):
+		super(SimulatedGamma, self).__init__()
+		self.ramp_size = ramp_size
+		self.latency = latency
+		self.builder = builder
+		self.history = collections.deque(maxlen=history)
+		self.updates = 0
+		self.restore_called = False
+
+	def adjust_white_point(self, white):
+		"""Build and record the gamma ramp for the specified white point (tuple of RGB
+		floats, 0-1.0)."""
+		ramp = self.builder.build(self.ramp_size, white, self.gamma, self.calibrations.get(None))
+		if self.latency > 0.0:
+			time.sleep(self.latency)
+		self.history.append((time.time(), tuple(white), ramp))
+		self.updates += 1
+
+	@property
+	def white(self):
+		"""Last white point set, or None."""
+		return self.history[-1][1] if self.history else None
+
+	def set_calibration(self, calibration, name=None):
+		"""Correct ramps with a Calibration, or remove it with None.  There's only one
+		output and it has no name, so name must be None."""
+		if name is not None:
+			raise ValueError('Unknown output: {0}'.format(name))
+		if calibration is None:
+			self.calibrations.pop(None, None)
+		else:
+			self.calibrations[None] = calibration
+
+	@property
+	def ramp_sizes(self):
+		"""List of gamma ramp size of each output."""
+		return [self.ramp_size]
+
+	def restore(self, name=None):
+		"""Restore gamma back to original value."""
+		self.restore_called = True
@@ -0,0 +1,262 @@
+import logging
+import random
+import threading
+import timeit
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+import Metrics
+
+
+log = logging.getLogger(__name__)
+
+# Seconds a reading may take when the hardware doesn't say how long it can take.
+DEFAULT_DEADLINE = 3.0
+
+# Seconds added to how long the hardware says a reading can take, for the time
+# spent talking to it.
+DEADLINE_MARGIN = 1.0
+
+
+class _Worker(object):
+	"""Long-lived thread making calls to one hardware object, one at a time, each
+	given deadline seconds to return."""
+
+	def __init__(self, hardware, deadline):
+		self.hardware = hardware
+		self.deadline = deadline
+		self._calls = queue.Queue()
+		self._thread = threading.Thread(target=self._run, name='SupervisedHardware-worker')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self):
+		while True:
+			call = self._calls.get()
+			if call is None:
+				return
+			name, result, finished = call
+			try:
+				result['value'] = getattr(self.hardware, name)()
+			except Exception as e:
+				result['error'] = e
+			finally:
+				finished.set()
+
+	def call(self, name, deadline=None):
+		"""Call a method of the hardware and return a dict with its value or error,
+		or None if it missed its deadline (the worker's deadline if not given)."""
+		result = {}
+		finished = threading.Event()
+		self._calls.put((name, result, finished))
+		if not finished.wait(self.deadline if deadline is None else deadline):
+			return None
+		return result
+
+	def stop(self):
+		"""Stop the thread once the call in progress, if any, returns."""
+		self._calls.put(None)
+
+
+class SupervisedHardware(object):
+	"""Wrap color sensor hardware so a failing or disconnected device can't stall
+	or stop the program.  Hardware is created by calling factory, so it can be
+	created again to reconnect.
+
+	Calls to the hardware run on a worker thread and are given deadline seconds
+	to return, so callers are never blocked longer than that.  Without a
+	deadline it's the hardware's max_read_seconds plus DEADLINE_MARGIN, or
+	DEFAULT_DEADLINE if the hardware doesn't say.  A call that misses its
+	deadline, or max_failures calls in a row that raise, mark the hardware as
+	lost: it's closed, its worker thread is abandoned, and a background thread
+	creates it again, waiting backoff seconds before the first try and doubling
+	the wait (up to max_backoff, with some jitter) after each failed try.  Until
+	it's back get_color and get_counts return None, which AutoColorTemp treats
+	as no reading so the display holds its last white point.
+
+	A light_changed check and the reading after it are one sample and share
+	one deadline, so a sample never blocks for longer than deadline seconds."""
+
+	def __init__(self, factory, deadline=None, max_failures=3, backoff=0.5, max_backoff=30.0):
+		self.factory = factory
+		self.deadline = deadline
+		self.max_failures = max_failures
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.failures = 0
+		self.reconnects = 0
+		self._hardware = None
+		self._worker = None
+		self._lock = threading.Lock()
+		self._reconnecting = False
+		self._closing = threading.Event()
+		self._reconnector = None
+		# When the sample started by light_changed must finish, for the reading
+		# that follows it.
+		self._sample_ends = None
+		# Connect straight away, but carry on without the hardware if it isn't
+		# there yet.
+		try:
+			self._connected(factory())
+		except Exception as e:
+			log.warning('Could not connect to hardware, retrying in the background: {0}'.format(e))
+			self._lost(None)
+		Metrics.registry.set('hardware_connected', 1 if self._hardware is not None else 0)
+
+	def __getattr__(self, name):
+		# Expose anything else the current hardware provides.
+		hardware = self.__dict__.get('_hardware')
+		if hardware is None:
+			raise AttributeError(name)
+		return getattr(hardware, name)
+
+	@property
+	def connected(self):
+		"""True if the hardware is connected and answering."""
+		return self._hardware is not None
+
+	def _deadline(self, hardware):
+		"""Return seconds a call to the hardware may take."""
+		longest = getattr(hardware, 'max_read_seconds', None)
+		if self.deadline is not None:
+			if longest is not None and longest > self.deadline:
+				log.warning('Hardware can take {0} seconds to read, longer than the {1} second deadline.'.format(
+					longest, self.deadline))
+			return self.deadline
+		if longest is None:
+			return DEFAULT_DEADLINE
+		return longest + DEADLINE_MARGIN
+
+	def _connected(self, hardware):
+		"""Start using newly created hardware.  Call with the lock held, or before
+		any other thread is started."""
+		self._worker = _Worker(hardware, self._deadline(hardware))
+		self._hardware = hardware
+		self.failures = 0
+
+	def _call(self, name, default=None, deadline=None, probe=False):
+		"""Call a method of the hardware with a deadline (the worker's if not
+		given), returning default if it fails or the hardware isn't connected.  A
+		probe is followed by a reading, which counts the failed update."""
+		worker = self._worker
+		if worker is None:
+			return default
+		hardware = worker.hardware
+		if deadline is None:
+			deadline = worker.deadline
+		result = worker.call(name, deadline)
+		if result is None:
+			# The device is stuck, give up on it.  The worker finishes once the
+			# hardware is closed or its own timeout expires.  No reading follows,
+			# so this is the failed update even for a probe.
+			log.warning('Hardware {0} took longer than {1:.2f} seconds.'.format(name, deadline))
+			Metrics.registry.inc('hardware_timeouts_total')
+			Metrics.registry.inc('updates_failed_total')
+			self._lost(hardware)
+			return default
+		if 'error' in result:
+			self.failures += 1
+			log.warning('Hardware {0} failed ({1} in a row): {2}'.format(name, self.failures, result['error']))
+			Metrics.registry.inc('hardware_failures_total')
+			lost = self.failures >= self.max_failures
+			if lost or not probe:
+				Metrics.registry.inc('updates_failed_total')
+			if lost:
+				self._lost(hardware)
+			return default
+		self.failures = 0
+		return result['value']
+
+	def _lost(self, hardware):
+		"""Drop the hardware and start reconnecting in the background."""
+		with self._lock:
+			if self._hardware is not hardware or self._reconnecting or self._closing.is_set():
+				return
+			worker, self._worker = self._worker, None
+			self._hardware = None
+			self._reconnecting = True
+		if worker is not None:
+			worker.stop()
+		Metrics.registry.set('hardware_connected', 0)
+		self._reconnector = threading.Thread(target=self._reconnect, args=(hardware,), name='SupervisedHardware-reconnect')
+		self._reconnector.daemon = True
+		self._reconnector.start()
+
+	def _reconnect(self, old):
+		if old is not None:
+			try:
+				old.close()
+			except Exception as e:
+				log.debug('Error closing lost hardware: {0}'.format(e))
+		attempt = 0
+		while True:
+			wait = min(self.max_backoff, self.backoff * 2**attempt) * random.uniform(0.75, 1.0)
+			if self._closing.wait(wait):
+				break
+			try:
+				hardware = self.factory()
+			except Exception as e:
+				attempt += 1
+				log.warning('Reconnecting to hardware failed (attempt {0}): {1}'.format(attempt, e))
+				continue
+			with self._lock:
+				if self._closing.is_set():
+					hardware.close()
+					break
+				self._connected(hardware)
+				self.reconnects += 1
+			log.info('Reconnected to hardware.')
+			Metrics.registry.inc('hardware_reconnects_total')
+			Metrics.registry.set('hardware_connected', 1)
+			break
+		with self._lock:
+			self._reconnecting = False
+
+	def _remaining(self):
+		"""Return seconds left of the sample started by light_changed, or None if
+		there isn't one and a reading gets the whole deadline."""
+		ends, self._sample_ends = self._sample_ends, None
+		if ends is None:
+			return None
+		return max(0.0, ends - timeit.default_timer())
+
+	def get_color(self):
+		"""Return tuple of RGB color (with float components, 0-1.0), or None if the
+		hardware didn't give a reading in time."""
+		return self._call('get_color', deadline=self._remaining())
+
+	def get_counts(self):
+		"""Return tuple of raw red, green, blue, and clear counts, or None if the
+		hardware didn't give a reading in time."""
+		return self._call('get_counts', deadline=self._remaining())
+
+	def light_changed(self):
+		"""Return True if the light may have changed since the last reading, also when
+		the hardware can't tell or isn't answering.  A reading after True gets
+		what's left of the deadline."""
+		self._sample_ends = None
+		worker = self._worker
+		if worker is None or not hasattr(worker.hardware, 'light_changed'):
+			return True
+		ends = timeit.default_timer() + worker.deadline
+		changed = self._call('light_changed', True, probe=True)
+		if changed:
+			self._sample_ends = ends
+		return changed
+
+	def close(self):
+		"""Stop reconnecting and close the connection with the sensor hardware."""
+		self._closing.set()
+		if self._reconnector is not None:
+			# Don't wait on a factory that's stuck opening the device, whatever it
+			# creates is closed when it returns.
+			self._reconnector.join(self.deadline if self.deadline is not None else DEFAULT_DEADLINE)
+		with self._lock:
+			hardware, self._hardware = self._hardware, None
+			worker, self._worker = self._worker, None
+		if worker is not None:
+			worker.stop()
+		if hardware is not None:
+			hardware.close()
@@ -0,0 +1,156 @@
+import collections
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+def _smoothstep(x):
+	"""Ease in and out of a transition, x goes from 0 to 1."""
+	return x*x*(3.0 - 2.0*x)
+
+
+class GammaTransition(object):
+	"""Wrap a gamma adjustment object so white point changes fade smoothly from the
+	current white point to the new one over duration seconds at fps frames per
+	second.  Frames are applied from a background thread, and a new white point
+	arriving mid-transition starts a new fade from wherever the display is.
+
+	The white point of each frame is precomputed per start and target white point
+	and picked by frame number, not the exact time, so repeating a fade produces
+	the same white points and its ramps come from the gamma ramp cache."""
+
+	def __init__(self, gamma, duration=2.0, fps=30.0, cache_size=8):
+		self.gamma = gamma
+		self.duration = float(duration)
+		self.fps = float(fps)
+		self.frames = 0
+		self.cache_size = cache_size
+		self._fades = collections.OrderedDict()
+		# Guards transition state, only held briefly.
+		self._condition = threading.Condition()
+		# Serializes calls to the wrapped gamma object, which can be slow.
+		self._write_lock = threading.Lock()
+		self._generation = 0
+		self._thread = None
+		self._stopping = False
+		self._current = None
+		self._start = None
+		self._target = None
+		self._frame = 0
+		self._start_time = 0.0
+
+	def __getattr__(self, name):
+		# Expose anything else the wrapped gamma object provides.
+		if name == 'gamma':
+			raise AttributeError(name)
+		return getattr(self.gamma, name)
+
+	@property
+	def frame_count(self):
+		"""Number of frames in a transition."""
+		return max(1, int(round(self.duration * self.fps)))
+
+	def _fade(self, start, target):
+		"""Return list of white points of each frame fading from start to target, the
+		last being target."""
+		key = (start, target)
+		frames = self._fades.pop(key, None)
+		if frames is None:
+			count = self.frame_count
+			frames = []
+			for index in range(1, count + 1):
+				amount = _smoothstep(index / float(count))
+				frames.append(tuple(s + (t - s)*amount for s, t in zip(start, target)))
+			frames[-1] = target
+		self._fades[key] = frames
+		while len(self._fades) > self.cache_size:
+			self._fades.popitem(last=False)
+		return frames
+
+	def set_gamma(self, gamma):
+		"""Change RGB gamma value of the wrapped gamma object."""
+		with self._write_lock:
+			self.gamma.set_gamma(gamma)
+
+	def adjust_white_point(self, white):
+		"""Start a transition to the specified white point (tuple of RGB floats, 0-1.0).
+		The first white point, and dicts of per output white points, are applied
+		immediately."""
+		with self._condition:
+			self._generation += 1
+			generation = self._generation
+			if not (self._current is None or self.duration <= 0.0 or isinstance(white, dict)):
+				self._start = self._current
+				self._target = tuple(white)
+				self._frame = 0
+				self._start_time = time.time()
+				if self._thread is None:
+					self._stopping = False
+					self._thread = threading.Thread(target=self._run, name='GammaTransition')
+					self._thread.daemon = True
+					self._thread.start()
+				self._condition.notify()
+				return
+			self._target = None
+			self._current = None if isinstance(white, dict) else tuple(white)
+		with self._write_lock:
+			with self._condition:
+				if self._generation != generation:
+					# A newer white point has already taken over.
+					return
+			self.gamma.adjust_white_point(white)
+
+	def _run(self):
+		frame_time = 1.0 / self.fps
+		while True:
+			with self._condition:
+				while self._target is None and not self._stopping:
+					self._condition.wait()
+				if self._stopping:
+					return
+				frames = self._fade(self._start, self._target)
+				index = int(round((time.time() - self._start_time) * self.fps))
+				if index >= len(frames):
+					white = self._target
+					self._target = None
+				elif index > self._frame:
+					white = frames[index - 1]
+				else:
+					# Still on the frame already shown.
+					self._condition.wait(frame_time)
+					continue
+				self._frame = index
+				self._current = white
+				generation = self._generation
+			with self._write_lock:
+				with self._condition:
+					if self._generation != generation or self._stopping:
+						continue
+				self.gamma.adjust_white_point(white)
+			with self._condition:
+				self.frames += 1
+				if self._target is not None and not self._stopping:
+					self._condition.wait(frame_time)
+
+	def stop(self):
+		"""Stop any transition in progress, leaving the display where it is."""
+		with self._condition:
+			thread = self._thread
+			self._thread = None
+			self._target = None
+			self._stopping = True
+			self._condition.notify()
+		if thread is not None:
+			thread.join()
+
+	def restore(self):
+		"""Stop any transition in progress and restore gamma back to original value."""
+		self.stop()
+		with self._condition:
+			self._current = None
+			self._generation += 1
+		with self._write_lock:
+			self.gamma.restore()
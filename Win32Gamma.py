@@ -1,7 +1,8 @@
 from ctypes import *
 import logging
 
-from AutoColorTemp import gamma_table_gen
+from GammaBackend import GammaBackend
+from GammaRamp import GammaRamp
 
 
 log = logging.getLogger(__name__)
@@ -9,42 +10,38 @@ log = logging.getLogger(__name__)
 # Windows color system reference: 
 #  http://msdn.microsoft.com/en-us/library/windows/desktop/dd371793(v=vs.85).aspx
 
-USHORT_MAX = 65535
 RAMP_SIZE = 256
 
 
-class Win32Gamma(object):
+class _DeviceOutput(object):
+	"""Gamma ramp of a display device context."""
+
+	def __init__(self, dc):
+		self.dc = dc
+		self.name = 'primary'
+		self.ramp_size = RAMP_SIZE
+		# Save current gamma ramps.
+		self.old_ramp = GammaRamp(RAMP_SIZE)
+		if not windll.gdi32.GetDeviceGammaRamp(dc, byref(self.old_ramp.buffer)):
+			raise RuntimeError('GetDeviceGammaRamp failed.')
+
+	def set_ramp(self, ramp):
+		# GDI takes the three ramps back to back in one buffer.
+		windll.gdi32.SetDeviceGammaRamp(self.dc, byref(ramp.buffer))
+
+	def restore(self):
+		self.set_ramp(self.old_ramp)
+
+
+class Win32Gamma(GammaBackend):
 	"""Adjust color temperature of main display on Windows."""
 
+	name = 'win32'
+	default_gamma = (2.2, 2.2, 2.2)
+
 	def __init__(self):
+		super(Win32Gamma, self).__init__()
 		# Get DC for primary display.
 		self.dc = windll.user32.GetDC(None)
 		# TODO: Support multiple monitors.
-		# Save current gamma ramps.
-		self.gamma_ramp = c_ushort * (RAMP_SIZE * 3)
-		self.old_ramp = self.gamma_ramp()
-		if not windll.gdi32.GetDeviceGammaRamp(self.dc, byref(self.old_ramp)):
-			raise RuntimeError('GetDeviceGammaRamp failed.')
-		# Set default gamma.
-		self.gamma = (2.2, 2.2, 2.2)
-
-	def set_gamma(self, gamma):
-		"""Change RGB gamma value used in computation of gamma ramp. Should be a tuple
-		of three float values (one for each channel).  Default gamma is 1.0 (no gamma)."""
-		self.gamma = gamma
-
-	def adjust_white_point(self, white):
-		"""Change the white point of the monitor to the specified value (tuple of 
-		RGB floats, 0-1.0)."""
-		# Allocate gamma ramps.
-		ramp = self.gamma_ramp()
-		# Fill gamma ramps.
-		for c in range(3):
-			for i, value in enumerate(gamma_table_gen(RAMP_SIZE, white[c], self.gamma[c])):
-				ramp[i + 256*c] = c_ushort(int(USHORT_MAX*value))
-		# Set gamma ramps.
-		windll.gdi32.SetDeviceGammaRamp(self.dc, byref(ramp))
-
-	def restore(self):
-		"""Restore gamma back to original value."""
-		windll.gdi32.SetDeviceGammaRamp(self.dc, byref(self.old_ramp))
+		self.outputs = [_DeviceOutput(self.dc)]
@@ -1,74 +1,229 @@
 from ctypes import *
 from ctypes.util import find_library
 import logging
+import os
 
-from AutoColorTemp import gamma_table_gen
+from GammaBackend import GammaBackend
+from GammaRamp import GammaRamp
 
 
 log = logging.getLogger(__name__)
 
-# X11 references: 
+
+def _declare(library, name, restype, argtypes):
+	"""Set result and argument types of a library function, if it exists.  Display
+	and other pointers must be declared, or ctypes passes them as 32-bit ints."""
+	try:
+		function = getattr(library, name)
+	except AttributeError:
+		return
+	function.restype = restype
+	function.argtypes = argtypes
+
+
+# X11 references:
 #  http://www.x.org/releases/current/doc/libX11/libX11/libX11.html
 #  http://www.x.org/releases/current/doc/man/man3/XF86VM.3.xhtml
+#  http://www.x.org/releases/current/doc/randrproto/randrproto.txt
 Xlib = CDLL(find_library('X11'))
+_declare(Xlib, 'XOpenDisplay', c_void_p, [c_char_p])
+_declare(Xlib, 'XScreenCount', c_int, [c_void_p])
+_declare(Xlib, 'XRootWindow', c_ulong, [c_void_p, c_int])
+_declare(Xlib, 'XFlush', c_int, [c_void_p])
 
 Xf86vm = CDLL(find_library('Xxf86vm'))
+_declare(Xf86vm, 'XF86VidModeGetGammaRampSize', c_int, [c_void_p, c_int, POINTER(c_int)])
+_declare(Xf86vm, 'XF86VidModeGetGammaRamp', c_int,
+	[c_void_p, c_int, c_int, POINTER(c_ushort), POINTER(c_ushort), POINTER(c_ushort)])
+_declare(Xf86vm, 'XF86VidModeSetGammaRamp', c_int,
+	[c_void_p, c_int, c_int, POINTER(c_ushort), POINTER(c_ushort), POINTER(c_ushort)])
+
+
+class XRRScreenResources(Structure):
+	_fields_ = [('timestamp', c_ulong),
+				('configTimestamp', c_ulong),
+				('ncrtc', c_int),
+				('crtcs', POINTER(c_ulong)),
+				('noutput', c_int),
+				('outputs', POINTER(c_ulong)),
+				('nmode', c_int),
+				('modes', c_void_p)]
+
+class XRRCrtcInfo(Structure):
+	_fields_ = [('timestamp', c_ulong),
+				('x', c_int),
+				('y', c_int),
+				('width', c_uint),
+				('height', c_uint),
+				('mode', c_ulong),
+				('rotation', c_ushort),
+				('noutput', c_int),
+				('outputs', POINTER(c_ulong)),
+				('rotations', c_ushort),
+				('npossible', c_int),
+				('possible', POINTER(c_ulong))]
+
+class XRROutputInfo(Structure):
+	# Only the leading fields are declared, the rest aren't used.
+	_fields_ = [('timestamp', c_ulong),
+				('crtc', c_ulong),
+				('name', c_char_p),
+				('nameLen', c_int)]
+
+class XRRCrtcGamma(Structure):
+	_fields_ = [('size', c_int),
+				('red', POINTER(c_ushort)),
+				('green', POINTER(c_ushort)),
+				('blue', POINTER(c_ushort))]
+
+# XRandR 1.3 or later gives per-CRTC gamma control but is optional, without it
+# each X screen is adjusted as a whole with XF86VidMode.
+Xrandr = None
+if find_library('Xrandr') is not None:
+	Xrandr = CDLL(find_library('Xrandr'))
+	_declare(Xrandr, 'XRRGetScreenResourcesCurrent', POINTER(XRRScreenResources), [c_void_p, c_ulong])
+	_declare(Xrandr, 'XRRFreeScreenResources', None, [POINTER(XRRScreenResources)])
+	_declare(Xrandr, 'XRRGetCrtcInfo', POINTER(XRRCrtcInfo), [c_void_p, POINTER(XRRScreenResources), c_ulong])
+	_declare(Xrandr, 'XRRFreeCrtcInfo', None, [POINTER(XRRCrtcInfo)])
+	_declare(Xrandr, 'XRRGetOutputInfo', POINTER(XRROutputInfo), [c_void_p, POINTER(XRRScreenResources), c_ulong])
+	_declare(Xrandr, 'XRRFreeOutputInfo', None, [POINTER(XRROutputInfo)])
+	_declare(Xrandr, 'XRRGetCrtcGammaSize', c_int, [c_void_p, c_ulong])
+	_declare(Xrandr, 'XRRGetCrtcGamma', POINTER(XRRCrtcGamma), [c_void_p, c_ulong])
+	_declare(Xrandr, 'XRRSetCrtcGamma', None, [c_void_p, c_ulong, POINTER(XRRCrtcGamma)])
+	_declare(Xrandr, 'XRRFreeGamma', None, [POINTER(XRRCrtcGamma)])
+
+
+class _CrtcOutput(object):
+	"""Gamma ramp of one XRandR CRTC."""
+
+	def __init__(self, display, crtc, name, ramp_size):
+		self.display = display
+		self.crtc = crtc
+		self.name = name
+		self.ramp_size = ramp_size
+		# Save current gamma ramps.
+		self.old_ramp = GammaRamp(ramp_size)
+		current = Xrandr.XRRGetCrtcGamma(display, crtc)
+		if not current:
+			raise RuntimeError('Could not read gamma ramp of CRTC {0}.'.format(crtc))
+		for channel, values in ((self.old_ramp.red, current.contents.red),
+								(self.old_ramp.green, current.contents.green),
+								(self.old_ramp.blue, current.contents.blue)):
+			memmove(channel, values, sizeof(channel))
+		Xrandr.XRRFreeGamma(current)
+
+	def set_ramp(self, ramp):
+		gamma = XRRCrtcGamma(ramp.size, cast(ramp.red, POINTER(c_ushort)),
+			cast(ramp.green, POINTER(c_ushort)), cast(ramp.blue, POINTER(c_ushort)))
+		Xrandr.XRRSetCrtcGamma(self.display, self.crtc, byref(gamma))
+
+	def restore(self):
+		self.set_ramp(self.old_ramp)
+
+
+class _ScreenOutput(object):
+	"""Gamma ramp of one X screen, through XF86VidMode."""
+
+	def __init__(self, display, screen, ramp_size):
+		self.display = display
+		self.screen = screen
+		self.name = 'screen{0}'.format(screen)
+		self.ramp_size = ramp_size
+		# Save current gamma ramps.
+		self.old_ramp = GammaRamp(ramp_size)
+		Xf86vm.XF86VidModeGetGammaRamp(display, screen, ramp_size,
+			self.old_ramp.red, self.old_ramp.green, self.old_ramp.blue)
+
+	def set_ramp(self, ramp):
+		Xf86vm.XF86VidModeSetGammaRamp(self.display, self.screen, ramp.size,
+			ramp.red, ramp.green, ramp.blue)
+
+	def restore(self):
+		self.set_ramp(self.old_ramp)
 
-USHORT_MAX = 65535
 
+class X11Gamma(GammaBackend):
+	"""Adjust color temperature of all displays on X11/Linux.  Each active XRandR
+	CRTC is adjusted separately when XRandR is available, otherwise each X screen
+	is adjusted with XF86VidMode.  If a ProbeCache is given the active CRTCs and
+	their ramp sizes are remembered, and reused until the X server reports its
+	screen configuration changed."""
 
-class X11Gamma(object):
-	"""Adjust color temperature of main display on X11/Linux."""
+	name = 'x11'
+	per_output = True
+	probe_cache = True
 
-	def __init__(self):
-		# Save the current display and screen ID.
+	def __init__(self, use_xrandr=True, cache=None):
+		super(X11Gamma, self).__init__()
 		self.display = Xlib.XOpenDisplay(None)
-		self.screen = Xlib.XDefaultScreen(self.display)
-		log.info('XDefaultScreen returned screen ID: {0}'.format(self.screen))
-		# TODO: Support multiple monitors.
-		# Save size of gamma ramp.
-		self.ramp_size = c_int(0)
-		Xf86vm.XF86VidModeGetGammaRampSize(self.display, self.screen, byref(self.ramp_size))
-		if self.ramp_size.value == 0:
+		if not self.display:
+			raise RuntimeError('Could not open X display.')
+		self.cache = cache
+		if use_xrandr and Xrandr is not None:
+			self._find_crtcs()
+		if not self.outputs:
+			self._find_screens()
+		if not self.outputs:
 			raise RuntimeError('Could not read size of X11 gamma ramp.')
-		# Save current gamma ramps.
-		self.gamma_ramp = c_ushort * self.ramp_size.value
-		self.old_red = self.gamma_ramp()
-		self.old_green = self.gamma_ramp()
-		self.old_blue = self.gamma_ramp()
-		Xf86vm.XF86VidModeGetGammaRamp(self.display, self.screen, self.ramp_size, 
-			byref(self.old_red), byref(self.old_green), byref(self.old_blue))
-		# Default to gamma of 1.0 (no gamma adjustment).
-		# For some reason I found the gamma ramp returned by X11 (Ubuntu 12.04) 
-		# doesn't seem to apply any gamma adjustment and looks washed out when 
+		for output in self.outputs:
+			log.info('Found output {0} with gamma ramp size {1}'.format(output.name, output.ramp_size))
+		# Gamma is left at the default of 1.0 (no gamma adjustment).
+		# For some reason I found the gamma ramp returned by X11 (Ubuntu 12.04)
+		# doesn't seem to apply any gamma adjustment and looks washed out when
 		# typical gamma of 2.2 or so is applied.
-		self.gamma = (1.0, 1.0, 1.0)
-
-	def set_gamma(self, gamma):
-		"""Change RGB gamma value used in computation of gamma ramp. Should be a tuple
-		of three float values (one for each channel).  Default gamma is 1.0 (no gamma)."""
-		self.gamma = gamma
-
-	def adjust_white_point(self, white):
-		"""Change the white point of the monitor to the specified value (tuple of 
-		RGB floats, 0-1.0)."""
-		# Allocate gamma ramps.
-		red = self.gamma_ramp()
-		green = self.gamma_ramp()
-		blue = self.gamma_ramp()
-		# Fill ramps with values.
-		size = self.ramp_size.value
-		for i, value in enumerate(gamma_table_gen(size, white[0], self.gamma[0])):
-			red[i] = c_ushort(int(USHORT_MAX*value))
-		for i, value in enumerate(gamma_table_gen(size, white[1], self.gamma[1])):
-			green[i] = c_ushort(int(USHORT_MAX*value))
-		for i, value in enumerate(gamma_table_gen(size, white[2], self.gamma[2])):
-			blue[i] = c_ushort(int(USHORT_MAX*value))
-		# Set gamma ramps.
-		Xf86vm.XF86VidModeSetGammaRamp(self.display, self.screen, self.ramp_size, 
-			byref(red), byref(green), byref(blue))
 
-	def restore(self):
-		"""Restore gamma back to original value."""
-		Xf86vm.XF86VidModeSetGammaRamp(self.display, self.screen, self.ramp_size, 
-			byref(self.old_red), byref(self.old_green), byref(self.old_blue))
+	def _find_crtcs(self):
+		"""Add an output for each active CRTC of every X screen."""
+		for screen in range(Xlib.XScreenCount(self.display)):
+			root = Xlib.XRootWindow(self.display, screen)
+			try:
+				resources = Xrandr.XRRGetScreenResourcesCurrent(self.display, root)
+			except AttributeError:
+				log.info('XRandR 1.3 not available, falling back to XF86VidMode.')
+				return
+			if not resources:
+				continue
+			key = 'x11-crtcs {0} {1}'.format(os.environ.get('DISPLAY', ''), screen)
+			stamps = [resources.contents.timestamp, resources.contents.configTimestamp]
+			cached = self.cache.get(key) if self.cache is not None else None
+			if cached is not None and cached.get('stamps') == stamps:
+				crtcs = cached['crtcs']
+			else:
+				crtcs = self._probe_crtcs(resources)
+				if self.cache is not None:
+					self.cache.set(key, {'stamps': stamps, 'crtcs': crtcs})
+			Xrandr.XRRFreeScreenResources(resources)
+			for crtc, name, size in crtcs:
+				self.outputs.append(_CrtcOutput(self.display, crtc, name, size))
+
+	def _probe_crtcs(self, resources):
+		"""Return list of CRTC ID, output name, and gamma ramp size of each CRTC
+		driving an output."""
+		crtcs = []
+		for i in range(resources.contents.ncrtc):
+			crtc = resources.contents.crtcs[i]
+			info = Xrandr.XRRGetCrtcInfo(self.display, resources, crtc)
+			if not info:
+				continue
+			# Skip CRTCs which aren't driving any output.
+			if info.contents.noutput > 0:
+				output = Xrandr.XRRGetOutputInfo(self.display, resources, info.contents.outputs[0])
+				name = output.contents.name.decode('ascii', 'replace')
+				Xrandr.XRRFreeOutputInfo(output)
+				size = Xrandr.XRRGetCrtcGammaSize(self.display, crtc)
+				if size > 0:
+					crtcs.append([crtc, name, size])
+			Xrandr.XRRFreeCrtcInfo(info)
+		return crtcs
+
+	def _find_screens(self):
+		"""Add an output for each X screen that supports XF86VidMode gamma ramps."""
+		for screen in range(Xlib.XScreenCount(self.display)):
+			size = c_int(0)
+			Xf86vm.XF86VidModeGetGammaRampSize(self.display, screen, byref(size))
+			if size.value > 0:
+				self.outputs.append(_ScreenOutput(self.display, screen, size.value))
+
+	def flush(self):
+		"""Send gamma ramp changes to the X server together."""
+		Xlib.XFlush(self.display)
@@ -0,0 +1,79 @@
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import json
+import time
+
+import AutoColorTemp
+from GammaRamp import RampBuilder
+import Simulated
+
+
+# Backend configurations to benchmark.  Latencies are in seconds.
+CONFIGURATIONS = [
+	{'name': 'ideal',        'sensor_latency': 0.0,    'noise': 0.0,  'ramp_size': 256,  'driver_latency': 0.0},
+	{'name': 'win32',        'sensor_latency': 0.0,    'noise': 0.01, 'ramp_size': 256,  'driver_latency': 0.0002},
+	{'name': 'x11-1024',     'sensor_latency': 0.0,    'noise': 0.01, 'ramp_size': 1024, 'driver_latency': 0.0005},
+	{'name': 'x11-4096',     'sensor_latency': 0.0,    'noise': 0.01, 'ramp_size': 4096, 'driver_latency': 0.0005},
+	{'name': 'ftdi-24ms',    'sensor_latency': 0.024,  'noise': 0.01, 'ramp_size': 1024, 'driver_latency': 0.0005},
+]
+
+STAGES = ['sample', 'rgb_to_temp', 'temp_to_white', 'ramp_build', 'apply']
+
+
+def _time(function, iterations):
+	"""Return mean seconds per call of function."""
+	start = time.perf_counter()
+	for _ in range(iterations):
+		function()
+	return (time.perf_counter() - start) / iterations
+
+
+def run_benchmark(config, iterations=200, white_table=None):
+	"""Benchmark each stage of an update, and whole updates, with simulated backends
+	for the configuration.  Returns dict of stage name to mean seconds per call,
+	plus updates per second."""
+	white_table = white_table if white_table is not None else AutoColorTemp.default_white_table()
+	hardware = Simulated.SimulatedHardware(curve=Simulated.daylight_curve(period=1.0),
+		latency=config['sensor_latency'], noise=config['noise'], seed=0)
+	gamma = Simulated.SimulatedGamma(config['ramp_size'], config['driver_latency'])
+	# Uncached builder so every ramp is built from scratch.
+	builder = RampBuilder(cache_size=0)
+	color = hardware.get_color()
+	temp = AutoColorTemp._rgb_to_temp(*color)
+	white = white_table.white(temp)
+	results = {}
+	results['sample'] = _time(hardware.get_color, iterations)
+	results['rgb_to_temp'] = _time(lambda: AutoColorTemp._rgb_to_temp(*color), iterations)
+	results['temp_to_white'] = _time(lambda: white_table.white(temp), iterations)
+	results['ramp_build'] = _time(lambda: builder.build(config['ramp_size'], white, gamma.gamma), iterations)
+	results['apply'] = _time(lambda: gamma.adjust_white_point(white), iterations)
+	# Whole updates, with the measured temperature printout swallowed.
+	main = AutoColorTemp.AutoColorTemp(hardware, gamma, white_table)
+	with contextlib.redirect_stdout(io.StringIO()):
+		results['update'] = _time(main.update, iterations)
+	results['updates_per_second'] = 1.0 / results['update']
+	return results
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark color temperature update stages with simulated sensor and gamma backends.')
+	parser.add_argument('-n', '--iterations', type=int, default=200, help='calls to time for each stage.  Default is 200.')
+	parser.add_argument('--json', action='store_true', help='print results as JSON')
+	args = parser.parse_args()
+
+	white_table = AutoColorTemp.default_white_table()
+	report = {}
+	for config in CONFIGURATIONS:
+		report[config['name']] = run_benchmark(config, args.iterations, white_table)
+
+	if args.json:
+		print(json.dumps(report, indent=2, sort_keys=True))
+	else:
+		print('{0:<12}'.format('config') + ''.join('{0:>17}'.format(s + ' us') for s in STAGES + ['update']) + '{0:>12}'.format('updates/s'))
+		for config in CONFIGURATIONS:
+			results = report[config['name']]
+			print('{0:<12}'.format(config['name']) +
+				''.join('{0:>17.1f}'.format(results[s] * 1e6) for s in STAGES + ['update']) +
+				'{0:>12,.0f}'.format(results['updates_per_second']))
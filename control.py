@@ -0,0 +1,41 @@
+from __future__ import print_function
+import argparse
+import json
+
+import Daemon
+import Filters
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Query or change settings of a running color temperature daemon (run.py --daemon).')
+	parser.add_argument('--socket', default=None, metavar='PATH', help='control socket of the daemon.  Default is {0}'.format(Daemon.default_socket_path()))
+	commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+	commands.required = True
+	commands.add_parser('status', help='print current temperatures, white point, and settings')
+	commands.add_parser('metrics', help='print collected metrics')
+	pin = commands.add_parser('pin', help='hold the display at a color temperature')
+	pin.add_argument('kelvin', type=float)
+	commands.add_parser('unpin', help='go back to following the sensor')
+	delay = commands.add_parser('delay', help='change the seconds between updates')
+	delay.add_argument('seconds', type=float)
+	filter = commands.add_parser('filter', help='change the sensor reading filter')
+	filter.add_argument('name', choices=('none',) + Filters.FILTERS)
+	filter.add_argument('size', type=int, nargs='?', default=None)
+	commands.add_parser('pause', help='stop updating the display')
+	commands.add_parser('resume', help='start updating the display again')
+	commands.add_parser('update', help='update the display now')
+	commands.add_parser('stop', help='shut down the daemon')
+	args = parser.parse_args()
+
+	request = dict((k, v) for k, v in vars(args).items() if k not in ('command', 'socket'))
+	command = args.command
+	if command == 'unpin':
+		command = 'pin'
+		request['kelvin'] = None
+	try:
+		response = Daemon.send_command(command, args.socket, **request)
+	except (RuntimeError, IOError, OSError) as e:
+		raise SystemExit('Error: {0}'.format(e))
+	response.pop('ok')
+	if response:
+		print(json.dumps(response, indent=2, sort_keys=True))
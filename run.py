@@ -1,16 +1,34 @@
 from __future__ import print_function
+import timeit
+# Startup is timed from here for --benchmark-startup.
+_started = timeit.default_timer()
 import argparse
 import logging
-import platform
 import time
 
 import AutoColorTemp
 
 
 log = logging.getLogger('main')
-	
+
+_startup = []
+
+def mark(stage):
+	"""Record the time a stage of startup finished."""
+	_startup.append((stage, timeit.default_timer()))
+
+def print_startup_report():
+	"""Print how long each stage of startup took."""
+	print('{0:<16}{1:>12}'.format('stage', 'ms'))
+	previous = _started
+	for stage, finished in _startup:
+		print('{0:<16}{1:>12.1f}'.format(stage, (finished - previous) * 1000.0))
+		previous = finished
+	print('{0:<16}{1:>12.1f}'.format('total', (previous - _started) * 1000.0))
+
 
 if __name__ == '__main__':
+	mark('imports')
 	print('Automatic Monitor Color Temperature Adjustment')
 	print('Copyright 2014 Tony DiCola (tony@tonydicola.com)')
 	print()
@@ -19,42 +37,154 @@ if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description='Automatically adjust display monitor color temperature to match temperature measured from sensor hardware.')
 	parser.add_argument('-v,', '--verbose', action='store_true', help='display verbose logging information')
 	action = parser.add_mutually_exclusive_group(required=True)
-	action.add_argument('-a', '--arduino', nargs=1, metavar='PORT', help='use Arduino at provided serial port')
+	action.add_argument('-a', '--arduino', nargs='+', metavar='PORT', help='use Arduino at provided serial port, or Arduinos at several ports with their readings averaged')
 	action.add_argument('-f', '--ftdi', action='store_true', help='use FT232H or compatible device')
+	action.add_argument('--schedule', nargs=1, default=None, metavar='SPEC', help='use no sensor and follow a daily schedule of comma separated HH:MM=KELVIN entries, like 07:00=6500,21:00=2700')
+	action.add_argument('--sun', nargs=2, type=float, default=None, metavar=('LATITUDE', 'LONGITUDE'), help='use no sensor and follow the sun at a location (degrees, north and east positive)')
+	action.add_argument('--subscribe', nargs='?', const='', default=None, metavar='HOST:PORT', help='use no sensor and follow color temperature updates from a host running with --publish.  Default is multicast group 239.255.67.84:4267.')
+	parser.add_argument('--publish', nargs='?', const='', default=None, metavar='HOST:PORT', help='send color temperature updates to hosts running with --subscribe, at a multicast group or a host address.  Default is multicast group 239.255.67.84:4267.')
+	parser.add_argument('--publish-interval', nargs=1, default=[0.5], metavar='SECONDS', help='send at most one update this often with --publish, coalescing bursts of readings.  Default is 0.5 seconds.')
+	parser.add_argument('--day-temp', nargs=1, default=[6500.0], metavar='KELVIN', help='color temperature while the sun is up with --sun.  Default is 6500 kelvin.')
+	parser.add_argument('--night-temp', nargs=1, default=[2700.0], metavar='KELVIN', help='color temperature while the sun is down with --sun.  Default is 2700 kelvin.')
+	parser.add_argument('-s', '--stream', action='store_true', help='have Arduino stream readings continuously instead of polling it')
+	parser.add_argument('-b', '--binary', action='store_true', help='stream binary frames with raw counts from Arduino (use with --stream)')
+	parser.add_argument('--sensor-matrix', nargs='?', const='', default=None, metavar='FILE', help='read raw sensor counts and convert them to color temperature with a sensor to CIE XYZ matrix, the default one or loaded from FILE (3 lines of 3 values for X, Y, and Z).  Arduino streams use binary frames.')
+	parser.add_argument('--fast-i2c', action='store_true', help='talk to FT232H connected sensor at 400khz instead of 100khz')
+	parser.add_argument('--auto-range', action='store_true', help='adjust integration time and gain of FT232H connected sensor to the light level')
+	parser.add_argument('--threshold', nargs=1, default=None, metavar='FRACTION', help='only read FT232H connected sensor after clear channel changes by this fraction')
+	parser.add_argument('--wait-valid', action='store_true', help='wait for FT232H connected sensor to finish integrating before reading')
 	parser.add_argument('-d', '--delay', nargs=1, default=[10], metavar='SECONDS', help='amount of seconds to wait between updates.  Default is 10 seconds.')
+	parser.add_argument('--budget', nargs=1, default=None, metavar='SECONDS', help='longest a sensor reading may take before the display is held at its last white point and the sensor is reconnected in the background.  0 turns this off and exits on sensor errors.  Default is the longest the sensor can take to answer or time out, plus 1 second.')
+	parser.add_argument('--filter', nargs=1, default=None, choices=('ema', 'median', 'kalman'), help='filter sensor readings to reject noise')
+	parser.add_argument('--filter-size', nargs=1, default=[5], metavar='SAMPLES', help='number of samples filtered over.  Default is 5.')
+	parser.add_argument('-p', '--pipeline', action='store_true', help='sample sensor, compute, and update gamma on separate threads')
+	parser.add_argument('--backend', nargs=1, default=None, metavar='NAME', help='gamma adjustment backend (x11, drm, macosx, win32, simulated, or an installed plugin).  Default is picked for the platform.')
+	parser.add_argument('--drm', nargs='?', const='', default=None, metavar='DEVICE', help='same as --backend drm, optionally of the specified /dev/dri/card device.  DRM/KMS is used automatically on Linux without an X display.')
 	parser.add_argument('-g', '--gamma', nargs=3, default=None, metavar='VALUE', help='override gamma to specified RGB values')
+	parser.add_argument('-c', '--calibration', action='append', default=[], metavar='[OUTPUT=]FILE', help='correct display response with an ICC profile vcgt tag or a text LUT file, for all outputs or just the named one.  Can be repeated.')
+	parser.add_argument('-t', '--transition', nargs=1, default=[0.0], metavar='SECONDS', help='fade between color temperatures over this many seconds.  Default is 0 (no fade).')
+	parser.add_argument('--fps', nargs=1, default=[30.0], metavar='FRAMES', help='frames per second of color temperature fades.  Default is 30.')
+	parser.add_argument('-w', '--white-table', nargs=1, default=None, metavar='FILE', help='cache precomputed white point table in specified file')
+	parser.add_argument('--deadband', nargs=1, default=[0.0], metavar='KELVIN', help='skip updates that change color temperature by less than this amount.  Default is 0 kelvin.')
+	parser.add_argument('--deadband-delta-e', nargs=1, default=[0.0], metavar='DELTA_E', help='skip updates that change the white point by less than this CIE76 delta E.  Default is 0.')
+	parser.add_argument('--white-step', nargs=1, default=[1.0], metavar='MIREDS', help='spacing of white point table entries in mireds.  Default is 1 mired.')
+	parser.add_argument('--metrics-port', nargs=1, default=None, metavar='PORT', help='serve Prometheus metrics over HTTP on this localhost port')
+	parser.add_argument('--metrics-json', nargs=1, default=None, metavar='FILE', help='periodically write metrics as JSON to specified file')
+	parser.add_argument('--metrics-interval', nargs=1, default=[60.0], metavar='SECONDS', help='seconds between JSON metrics writes.  Default is 60 seconds.')
+	parser.add_argument('-r', '--record', nargs=1, default=None, metavar='FILE', help='append every reading to a binary measurement log (single sensor without --pipeline)')
+	parser.add_argument('-D', '--daemon', action='store_true', help='run as a daemon controlled over a Unix socket (see control.py)')
+	parser.add_argument('--socket', nargs=1, default=None, metavar='PATH', help='path of daemon control socket')
+	parser.add_argument('--no-probe-cache', action='store_true', help='probe sensors and displays from scratch instead of using what was found on the last run')
+	parser.add_argument('--benchmark-startup', action='store_true', help='report how long each stage of startup takes, after one update, and exit')
 	args = parser.parse_args()
+	scheduled = args.schedule is not None or args.sun is not None
+	if args.daemon:
+		for option, value in (('--schedule', args.schedule), ('--sun', args.sun), ('--subscribe', args.subscribe)):
+			if value is not None:
+				parser.error('--daemon reads a sensor and does not work with {0}'.format(option))
+		if args.pipeline or (args.arduino is not None and len(args.arduino) > 1):
+			parser.error('--daemon works with a single sensor and without --pipeline')
+	if args.record is not None and (args.pipeline or (args.arduino is not None and len(args.arduino) > 1)):
+		parser.error('--record works with a single sensor and without --pipeline')
+	if args.pipeline and args.arduino is not None and len(args.arduino) > 1:
+		parser.error('--pipeline works with a single sensor, several are always read concurrently')
+	if args.publish is not None and (args.subscribe is not None or (args.arduino is not None and len(args.arduino) > 1)):
+		parser.error('--publish works with a single sensor or a schedule')
+
+	# Check fleet addresses before setting up sensors and displays.
+	address = None
+	if args.publish is not None or args.subscribe is not None:
+		import Fleet
+		try:
+			address = Fleet.parse_address(args.publish or args.subscribe or None)
+		except ValueError as e:
+			parser.error(str(e))
+
+	# Check a schedule or location before setting up sensors and displays.
+	source = None
+	if scheduled:
+		import Schedule
+		try:
+			if args.schedule is not None:
+				source = Schedule.Schedule.parse(args.schedule[0])
+			else:
+				source = Schedule.SunSchedule(args.sun[0], args.sun[1], float(args.day_temp[0]), float(args.night_temp[0]))
+		except ValueError as e:
+			parser.error(str(e))
 
 	# Initialize logging.
 	logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
 
-	# Initialize hardware color sensor connection.
-	hardware = None
+	# Collect and export metrics if requested.
+	exporters = []
+	if args.metrics_port is not None or args.metrics_json is not None:
+		import Metrics
+		Metrics.registry.enabled = True
+		if args.metrics_port is not None:
+			exporters.append(Metrics.MetricsServer(int(args.metrics_port[0])))
+			log.info('Serving metrics on port: {0}'.format(exporters[-1].port))
+		if args.metrics_json is not None:
+			exporters.append(Metrics.JsonDumper(args.metrics_json[0], float(args.metrics_interval[0])))
+			log.info('Writing metrics to: {0}'.format(args.metrics_json[0]))
+
+	# Remember what was found probing hardware to speed up the next start.
+	cache = None
+	if not args.no_probe_cache:
+		import ProbeCache
+		cache = ProbeCache.ProbeCache()
+	mark('setup')
+
+	# Initialize hardware color sensor connections.  Each sensor is created by a
+	# function so it can be created again to reconnect.
+	factories = []
 	if args.ftdi:
 		log.info('Using FT232H compatible hardware.')
 		import FT232Hardware
-		hardware = FT232Hardware.FT232Hardware()
-	else:
-		port = args.arduino[0]
-		log.info('Using Arduino hardware at port: {0}'.format(port))
+		bus_hz = FT232Hardware.I2C_FAST_BUS_HZ if args.fast_i2c else FT232Hardware.I2C_BUS_HZ
+		threshold = float(args.threshold[0]) if args.threshold is not None else None
+		factories.append(lambda: FT232Hardware.FT232Hardware(bus_hz=bus_hz, wait_valid=args.wait_valid,
+			auto_range=args.auto_range, threshold=threshold))
+	elif args.arduino is not None:
 		import ArduinoHardware
-		hardware = ArduinoHardware.ArduinoHardware(port)
-
-	# Initialize platform-specific gamma adjustment.
-	gamma = None
-	sys = platform.system()
-	log.info('Detected system as: {0}'.format(sys))
-	if sys == 'Darwin':
-		import MacOSXGamma
-		gamma = MacOSXGamma.MacOSXGamma()
-	elif sys == 'Linux':
-		import X11Gamma
-		gamma = X11Gamma.X11Gamma()
-	elif sys == 'Windows':
-		import Win32Gamma
-		gamma = Wind32Gamma.Win32Gamma()
+		for port in args.arduino:
+			log.info('Using Arduino hardware at port: {0}'.format(port))
+			factories.append(lambda port=port: ArduinoHardware.ArduinoHardware(port, stream=args.stream,
+				binary=args.binary or args.sensor_matrix is not None, cache=cache))
+
+	# Supervise sensors so a device that stops answering or is unplugged holds
+	# the display as it is while it's reconnected in the background.
+	budget = float(args.budget[0]) if args.budget is not None else None
+	if budget is None or budget > 0.0:
+		import Supervisor
+		sensors = [Supervisor.SupervisedHardware(factory, budget) for factory in factories]
 	else:
-		raise RuntimeError('Could not find gamma adjustment for platform: {0}'.format(sys))
+		sensors = [factory() for factory in factories]
+
+	# Filter sensor readings if requested.
+	if args.filter is not None:
+		import Filters
+		log.info('Using {0} filter.'.format(args.filter[0]))
+		sensors = [Filters.FilteredHardware(s, Filters.create_filter(args.filter[0], int(args.filter_size[0]))) for s in sensors]
+	mark('sensors')
+
+	# Initialize gamma adjustment, with the named backend or the default for
+	# this platform.  Only the chosen backend's module and native libraries are
+	# loaded.
+	import GammaBackend
+	backend_name = args.backend[0] if args.backend is not None else None
+	backend_args = {}
+	if args.drm is not None:
+		backend_name = 'drm'
+		if args.drm:
+			backend_args['device'] = args.drm
+	if backend_name is None:
+		backend_name = GammaBackend.default_name()
+	# Plugins may not subclass GammaBackend, so may not say if they take a cache.
+	if getattr(GammaBackend.get(backend_name), 'probe_cache', False):
+		backend_args['cache'] = cache
+	gamma = GammaBackend.create(backend_name, **backend_args)
+	if cache is not None:
+		cache.save()
 
 	# Override monitor gamma if specified in arguments.
 	if args.gamma is not None:
@@ -62,22 +192,128 @@ if __name__ == '__main__':
 		log.info('Using gamma override of: red={0} green={1} blue={2}'.format(gamma_r, gamma_g, gamma_b))
 		gamma.set_gamma((gamma_r, gamma_g, gamma_b))
 
-	# Initialize color temperature adjust logic.
-	main = AutoColorTemp.AutoColorTemp(hardware, gamma)
+	# Load display calibration, which is fused into the gamma ramps.
+	if args.calibration:
+		import Calibration
+		if not getattr(gamma, 'calibrated', False):
+			parser.error('the {0} gamma backend does not support --calibration'.format(backend_name))
+		for spec in args.calibration:
+			name, path = spec.split('=', 1) if '=' in spec else (None, spec)
+			log.info('Using calibration {0} for {1}'.format(path, name or 'all outputs'))
+			try:
+				gamma.set_calibration(Calibration.load(path), name)
+			except (IOError, OSError, ValueError) as e:
+				parser.error('could not use calibration {0}: {1}'.format(spec, e))
+
+	# Fade between color temperatures if a transition time is specified.
+	transition = float(args.transition[0])
+	if transition > 0.0:
+		import Transition
+		log.info('Using transitions of {0} seconds.'.format(transition))
+		gamma = Transition.GammaTransition(gamma, transition, float(args.fps[0]))
+	mark('gamma')
+
+	# Build or load the table of white points for each color temperature.
+	# Subscribers are sent white points already computed.
+	subscribed = args.subscribe is not None
+	white_step = float(args.white_step[0])
+	if subscribed:
+		white_table = None
+	elif args.white_table is not None:
+		log.info('Using white point table cache: {0}'.format(args.white_table[0]))
+		white_table = AutoColorTemp.WhitePointTable.load(args.white_table[0], white_step)
+	else:
+		white_table = AutoColorTemp.WhitePointTable(white_step)
+	mark('white table')
 
 	# Set delay between updates.
 	delay = float(args.delay[0])
-	print('Updating color temperature every {0} seconds.'.format(delay))
+
+	# Initialize color temperature adjust logic.  Several sensors are read
+	# concurrently and their readings averaged.
+	deadband = float(args.deadband[0])
+	deadband_delta_e = float(args.deadband_delta_e[0])
+	sensor_matrix = None
+	if args.sensor_matrix is not None and sensors:
+		import SensorMatrix
+		if args.sensor_matrix:
+			log.info('Using sensor matrix: {0}'.format(args.sensor_matrix))
+			sensor_matrix = SensorMatrix.SensorMatrix.load(args.sensor_matrix)
+		else:
+			sensor_matrix = SensorMatrix.SensorMatrix()
+	if subscribed:
+		main = Fleet.Subscriber(gamma, address)
+	elif len(sensors) > 1:
+		import AsyncController
+		main = AsyncController.AsyncController(sensors, [gamma], delay, white_table,
+			deadband=deadband, deadband_delta_e=deadband_delta_e, sensor_matrix=sensor_matrix)
+	else:
+		recorder = None
+		if args.record is not None:
+			import Recorder
+			log.info('Recording readings to: {0}'.format(args.record[0]))
+			recorder = Recorder.Recorder(args.record[0])
+		publisher = None
+		if args.publish is not None:
+			log.info('Publishing updates to: {0}:{1}'.format(*address))
+			publisher = Fleet.Publisher(address, float(args.publish_interval[0]))
+		main = AutoColorTemp.AutoColorTemp(sensors[0] if sensors else None, gamma, white_table,
+			deadband=deadband, deadband_delta_e=deadband_delta_e, recorder=recorder, publisher=publisher,
+			sensor_matrix=sensor_matrix)
+	mark('controller')
+
+	# Report startup time after the first update, which loads the color
+	# conversion code, and quit.
+	if args.benchmark_startup:
+		try:
+			if len(sensors) == 1:
+				main.update()
+				mark('first update')
+		finally:
+			main.close()
+		print_startup_report()
+		raise SystemExit(0)
+
+	# Without a sensor, follow a schedule or the sun and only wake up when the
+	# temperature changes.
+	if scheduled:
+		main = Schedule.Scheduler(main, source)
+		print('Updating color temperature on schedule.')
+	elif subscribed:
+		print('Following color temperature updates sent to {0}:{1}.'.format(*main.address))
+	else:
+		print('Updating color temperature every {0} seconds.'.format(delay))
 
 	# Main loop to update color temperature.
 	print('Press Ctrl-C to quit.')
 	try:
-		while True:
-			main.update()
-			time.sleep(delay)
+		if scheduled or subscribed:
+			main.run()
+		elif len(sensors) > 1:
+			import asyncio
+			log.info('Reading {0} sensors concurrently.'.format(len(sensors)))
+			asyncio.run(main.run())
+		elif args.daemon:
+			import Daemon
+			import Metrics
+			# Collect metrics so clients can query them.
+			Metrics.registry.enabled = True
+			filter_name = args.filter[0] if args.filter is not None else 'none'
+			Daemon.Daemon(main, delay, args.socket[0] if args.socket is not None else None,
+				filter_name, int(args.filter_size[0])).run()
+		elif args.pipeline:
+			import Pipeline
+			log.info('Using threaded pipeline.')
+			Pipeline.Pipeline(main, delay).run()
+		else:
+			while True:
+				main.update()
+				time.sleep(delay)
 	except KeyboardInterrupt:
 		log.info('Received keyboard interrupt, shutting down.')
 	except Exception as e:
 		log.error(str(e))
 	finally:
 		main.close()
+		for exporter in exporters:
+			exporter.close()
@@ -0,0 +1,199 @@
+import os
+import struct
+import threading
+import time
+import unittest
+try:
+	from unittest import mock
+except ImportError:
+	import mock
+
+import ArduinoHardware
+import ProbeCache
+
+
+def frame(sequence, r, g, b, c):
+	payload = struct.pack('<HHHHH', sequence, r, g, b, c)
+	checksum = 0
+	for byte in bytearray(payload):
+		checksum ^= byte
+	return ArduinoHardware.FRAME_SYNC + payload + struct.pack('B', checksum)
+
+
+class FakeSerial(object):
+	"""Fake serial port which answers '?' with a line and 'c' with a frame, and
+	streams the given data after a subscribe command."""
+
+	def __init__(self, stream_data=b'', line=b'0.50000,0.25000,0.12500\r\n', counts_frame=b'', delay=0.0):
+		self.stream_data = stream_data
+		self.line = line
+		# Seconds taken to answer '?', the sketch reads the sensor first.
+		self.delay = delay
+		self.timeout = None
+		self.counts_frame = counts_frame
+		self.written = []
+		self.opened = False
+		self._pending = b''
+		self._lock = threading.Condition()
+
+	def write(self, data):
+		self.written.append(data)
+		with self._lock:
+			if data in (b's', b'b'):
+				self._pending += self.stream_data
+				self._lock.notify_all()
+			elif data == b'c':
+				self._pending += self.counts_frame
+				self._lock.notify_all()
+
+	def open(self):
+		self.opened = True
+
+	def flush(self):
+		pass
+
+	def flushInput(self):
+		pass
+
+	def inWaiting(self):
+		return len(self._pending)
+
+	def read(self, size):
+		with self._lock:
+			if not self._pending:
+				self._lock.wait(0.01)
+			data = self._pending[:size]
+			self._pending = self._pending[size:]
+			return data
+
+	def readline(self):
+		if self.written and self.written[-1] == b'?':
+			if self.delay > self.timeout:
+				threading.Event().wait(self.timeout)
+				return b''
+			threading.Event().wait(self.delay)
+			return self.line
+		with self._lock:
+			if b'\n' not in self._pending:
+				self._lock.wait(0.01)
+				return b''
+			line, _, self._pending = self._pending.partition(b'\n')
+			return line + b'\n'
+
+	def close(self):
+		pass
+
+
+class TestArduinoHardware(unittest.TestCase):
+
+	def open(self, fake, **kwargs):
+		with mock.patch.object(ArduinoHardware.serial, 'Serial', return_value=fake), \
+			mock.patch.object(ArduinoHardware.time, 'sleep') as sleep:
+			hardware = ArduinoHardware.ArduinoHardware('/dev/null', timeout=0.2, **kwargs)
+		self.sleep = sleep
+		self.addCleanup(hardware.close)
+		return hardware
+
+	def test_running_board_skips_reset_wait(self):
+		fake = FakeSerial()
+		self.open(fake)
+
+		self.assertTrue(fake.opened)
+		self.assertFalse(fake.dtr)
+		self.assertFalse(self.sleep.called)
+
+	def test_waits_for_reset_when_board_does_not_answer(self):
+		fake = FakeSerial(line=b'')
+		self.open(fake)
+
+		self.assertTrue(self.sleep.called)
+
+	def test_board_answering_after_a_reading_skips_reset_wait(self):
+		fake = FakeSerial(delay=ArduinoHardware.INTEGRATION[0] + 0.05)
+		self.open(fake)
+
+		self.assertFalse(self.sleep.called)
+
+	def test_cache_remembers_board_does_not_stream(self):
+		cache = ProbeCache.ProbeCache(os.devnull)
+		self.open(FakeSerial(), stream=True, cache=cache)
+		fake = FakeSerial()
+		hardware = self.open(fake, stream=True, cache=cache)
+
+		self.assertFalse(hardware.stream)
+		self.assertEqual(fake.written, [b'?'])
+
+	def test_cached_board_does_not_stream_expires(self):
+		cache = ProbeCache.ProbeCache(os.devnull)
+		key = 'arduino-stream /dev/null'
+		expired = time.time() - ArduinoHardware.STREAM_CACHE_SECONDS - 1.0
+		for value in ({'stream': False, 'checked': expired}, False):
+			cache.set(key, value)
+			fake = FakeSerial(stream_data=frame(0, 100, 200, 300, 400))
+			hardware = self.open(fake, stream=True, binary=True, cache=cache)
+
+			# Checked again, and now it streams so it's no longer cached.
+			self.assertTrue(hardware.stream)
+			self.assertIsNone(cache.get(key))
+
+	def test_polled_reading(self):
+		fake = FakeSerial()
+		hardware = self.open(fake)
+
+		self.assertEqual(hardware.get_color(), (0.5, 0.25, 0.125))
+		self.assertEqual(fake.written, [b'?', b'?'])
+
+	def test_polled_counts(self):
+		fake = FakeSerial(counts_frame=frame(0, 100, 200, 300, 400))
+		hardware = self.open(fake)
+
+		self.assertEqual(hardware.get_counts(), (100, 200, 300, 400))
+		self.assertEqual(hardware.last_counts, (100, 200, 300, 400))
+		self.assertEqual(fake.written, [b'?', b'c'])
+
+	def test_polled_counts_bad_frame(self):
+		corrupt = bytearray(frame(0, 100, 200, 300, 400))
+		corrupt[-1] ^= 0xFF
+		hardware = self.open(FakeSerial(counts_frame=bytes(corrupt)))
+		self.assertRaises(RuntimeError, hardware.get_counts)
+		# An older sketch doesn't answer.
+		hardware = self.open(FakeSerial())
+		self.assertRaises(RuntimeError, hardware.get_counts)
+
+	def test_binary_stream_fills_ring_buffer(self):
+		# Include garbage and a corrupt frame, which should be skipped.
+		corrupt = bytearray(frame(9, 1, 2, 3, 4))
+		corrupt[-1] ^= 0xFF
+		data = b'\x00\xa5' + frame(1, 100, 200, 300, 400) + bytes(corrupt) + frame(2, 50, 50, 50, 100) + frame(3, 10, 20, 30, 40)
+		fake = FakeSerial(data)
+		hardware = self.open(fake, stream=True, binary=True, buffer_size=2)
+
+		for _ in range(100):
+			if hardware.recent() and hardware.recent()[-1].sequence == 3:
+				break
+			time.sleep(0.01)
+		samples = hardware.recent()
+
+		self.assertTrue(hardware.stream)
+		self.assertEqual([s.sequence for s in samples], [2, 3])
+		self.assertEqual(samples[-1].counts, (10, 20, 30, 40))
+		self.assertEqual(hardware.get_color(), (0.25, 0.5, 0.75))
+		self.assertEqual(hardware.get_counts(), (10, 20, 30, 40))
+		self.assertEqual(fake.written, [b'?', b'b'])
+
+	def test_text_stream(self):
+		fake = FakeSerial(b'0.10000,0.20000,0.30000\r\n')
+		hardware = self.open(fake, stream=True)
+
+		self.assertTrue(hardware.stream)
+		self.assertEqual(hardware.get_color(), (0.1, 0.2, 0.3))
+		# Text lines have no raw counts.
+		self.assertRaises(RuntimeError, hardware.get_counts)
+
+	def test_falls_back_to_polling_without_stream(self):
+		fake = FakeSerial()
+		hardware = self.open(fake, stream=True, binary=True)
+
+		self.assertFalse(hardware.stream)
+		self.assertEqual(hardware.get_color(), (0.5, 0.25, 0.125))
+		self.assertEqual(fake.written, [b'?', b'b', b'x', b'?'])
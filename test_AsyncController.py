@@ -0,0 +1,146 @@
+import asyncio
+import time
+import unittest
+
+import AsyncController
+import Metrics
+import SensorMatrix
+
+
+class SlowHardware(object):
+	def __init__(self, color, latency):
+		self.color = color
+		self.latency = latency
+		self.reads = 0
+
+	def get_color(self):
+		time.sleep(self.latency)
+		self.reads += 1
+		return self.color
+
+	def get_counts(self):
+		self.reads += 1
+		return tuple(int(1000 * c) for c in self.color) + (1000,)
+
+
+class SteadyHardware(SlowHardware):
+	"""Reports the light unchanged after the first reading."""
+
+	def __init__(self, color):
+		super(SteadyHardware, self).__init__(color, 0.0)
+
+	def light_changed(self):
+		return self.reads == 0
+
+
+class BrokenHardware(object):
+	def get_color(self):
+		raise RuntimeError('Sensor unplugged.')
+
+
+class RecordingGamma(object):
+	def __init__(self, latency=0.0):
+		self.latency = latency
+		self.whites = []
+
+	def adjust_white_point(self, white):
+		time.sleep(self.latency)
+		self.whites.append(white)
+
+
+class TestAsyncController(unittest.TestCase):
+
+	def run_controller(self, controller, seconds):
+		async def run():
+			try:
+				await asyncio.wait_for(controller.run(), seconds)
+			except asyncio.TimeoutError:
+				pass
+		asyncio.run(run())
+
+	def test_fuse_weighted_average(self):
+		controller = AsyncController.AsyncController(
+			[AsyncController.Sensor(None, 3.0), AsyncController.Sensor(None, 1.0), AsyncController.Sensor(None)], [], 1.0)
+		controller.sensors[0].color = (1.0, 0.0, 0.5)
+		controller.sensors[1].color = (0.0, 1.0, 0.5)
+
+		self.assertEqual(controller.fuse(), (0.75, 0.25, 0.5))
+		self.assertEqual(controller.fuse([1]), (0.0, 1.0, 0.5))
+		self.assertIsNone(controller.fuse([2]))
+
+	def test_slow_sensor_does_not_hold_up_fast_one(self):
+		fast = SlowHardware((1.0, 0.5, 0.0), 0.0)
+		slow = SlowHardware((0.8, 0.8, 1.0), 0.7)
+		controller = AsyncController.AsyncController([fast, slow], [RecordingGamma()], 0.02)
+
+		self.run_controller(controller, 0.5)
+
+		self.assertGreater(fast.reads, 5)
+		self.assertLessEqual(slow.reads, 1)
+
+	def test_displays_follow_their_own_sensors(self):
+		warm = SlowHardware((1.0, 0.5, 0.0), 0.0)
+		cool = SlowHardware((0.8, 0.8, 1.0), 0.0)
+		warm_gamma = RecordingGamma()
+		cool_gamma = RecordingGamma(latency=0.2)
+		controller = AsyncController.AsyncController([warm, cool],
+			[AsyncController.Display(warm_gamma, [0]), AsyncController.Display(cool_gamma, [1])], 0.02)
+
+		self.run_controller(controller, 0.5)
+
+		self.assertGreater(len(warm_gamma.whites), 0)
+		self.assertGreater(len(cool_gamma.whites), 0)
+		# Warm light gives a white point with less blue.
+		self.assertLess(warm_gamma.whites[-1][2], cool_gamma.whites[-1][2])
+
+	def test_unchanged_light_is_not_read_again(self):
+		steady = SteadyHardware((1.0, 0.5, 0.0))
+		gamma = RecordingGamma()
+		controller = AsyncController.AsyncController([steady], [gamma], 0.02)
+
+		self.run_controller(controller, 0.3)
+
+		self.assertEqual(steady.reads, 1)
+		self.assertEqual(len(gamma.whites), 1)
+
+	def test_display_wakes_only_for_its_own_sensors(self):
+		steady = SteadyHardware((1.0, 0.5, 0.0))
+		busy = SlowHardware((0.8, 0.8, 1.0), 0.0)
+		controller = AsyncController.AsyncController([steady, busy],
+			[AsyncController.Display(RecordingGamma(), [0]), AsyncController.Display(RecordingGamma(), [1])], 0.02)
+		processed = []
+		main = controller.displays[0].main
+		process = main.process
+		def record(color):
+			processed.append(color)
+			return process(color)
+		main.process = record
+
+		self.run_controller(controller, 0.3)
+
+		self.assertGreater(busy.reads, 5)
+		self.assertEqual(processed, [(1.0, 0.5, 0.0)])
+
+	def test_sensor_matrix_fuses_counts(self):
+		warm = SlowHardware((1.2, 1.0, 0.8), 0.0)
+		cool = SlowHardware((1.0, 1.0, 1.0), 0.0)
+		gamma = RecordingGamma()
+		matrix = SensorMatrix.SensorMatrix(ir_rejection=False)
+		controller = AsyncController.AsyncController([warm, cool], [gamma], 0.02, sensor_matrix=matrix)
+
+		self.run_controller(controller, 0.3)
+
+		self.assertEqual(controller.fuse(), (1100.0, 1000.0, 900.0, 1000.0))
+		self.assertGreater(len(gamma.whites), 0)
+		self.assertEqual(controller.displays[0].main.measured_temp, matrix.temp(controller.fuse()))
+
+	def test_sensor_errors_are_counted(self):
+		Metrics.registry.reset()
+		Metrics.registry.enabled = True
+		self.addCleanup(Metrics.registry.reset)
+		self.addCleanup(setattr, Metrics.registry, 'enabled', False)
+		controller = AsyncController.AsyncController([BrokenHardware()], [RecordingGamma()], 0.02)
+
+		self.run_controller(controller, 0.1)
+
+		self.assertGreater(Metrics.registry.counters['updates_failed_total'], 0)
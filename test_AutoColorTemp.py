@@ -1,6 +1,18 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
+try:
+	from unittest import mock
+except ImportError:
+	import mock
+
+import numpy
 
 import AutoColorTemp
+import Transition
 
 
 class MockColorHardware(object):
@@ -17,6 +29,20 @@ class MockColorHardware(object):
 		self.close_called = True
 
 
+class MockCountsHardware(object):
+	def __init__(self, counts):
+		self.counts = counts
+		self.last_counts = None
+		self.integration = (0.7, 1)
+
+	def get_counts(self):
+		self.last_counts = self.counts
+		return self.counts
+
+	def close(self):
+		pass
+
+
 class MockGammaAdjust(object):
 	def __init__(self):
 		self.white = None
@@ -40,7 +66,52 @@ class TestAutoColorTemp(unittest.TestCase):
 		main.update()
 
 		self.assertTrue(hardware.get_color_called)
-		self.assertEqual(color, gamma.white)
+		expected = AutoColorTemp._temp_to_white(AutoColorTemp._rgb_to_temp(*color))
+		for c in range(3):
+			self.assertAlmostEqual(expected[c], gamma.white[c], delta=0.01)
+
+	def test_update_skips_changes_within_kelvin_deadband(self):
+		hardware = MockColorHardware((1.0, 0.5, 0.0))
+		gamma = MockGammaAdjust()
+		main = AutoColorTemp.AutoColorTemp(hardware, gamma, deadband=100.0)
+
+		main.update()
+		first = gamma.white
+		gamma.white = None
+		# Nudge the reading by a few kelvin.
+		hardware.color = (1.0, 0.501, 0.0)
+		main.update()
+
+		self.assertIsNotNone(first)
+		self.assertIsNone(gamma.white)
+		self.assertEqual(main.applied_updates, 1)
+		self.assertEqual(main.skipped_updates, 1)
+
+		# A large change is applied.
+		hardware.color = (0.8, 0.8, 1.0)
+		main.update()
+
+		self.assertIsNotNone(gamma.white)
+		self.assertEqual(main.applied_updates, 2)
+
+	def test_update_skips_changes_within_delta_e_deadband(self):
+		hardware = MockColorHardware((1.0, 0.5, 0.0))
+		gamma = MockGammaAdjust()
+		main = AutoColorTemp.AutoColorTemp(hardware, gamma, deadband_delta_e=2.0)
+
+		main.update()
+		hardware.color = (1.0, 0.501, 0.0)
+		main.update()
+		hardware.color = (0.8, 0.8, 1.0)
+		main.update()
+
+		self.assertEqual(main.applied_updates, 2)
+		self.assertEqual(main.skipped_updates, 1)
+
+	def test_white_delta_e(self):
+		self.assertAlmostEqual(AutoColorTemp._white_delta_e((1.0, 1.0, 1.0), (1.0, 1.0, 1.0)), 0.0)
+		# Dropping blue from white is a large, perceptible change.
+		self.assertGreater(AutoColorTemp._white_delta_e((1.0, 1.0, 1.0), (1.0, 1.0, 0.5)), 10.0)
 
 	def test_close_restores_gamma(self):
 		hardware = MockColorHardware()
@@ -53,17 +124,53 @@ class TestAutoColorTemp(unittest.TestCase):
 
 		self.assertTrue(gamma.restore_called)
 
+	def test_close_closes_gamma(self):
+		for wrap in (lambda gamma: gamma, Transition.GammaTransition):
+			gamma = MockGammaAdjust()
+			gamma.close = mock.Mock()
+			main = AutoColorTemp.AutoColorTemp(MockColorHardware(), wrap(gamma))
+
+			main.close()
+
+			self.assertTrue(gamma.restore_called)
+			gamma.close.assert_called_once_with()
+
 	def test_close_closes_hardware(self):
 		hardware = MockColorHardware()
 		gamma = MockGammaAdjust()
 		main = AutoColorTemp.AutoColorTemp(hardware, gamma)
 
-		self.assertFalse(hardware.close_called
+		self.assertFalse(hardware.close_called)
 
 		main.close()
 
 		self.assertTrue(hardware.close_called)
 
+	def test_import_defers_colormath(self):
+		loaded = subprocess.check_output([sys.executable, '-c',
+			'import sys, AutoColorTemp; print("colormath" in sys.modules)'],
+			cwd=os.path.dirname(os.path.abspath(__file__)))
+
+		self.assertEqual(loaded.strip(), b'False')
+
+	def test_update_with_sensor_matrix_uses_counts(self):
+		# Run without colormath loaded to check raw counts don't need it.
+		script = '\n'.join((
+			'import sys, AutoColorTemp, SensorMatrix, test_AutoColorTemp as t',
+			'gamma = t.MockGammaAdjust()',
+			'main = AutoColorTemp.AutoColorTemp(t.MockCountsHardware((1200, 1000, 800, 3000)), gamma,',
+			'	sensor_matrix=SensorMatrix.SensorMatrix())',
+			'main.update()',
+			'print(round(main.measured_temp), round(main.measured_lux, 1), gamma.white is not None, "colormath" in sys.modules)'))
+		output = subprocess.check_output([sys.executable, '-c', script],
+			cwd=os.path.dirname(os.path.abspath(__file__)))
+
+		import SensorMatrix
+		counts = (1200, 1000, 800, 3000)
+		expected = '{0} {1} True False'.format(round(SensorMatrix.SensorMatrix().temp(counts)),
+			round(SensorMatrix.dn40_lux(counts, 0.7, 1), 1))
+		self.assertEqual(output.decode('ascii').strip().splitlines()[-1], expected)
+
 	def test_rgb_to_temp(self):
 		# Pure white RGB should be 6500K temperature.
 		temp = AutoColorTemp._rgb_to_temp(1.0, 1.0, 1.0)
@@ -93,3 +200,74 @@ class TestAutoColorTemp(unittest.TestCase):
 		# Verify intermediate values are an increasing curve.
 		for i in range(1, 256):
 			self.assertGreater(ramp[i], ramp[i-1])
+
+	def test_rgb_to_temp_array_matches_scalar(self):
+		colors = numpy.random.RandomState(0).uniform(0.3, 1.0, (200, 3))
+		temps = AutoColorTemp.rgb_to_temp_array(colors)
+
+		self.assertEqual(temps.shape, (200,))
+		for color, temp in zip(colors, temps):
+			self.assertAlmostEqual(AutoColorTemp._rgb_to_temp(*color), temp, delta=1e-6)
+
+	def test_temp_to_white_array_matches_scalar(self):
+		temps = numpy.linspace(AutoColorTemp.TEMP_MIN, AutoColorTemp.TEMP_MAX, 200)
+		whites = AutoColorTemp.temp_to_white_array(temps)
+
+		self.assertEqual(whites.shape, (200, 3))
+		# Scalar results are rounded to 8 bits, array results are not.
+		for temp, white in zip(temps, whites):
+			exact = AutoColorTemp._temp_to_white(temp)
+			for c in range(3):
+				self.assertAlmostEqual(exact[c], white[c], delta=0.5/255.0 + 1e-9)
+
+	def test_temp_to_white_array_out_of_range_raises(self):
+		self.assertRaises(ValueError, AutoColorTemp.temp_to_white_array, [5000.0, 1000.0])
+
+
+class TestWhitePointTable(unittest.TestCase):
+
+	def setUp(self):
+		self.table = AutoColorTemp.WhitePointTable(step=5.0)
+
+	def test_table_covers_full_range(self):
+		self.assertEqual(self.table.temps[0], AutoColorTemp.TEMP_MIN)
+		self.assertEqual(self.table.temps[-1], AutoColorTemp.TEMP_MAX)
+		for t in (AutoColorTemp.TEMP_MIN, AutoColorTemp.TEMP_MAX):
+			exact = AutoColorTemp._temp_to_white(t)
+			white = self.table.white(t)
+			for c in range(3):
+				self.assertAlmostEqual(exact[c], white[c], delta=0.5/255.0 + 1e-9)
+
+	def test_max_error_is_bounded(self):
+		# Exact white points are quantized to 1/255 by colormath, so the table
+		# can't do much better than a quantization step.
+		self.assertLessEqual(self.table.max_error(), 1.0/255.0)
+
+	def test_white_array_matches_scalar_lookup(self):
+		temps = [1667.0, 2000.0, 4000.0, 6500.0, 12345.0, 25000.0]
+		whites = self.table.white_array(temps)
+
+		self.assertEqual(whites.shape, (len(temps), 3))
+		for t, row in zip(temps, whites):
+			white = self.table.white(t)
+			for c in range(3):
+				self.assertAlmostEqual(white[c], row[c])
+
+	def test_out_of_range_raises(self):
+		self.assertRaises(ValueError, self.table.white, 1000.0)
+		self.assertRaises(ValueError, self.table.white, 30000.0)
+		self.assertRaises(ValueError, self.table.white_array, [5000.0, 30000.0])
+
+	def test_load_builds_and_reuses_cache(self):
+		path = os.path.join(tempfile.mkdtemp(), 'whites.npz')
+		self.addCleanup(shutil.rmtree, os.path.dirname(path))
+
+		built = AutoColorTemp.WhitePointTable.load(path, step=50.0)
+		self.assertTrue(os.path.exists(path))
+		loaded = AutoColorTemp.WhitePointTable.load(path, step=50.0)
+
+		self.assertEqual(loaded.white(5000.0), built.white(5000.0))
+		self.assertEqual(len(loaded.temps), len(built.temps))
+		# A different step rebuilds the table.
+		rebuilt = AutoColorTemp.WhitePointTable.load(path, step=100.0)
+		self.assertEqual(rebuilt.step, 100.0)
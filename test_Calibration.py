@@ -0,0 +1,109 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy
+
+import Calibration
+import GammaRamp
+
+
+def icc_profile(vcgt):
+	"""Return bytes of a minimal ICC profile with only a vcgt tag."""
+	header = bytearray(128)
+	header[36:40] = b'acsp'
+	offset = 128 + 4 + 12
+	tags = struct.pack('>I4sII', 1, b'vcgt', offset, len(vcgt))
+	return bytes(header) + tags + vcgt
+
+
+class TestCalibration(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+
+	def write(self, name, data):
+		path = os.path.join(self.directory, name)
+		with open(path, 'wb') as f:
+			f.write(data)
+		return path
+
+	def test_load_lut(self):
+		path = self.write('panel.lut', b'# measured\n0 0 0\n32768, 30000, 32768\n65535 60000 65535\n')
+
+		calibration = Calibration.load(path)
+
+		self.assertEqual(calibration.curves.shape, (3, 3))
+		self.assertAlmostEqual(calibration.curves[1][2], 60000 / 65535.0)
+		self.assertAlmostEqual(calibration.apply(1, numpy.array([1.0]))[0], 60000 / 65535.0)
+
+	def test_load_icc_vcgt_table(self):
+		values = [0, 16384, 32768, 65535]
+		table = struct.pack('>4sIIHHH', b'vcgt', 0, Calibration.VCGT_TABLE, 3, 4, 2)
+		table += struct.pack('>12H', *(values + values + [v // 2 for v in values]))
+		path = self.write('panel.icc', icc_profile(table))
+
+		calibration = Calibration.load(path)
+
+		self.assertEqual(calibration.curves.shape, (3, 4))
+		self.assertAlmostEqual(calibration.curves[0][1], 16384 / 65535.0)
+		self.assertAlmostEqual(calibration.curves[2][3], 32767 / 65535.0)
+
+	def test_load_icc_vcgt_formula(self):
+		formula = struct.pack('>4sII', b'vcgt', 0, Calibration.VCGT_FORMULA)
+		for gamma, low, high in ((1.0, 0.0, 1.0), (2.0, 0.0, 1.0), (1.0, 0.0, 0.5)):
+			formula += struct.pack('>iii', int(gamma * 65536), int(low * 65536), int(high * 65536))
+		path = self.write('panel.icm', icc_profile(formula))
+
+		calibration = Calibration.load(path)
+
+		self.assertAlmostEqual(calibration.apply(0, numpy.array([0.5]))[0], 0.5, places=3)
+		self.assertAlmostEqual(calibration.apply(1, numpy.array([0.5]))[0], 0.25, places=3)
+		self.assertAlmostEqual(calibration.apply(2, numpy.array([1.0]))[0], 0.5, places=3)
+
+	def test_not_an_icc_profile(self):
+		path = self.write('bad.icc', b'\x00' * 200)
+
+		with self.assertRaises(ValueError):
+			Calibration.load(path)
+
+	def test_truncated_icc_profile(self):
+		header = bytearray(128)
+		header[36:40] = b'acsp'
+		# Tag table says there are 5 tags but the profile ends after the count.
+		path = self.write('short.icc', bytes(header) + struct.pack('>I', 5) + b'\x00' * 8)
+		with self.assertRaises(ValueError):
+			Calibration.load(path)
+
+		# Tag runs past the end of the profile.
+		table = struct.pack('>4sIIHHH', b'vcgt', 0, Calibration.VCGT_TABLE, 3, 256, 2)
+		path = self.write('cut.icc', icc_profile(table)[:-2])
+		with self.assertRaises(ValueError):
+			Calibration.load(path)
+
+		# Table has fewer entries than the tag says.
+		path = self.write('short_table.icc', icc_profile(table + b'\x00' * 12))
+		with self.assertRaises(ValueError):
+			Calibration.load(path)
+
+	def test_mismatched_curves(self):
+		with self.assertRaises(ValueError):
+			Calibration.Calibration([0.0, 1.0], [0.0, 1.0], [0.0, 0.5, 1.0])
+
+	def test_fused_into_ramp(self):
+		# Calibration halving green, and a quadratic red.
+		x = numpy.linspace(0, 1, 65)
+		calibration = Calibration.Calibration(x ** 2, x * 0.5, x)
+		builder = GammaRamp.RampBuilder()
+
+		plain = builder.build(256, (1.0, 1.0, 0.5), (1.0, 1.0, 1.0))
+		calibrated = builder.build(256, (1.0, 1.0, 0.5), (1.0, 1.0, 1.0), calibration)
+
+		self.assertIsNot(plain, calibrated)
+		self.assertIs(calibrated, builder.build(256, (1.0, 1.0, 0.5), (1.0, 1.0, 1.0), calibration))
+		self.assertEqual(calibrated.green[255], 32767)
+		self.assertAlmostEqual(calibrated.red[128], 65535 * (128 / 255.0) ** 2, delta=20)
+		self.assertEqual(list(calibrated.blue), list(plain.blue))
@@ -0,0 +1,168 @@
+from ctypes import *
+import errno
+import unittest
+
+import numpy
+
+import DRMGamma
+
+
+class FakeDRM(object):
+	"""Fake DRM device ioctls with one CRTC per entry of crtcs, a dict of CRTC ID
+	to gamma ramp size where a size of 0 is an inactive CRTC.  Atomic sets whether
+	the driver supports atomic commits with a GAMMA_LUT property."""
+
+	GAMMA_LUT = 10
+	GAMMA_LUT_SIZE = 11
+	NAMES = {10: b'GAMMA_LUT', 11: b'GAMMA_LUT_SIZE'}
+
+	def __init__(self, crtcs, atomic=True):
+		self.crtcs = crtcs
+		self.atomic = atomic
+		self.blobs = {}
+		self.next_blob = 100
+		# Current GAMMA_LUT blob contents of each CRTC, None for no LUT.
+		self.luts = dict((crtc, None) for crtc in crtcs)
+		self.legacy = {}
+		self.commits = 0
+		self.handlers = {
+			DRMGamma.DRM_IOCTL_SET_CLIENT_CAP: self.set_client_cap,
+			DRMGamma.DRM_IOCTL_MODE_GETRESOURCES: self.get_resources,
+			DRMGamma.DRM_IOCTL_MODE_GETCRTC: self.get_crtc,
+			DRMGamma.DRM_IOCTL_MODE_GETGAMMA: self.get_gamma,
+			DRMGamma.DRM_IOCTL_MODE_SETGAMMA: self.set_gamma,
+			DRMGamma.DRM_IOCTL_MODE_OBJ_GETPROPERTIES: self.get_properties,
+			DRMGamma.DRM_IOCTL_MODE_GETPROPERTY: self.get_property,
+			DRMGamma.DRM_IOCTL_MODE_GETPROPBLOB: self.get_blob,
+			DRMGamma.DRM_IOCTL_MODE_CREATEPROPBLOB: self.create_blob,
+			DRMGamma.DRM_IOCTL_MODE_DESTROYPROPBLOB: self.destroy_blob,
+			DRMGamma.DRM_IOCTL_MODE_ATOMIC: self.commit,
+		}
+
+	def ioctl(self, fd, request, arg):
+		self.handlers[request](arg)
+
+	def set_client_cap(self, arg):
+		if not self.atomic:
+			raise IOError(errno.EINVAL, 'Invalid argument')
+
+	def get_resources(self, arg):
+		ids = sorted(self.crtcs)
+		if arg.count_crtcs >= len(ids):
+			(c_uint32 * len(ids)).from_address(arg.crtc_id_ptr)[:] = ids
+		arg.count_crtcs = len(ids)
+
+	def get_crtc(self, arg):
+		arg.mode_valid = 1 if self.crtcs[arg.crtc_id] > 0 else 0
+		arg.gamma_size = self.crtcs[arg.crtc_id]
+
+	def get_gamma(self, arg):
+		for address in (arg.red, arg.green, arg.blue):
+			(c_uint16 * arg.gamma_size).from_address(address)[:] = range(arg.gamma_size)
+
+	def set_gamma(self, arg):
+		self.legacy[arg.crtc_id] = [list((c_uint16 * arg.gamma_size).from_address(a)) for a in (arg.red, arg.green, arg.blue)]
+
+	def get_properties(self, arg):
+		if arg.count_props >= 2:
+			lut = self.luts[arg.obj_id]
+			blob = 0
+			if lut is not None:
+				blob = self.next_blob
+				self.next_blob += 1
+				self.blobs[blob] = lut
+			(c_uint32 * 2).from_address(arg.props_ptr)[:] = [self.GAMMA_LUT, self.GAMMA_LUT_SIZE]
+			(c_uint64 * 2).from_address(arg.prop_values_ptr)[:] = [blob, self.crtcs[arg.obj_id]]
+		arg.count_props = 2
+
+	def get_property(self, arg):
+		arg.name = self.NAMES[arg.prop_id]
+
+	def get_blob(self, arg):
+		data = self.blobs[arg.blob_id]
+		if arg.length >= len(data):
+			memmove(arg.data, data, len(data))
+		arg.length = len(data)
+
+	def create_blob(self, arg):
+		self.blobs[self.next_blob] = string_at(arg.data, arg.length)
+		arg.blob_id = self.next_blob
+		self.next_blob += 1
+
+	def destroy_blob(self, arg):
+		del self.blobs[arg.blob_id]
+
+	def commit(self, arg):
+		objs = (c_uint32 * arg.count_objs).from_address(arg.objs_ptr)
+		counts = (c_uint32 * arg.count_objs).from_address(arg.count_props_ptr)
+		props = (c_uint32 * arg.count_objs).from_address(arg.props_ptr)
+		values = (c_uint64 * arg.count_objs).from_address(arg.prop_values_ptr)
+		for crtc, count, prop, value in zip(objs, counts, props, values):
+			assert count == 1 and prop == self.GAMMA_LUT
+			self.luts[crtc] = self.blobs[value] if value else None
+		self.commits += 1
+
+	def lut(self, crtc):
+		"""Return current GAMMA_LUT of a CRTC as an Nx4 array."""
+		return numpy.frombuffer(self.luts[crtc], dtype=numpy.uint16).reshape(-1, 4)
+
+
+class TestDRMGamma(unittest.TestCase):
+
+	def open(self, fake, **kwargs):
+		return DRMGamma.DRMGamma('/dev/dri/card0', ioctl=fake.ioctl, fd=-1, **kwargs)
+
+	def test_atomic_updates_all_crtcs_in_one_commit(self):
+		fake = FakeDRM({31: 256, 32: 0, 33: 1024})
+		gamma = self.open(fake)
+
+		gamma.adjust_white_point((1.0, 0.5, 0.25))
+
+		self.assertTrue(gamma.atomic)
+		self.assertEqual([o.name for o in gamma.outputs], ['crtc-31', 'crtc-33'])
+		self.assertEqual(fake.commits, 1)
+		lut = fake.lut(33)
+		self.assertEqual(lut.shape, (1024, 4))
+		self.assertEqual(list(lut[-1]), [65535, 32767, 16383, 0])
+		self.assertEqual(fake.lut(31).shape, (256, 4))
+		self.assertIsNone(fake.luts[32])
+		# Blobs are released once committed.
+		self.assertEqual(fake.blobs, {})
+
+	def test_atomic_per_output_and_restore(self):
+		fake = FakeDRM({31: 256, 33: 256})
+		original = numpy.arange(256 * 4, dtype=numpy.uint16).tobytes()
+		fake.luts[33] = original
+		gamma = self.open(fake)
+
+		gamma.adjust_white_point({'crtc-33': (0.5, 0.5, 0.5)})
+
+		self.assertIsNone(fake.luts[31])
+		self.assertEqual(fake.lut(33)[-1][0], 32767)
+
+		gamma.restore()
+
+		self.assertIsNone(fake.luts[31])
+		self.assertEqual(fake.luts[33], original)
+
+	def test_legacy_fallback(self):
+		fake = FakeDRM({31: 256, 32: 0}, atomic=False)
+		gamma = self.open(fake)
+
+		gamma.adjust_white_point((1.0, 0.5, 0.25))
+
+		self.assertFalse(gamma.atomic)
+		self.assertEqual(sorted(fake.legacy), [31])
+		red, green, blue = fake.legacy[31]
+		self.assertEqual(red[-1], 65535)
+		self.assertEqual(green[-1], 32767)
+
+		gamma.restore()
+
+		self.assertEqual(fake.legacy[31][0], list(range(256)))
+
+	def test_no_active_crtcs(self):
+		fake = FakeDRM({31: 0})
+
+		with self.assertRaises(RuntimeError):
+			self.open(fake)
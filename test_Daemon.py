@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import AutoColorTemp
+import Daemon
+import Filters
+import Simulated
+
+
+class TestDaemon(unittest.TestCase):
+
+	def setUp(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.path = os.path.join(directory, 'control.sock')
+		self.hardware = Simulated.SimulatedHardware(samples=[(1.0, 1.0, 1.0)])
+		self.gamma = Simulated.SimulatedGamma()
+		self.main = AutoColorTemp.AutoColorTemp(self.hardware, self.gamma)
+		self.daemon = Daemon.Daemon(self.main, 60.0, self.path)
+		self.thread = threading.Thread(target=self.daemon.run)
+		self.daemon.start()
+		self.thread.start()
+		self.addCleanup(self.thread.join)
+		self.addCleanup(self.daemon.stop)
+
+	def send(self, command, **args):
+		return Daemon.send_command(command, self.path, **args)
+
+	def wait_for(self, condition):
+		for _ in range(200):
+			if condition():
+				return
+			time.sleep(0.01)
+		self.fail('Condition never became true.')
+
+	def test_status(self):
+		self.wait_for(lambda: self.main.applied_updates == 1)
+
+		status = self.send('status')
+
+		self.assertAlmostEqual(status['measured_temp'], self.main.measured_temp)
+		self.assertEqual(status['white'], list(self.main.last_white))
+		self.assertFalse(status['paused'])
+		self.assertTrue(status['connected'])
+		self.assertEqual(status['delay'], 60.0)
+		self.assertEqual(status['filter'], 'none')
+
+	def test_pin_overrides_sensor(self):
+		self.wait_for(lambda: self.main.applied_updates == 1)
+
+		self.send('pin', kelvin=3000)
+		self.send('update')
+		time.sleep(0.05)
+
+		self.assertEqual(self.gamma.white, self.main.white_table.white(3000.0))
+		self.assertEqual(self.hardware.reads, 1)
+		self.assertEqual(self.send('status')['pinned'], 3000.0)
+
+		self.send('pin', kelvin=None)
+		self.wait_for(lambda: self.hardware.reads == 2)
+
+	def test_pin_out_of_range_is_an_error(self):
+		with self.assertRaises(RuntimeError):
+			self.send('pin', kelvin=100)
+
+	def test_pause_and_resume(self):
+		self.wait_for(lambda: self.hardware.reads == 1)
+		self.send('pause')
+		self.send('update')
+		time.sleep(0.05)
+
+		self.assertEqual(self.hardware.reads, 1)
+
+		self.send('resume')
+		self.wait_for(lambda: self.hardware.reads == 2)
+
+	def test_change_delay_and_filter(self):
+		self.send('delay', seconds=0.01)
+		self.send('filter', name='median', size=3)
+
+		self.wait_for(lambda: self.hardware.reads > 3)
+		self.assertIsInstance(self.main.hardware.filter, Filters.MedianFilter)
+		self.assertEqual(self.main.hardware.filter.size, 3)
+		with self.assertRaises(RuntimeError):
+			self.send('delay', seconds=0)
+		with self.assertRaises(RuntimeError):
+			self.send('filter', name='bogus')
+
+	def test_unknown_command(self):
+		with self.assertRaises(RuntimeError):
+			self.send('explode')
+
+	def test_unexpected_command_error_is_reported(self):
+		def broken():
+			raise KeyError('white')
+		self.daemon._commands['status'] = broken
+
+		with self.assertRaises(RuntimeError):
+			self.send('status')
+		self.send('update')
+
+	def test_update_error_does_not_stop_daemon(self):
+		self.wait_for(lambda: self.hardware.reads == 1)
+		get_color = self.hardware.get_color
+		def unplugged():
+			self.hardware.get_color = get_color
+			raise IOError('Sensor unplugged.')
+		self.hardware.get_color = unplugged
+
+		self.send('update')
+		self.send('update')
+
+		self.wait_for(lambda: self.main.applied_updates == 2)
+		self.assertTrue(self.thread.is_alive())
+
+	def test_stop_removes_socket(self):
+		self.send('stop')
+		self.thread.join(5.0)
+
+		self.assertFalse(self.thread.is_alive())
+		self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,313 @@
+import importlib
+import struct
+import sys
+import types
+import unittest
+try:
+	from unittest import mock
+except ImportError:
+	import mock
+
+import AutoColorTemp
+import SensorMatrix
+
+
+class FakeMPSSE(object):
+	"""Fake MPSSE I2C interface to a TCS34725 with the given register values."""
+
+	def __init__(self, mode, frequency, endianness):
+		self.frequency = frequency
+		self.registers = bytearray(128)
+		self.registers[0x12] = 0x44
+		self.transactions = 0
+		# Number of times the ADCs were disabled to restart integration.
+		self.enables = 0
+		self._in_transaction = False
+		self._pointer = 0
+		self._auto_increment = False
+		# Clear channel counts per second at 1x gain when simulating light.
+		self.light = None
+
+	def SendAcks(self):
+		pass
+
+	def SendNacks(self):
+		pass
+
+	def Start(self):
+		# Repeated starts are part of the same transaction.
+		if not self._in_transaction:
+			self.transactions += 1
+		self._in_transaction = True
+
+	def Write(self, data):
+		data = bytearray(data)
+		if data[0] & 1:
+			return
+		command = data[1]
+		if command & 0x60 == 0x60:
+			# Special function to clear the interrupt flag.
+			self.registers[0x13] &= ~0x10
+			return
+		self._auto_increment = bool(command & 0x20)
+		self._pointer = command & 0x1F
+		for i, value in enumerate(data[2:]):
+			self.registers[self._pointer + (i if self._auto_increment else 0)] = value
+		if self._pointer == 0x00 and len(data) > 2 and not data[2] & 0x02:
+			# Disabling the ADCs clears AVALID until the next cycle completes.
+			self.registers[0x13] &= ~0x01
+			self.enables += 1
+
+	def _integrate(self):
+		"""Fill data registers with counts for the simulated light level."""
+		cycles = 256 - self.registers[0x01]
+		gain = (1, 4, 16, 60)[self.registers[0x0F]]
+		clear = min(self.light * cycles * 0.0024 * gain, min(65535, cycles * 1024))
+		counts = [int(clear), int(clear / 2), int(clear / 4), int(clear / 8)]
+		self.registers[0x14:0x1C] = struct.pack('<HHHH', *counts)
+		self.registers[0x13] |= 0x01
+		# Raise the interrupt when enabled and clear is outside the thresholds.
+		low, high = struct.unpack('<HH', bytes(self.registers[0x04:0x08]))
+		if self.registers[0x00] & 0x10 and not low <= counts[0] <= high:
+			self.registers[0x13] |= 0x10
+
+	def Read(self, count):
+		if self.light is not None:
+			self._integrate()
+		value = bytearray()
+		for _ in range(count):
+			value.append(self.registers[self._pointer])
+			if self._auto_increment:
+				self._pointer += 1
+		return bytes(value)
+
+	def Stop(self):
+		self._in_transaction = False
+
+	def Close(self):
+		pass
+
+
+class FT232TestCase(unittest.TestCase):
+	"""Imports FT232Hardware with a fake mpsse module, the real one talks to FTDI
+	hardware."""
+
+	def setUp(self):
+		global FT232Hardware
+		mpsse = types.ModuleType('mpsse')
+		mpsse.MPSSE = FakeMPSSE
+		mpsse.I2C = 'I2C'
+		mpsse.MSB = 'MSB'
+		patcher = mock.patch.dict(sys.modules, {'mpsse': mpsse})
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		sys.modules.pop('FT232Hardware', None)
+		FT232Hardware = importlib.import_module('FT232Hardware')
+
+
+class TestFT232Hardware(FT232TestCase):
+
+	def test_get_color_reads_all_channels_in_one_transaction(self):
+		hardware = FT232Hardware.FT232Hardware()
+		hardware.mpsse.registers[0x14:0x1C] = struct.pack('<HHHH', 1000, 500, 250, 125)
+		hardware.mpsse.transactions = 0
+
+		color = hardware.get_color()
+
+		self.assertEqual(color, (0.5, 0.25, 0.125))
+		self.assertEqual(hardware.mpsse.transactions, 1)
+
+	def test_get_counts(self):
+		hardware = FT232Hardware.FT232Hardware()
+		hardware.mpsse.registers[0x14:0x1C] = struct.pack('<HHHH', 1000, 500, 250, 125)
+
+		self.assertEqual(hardware.get_counts(), (500, 250, 125, 1000))
+		self.assertEqual(hardware.last_counts, (500, 250, 125, 1000))
+		# Default range of 700ms integration with 1x gain.
+		self.assertEqual(hardware.integration, (0.7, 1))
+
+	def test_bus_speed(self):
+		self.assertEqual(FT232Hardware.FT232Hardware().mpsse.frequency, FT232Hardware.I2C_BUS_HZ)
+		fast = FT232Hardware.FT232Hardware(bus_hz=FT232Hardware.I2C_FAST_BUS_HZ)
+		self.assertEqual(fast.mpsse.frequency, 400000)
+
+	def test_wait_valid_polls_status(self):
+		hardware = FT232Hardware.FT232Hardware(wait_valid=True)
+		hardware.mpsse.light = 10000.0
+		hardware.mpsse.transactions = 0
+
+		hardware.get_color()
+
+		# Two writes to restart integration, one status read, and one data read.
+		self.assertEqual(hardware.mpsse.transactions, 4)
+
+	def test_wait_valid_ignores_stale_cycle(self):
+		hardware = FT232Hardware.FT232Hardware(wait_valid=True, timeout=0.01)
+		# AVALID is still set from a cycle that completed before this reading.
+		hardware.mpsse.registers[FT232Hardware.TCS34725_STATUS] = FT232Hardware.TCS34725_STATUS_AVALID
+		enables = hardware.mpsse.enables
+
+		self.assertRaises(RuntimeError, hardware.get_color)
+		self.assertEqual(hardware.mpsse.enables, enables + 1)
+
+	def test_wait_valid_keeps_interrupt_enabled(self):
+		hardware = FT232Hardware.FT232Hardware(wait_valid=True, threshold=0.1)
+		hardware.mpsse.light = 10000.0
+		hardware.get_color()
+		hardware.get_color()
+
+		self.assertTrue(hardware.mpsse.registers[FT232Hardware.TCS34725_ENABLE] & FT232Hardware.TCS34725_ENABLE_AIEN)
+
+	def test_max_read_seconds(self):
+		self.assertEqual(FT232Hardware.FT232Hardware().max_read_seconds, 0.0)
+		self.assertEqual(FT232Hardware.FT232Hardware(wait_valid=True, timeout=1.5).max_read_seconds, 1.5)
+		# Auto ranging can wait for up to 3 more integrations.
+		self.assertEqual(FT232Hardware.FT232Hardware(wait_valid=True, auto_range=True).max_read_seconds, 8.0)
+
+	def test_wait_valid_times_out(self):
+		hardware = FT232Hardware.FT232Hardware(wait_valid=True, timeout=0.01)
+
+		self.assertRaises(RuntimeError, hardware.get_color)
+
+
+class TestFT232HardwareAutoRange(FT232TestCase):
+
+	def setUp(self):
+		super(TestFT232HardwareAutoRange, self).setUp()
+		self.sleep = FT232Hardware.time.sleep
+		FT232Hardware.time.sleep = lambda seconds: None
+		self.addCleanup(setattr, FT232Hardware.time, 'sleep', self.sleep)
+
+	def read(self, light):
+		hardware = FT232Hardware.FT232Hardware(auto_range=True)
+		hardware.mpsse.light = light
+		color = hardware.get_color()
+		return hardware, color
+
+	def test_ranges_sorted_by_sensitivity(self):
+		sensitivities = [r.sensitivity for r in FT232Hardware.SENSOR_RANGES]
+
+		self.assertEqual(sensitivities, sorted(sensitivities))
+		self.assertEqual(len(set(sensitivities)), len(sensitivities))
+
+	def test_bright_light_uses_short_integration(self):
+		hardware, color = self.read(200000.0)
+
+		for value, expected in zip(color, (0.5, 0.25, 0.125)):
+			self.assertAlmostEqual(value, expected, delta=0.01)
+		self.assertLessEqual(hardware.range.duration, 0.07)
+		# The next reading is within the band and keeps the range.
+		index = hardware.range_index
+		hardware.get_color()
+		self.assertEqual(hardware.range_index, index)
+
+	def test_dim_light_increases_sensitivity(self):
+		hardware, color = self.read(100.0)
+
+		self.assertGreater(hardware.range.sensitivity, FT232Hardware.SENSOR_RANGES[FT232Hardware.DEFAULT_RANGE].sensitivity)
+
+	def test_range_keeps_clear_channel_in_band(self):
+		for light in (500.0, 1000.0, 30000.0, 300000.0):
+			hardware, color = self.read(light)
+			hardware.get_color()
+			c = struct.unpack('<H', bytes(hardware.mpsse.registers[0x14:0x16]))[0]
+			low, high = hardware.range_band
+			self.assertGreaterEqual(c, low * hardware.range.max_count)
+			self.assertLessEqual(c, high * hardware.range.max_count)
+
+	def test_saturated_reading_is_retaken(self):
+		hardware = FT232Hardware.FT232Hardware(auto_range=True)
+		hardware.mpsse.light = 1e9
+
+		color = hardware.get_color()
+
+		self.assertEqual(hardware.range_index, 0)
+		self.assertEqual(color, (0.5, 0.25, 0.125))
+
+	def test_lux_uses_range_of_reading(self):
+		hardware = FT232Hardware.FT232Hardware(auto_range=True)
+		hardware.mpsse.light = 1000.0
+		main = AutoColorTemp.AutoColorTemp(hardware, mock.Mock(), sensor_matrix=SensorMatrix.SensorMatrix())
+
+		# The first reading switches ranges but is still usable.
+		main.process(main.sample())
+		self.assertNotEqual(hardware.range_index, FT232Hardware.DEFAULT_RANGE)
+		default = FT232Hardware.SENSOR_RANGES[FT232Hardware.DEFAULT_RANGE]
+		self.assertEqual(hardware.last_integration, (default.duration, FT232Hardware.GAIN_MULTIPLIERS[default.gain]))
+		first = main.measured_lux
+
+		# The next reading is taken with the new range and gives about the same lux.
+		main.process(main.sample())
+		self.assertEqual(hardware.last_integration, hardware.integration)
+		self.assertAlmostEqual(first / main.measured_lux, 1.0, delta=0.2)
+
+	def test_fixed_range_without_auto_range(self):
+		hardware = FT232Hardware.FT232Hardware()
+		hardware.mpsse.light = 2000000.0
+
+		hardware.get_color()
+
+		self.assertEqual(hardware.range_index, FT232Hardware.DEFAULT_RANGE)
+
+
+class TestFT232HardwareThreshold(FT232TestCase):
+
+	def setUp(self):
+		super(TestFT232HardwareThreshold, self).setUp()
+		self.hardware = FT232Hardware.FT232Hardware(threshold=0.1)
+		self.hardware.mpsse.light = 10000.0
+
+	def test_light_changed_before_first_reading(self):
+		self.assertTrue(self.hardware.light_changed())
+
+	def test_reading_arms_thresholds_around_clear_count(self):
+		self.hardware.get_color()
+
+		c = struct.unpack('<H', bytes(self.hardware.mpsse.registers[0x14:0x16]))[0]
+		low, high = struct.unpack('<HH', bytes(self.hardware.mpsse.registers[0x04:0x08]))
+		self.assertEqual((low, high), (int(c*0.9), int(c*1.1)))
+		self.assertEqual(self.hardware.mpsse.registers[FT232Hardware.TCS34725_PERS], FT232Hardware.TCS34725_PERS_3_CYCLE)
+		self.assertTrue(self.hardware.mpsse.registers[FT232Hardware.TCS34725_ENABLE] & FT232Hardware.TCS34725_ENABLE_AIEN)
+
+	def test_light_changed_uses_one_status_read(self):
+		self.hardware.get_color()
+		self.hardware.mpsse.transactions = 0
+
+		self.assertFalse(self.hardware.light_changed())
+		self.assertEqual(self.hardware.mpsse.transactions, 1)
+
+		self.hardware.mpsse.light = 20000.0
+		self.assertTrue(self.hardware.light_changed())
+
+		# Reading again moves the thresholds and clears the interrupt.
+		self.hardware.get_color()
+		self.assertFalse(self.hardware.light_changed())
+
+	def test_range_change_does_not_arm_old_counts(self):
+		hardware = FT232Hardware.FT232Hardware(auto_range=True, threshold=0.1)
+		hardware.mpsse.light = 1000.0
+		with mock.patch.object(FT232Hardware.time, 'sleep'):
+			hardware.get_color()
+			self.assertNotEqual(hardware.range_index, FT232Hardware.DEFAULT_RANGE)
+			# Not armed until a reading is taken with the new range.
+			self.assertFalse(hardware.armed)
+			self.assertTrue(hardware.light_changed())
+
+			hardware.get_color()
+			self.assertFalse(hardware.light_changed())
+			hardware.get_color()
+			self.assertFalse(hardware.light_changed())
+
+	def test_update_skipped_while_light_unchanged(self):
+		class Gamma(object):
+			def __init__(self):
+				self.count = 0
+			def adjust_white_point(self, white):
+				self.count += 1
+
+		gamma = Gamma()
+		main = AutoColorTemp.AutoColorTemp(self.hardware, gamma)
+		main.update()
+		main.update()
+
+		self.assertEqual(gamma.count, 1)
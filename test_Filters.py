@@ -0,0 +1,86 @@
+import unittest
+
+import Filters
+
+
+class CountingHardware(object):
+	def __init__(self, colors):
+		self.colors = list(colors)
+		self.close_called = False
+
+	def get_color(self):
+		return self.colors.pop(0)
+
+	def close(self):
+		self.close_called = True
+
+
+class TestFilters(unittest.TestCase):
+
+	def test_ema_filter(self):
+		ema = Filters.EMAFilter(0.5)
+
+		self.assertEqual(ema.filter((1.0, 1.0, 1.0)), (1.0, 1.0, 1.0))
+		self.assertEqual(ema.filter((0.0, 0.5, 1.0)), (0.5, 0.75, 1.0))
+
+	def test_median_filter_rejects_outlier(self):
+		median = Filters.MedianFilter(3)
+		colors = [(0.5, 0.5, 0.5), (0.5, 0.5, 0.5), (0.0, 1.0, 0.1), (0.5, 0.5, 0.5), (0.6, 0.4, 0.5)]
+
+		filtered = [median.filter(color) for color in colors]
+
+		self.assertEqual(filtered[2], (0.5, 0.5, 0.5))
+		self.assertEqual(filtered[3], (0.5, 0.5, 0.5))
+		self.assertEqual(filtered[4], (0.5, 0.5, 0.5))
+		# Only the last three samples are kept.
+		self.assertEqual(len(median.samples), 3)
+		self.assertEqual(median.sorted[0], [0.0, 0.5, 0.6])
+
+	def test_median_filter_even_count(self):
+		median = Filters.MedianFilter(4)
+		median.filter((0.0, 0.0, 0.0))
+
+		self.assertEqual(median.filter((1.0, 0.5, 0.25)), (0.5, 0.25, 0.125))
+
+	def test_kalman_filter_converges(self):
+		kalman = Filters.KalmanFilter()
+		kalman.filter((0.0, 0.0, 0.0))
+		for _ in range(500):
+			color = kalman.filter((1.0, 0.5, 0.25))
+
+		self.assertAlmostEqual(color[0], 1.0, places=2)
+		self.assertAlmostEqual(color[2], 0.25, places=2)
+
+	def test_kalman_filter_damps_single_spike(self):
+		kalman = Filters.KalmanFilter()
+		for _ in range(50):
+			kalman.filter((0.5, 0.5, 0.5))
+
+		color = kalman.filter((1.0, 0.5, 0.5))
+
+		self.assertLess(color[0], 0.6)
+
+	def test_create_filter(self):
+		self.assertIsInstance(Filters.create_filter('median', 7), Filters.MedianFilter)
+		self.assertEqual(Filters.create_filter('median', 7).size, 7)
+		self.assertIsNone(Filters.create_filter('none'))
+		self.assertRaises(ValueError, Filters.create_filter, 'mean')
+
+	def test_median_filter_counts(self):
+		f = Filters.MedianFilter(3)
+		f.filter((100, 200, 300, 400))
+		f.filter((9000, 9000, 9000, 9000))
+		self.assertEqual(f.filter((110, 210, 310, 410)), (110, 210, 310, 410))
+
+	def test_filtered_hardware(self):
+		hardware = CountingHardware([(1.0, 1.0, 1.0), (0.0, 0.0, 0.0)])
+		filtered = Filters.FilteredHardware(hardware, Filters.EMAFilter(0.25))
+
+		filtered.get_color()
+		self.assertEqual(filtered.get_color(), (0.75, 0.75, 0.75))
+		filtered.close()
+		self.assertTrue(hardware.close_called)
+
+	def test_filtered_hardware_passes_missing_reading(self):
+		filtered = Filters.FilteredHardware(CountingHardware([None]), Filters.MedianFilter(3))
+		self.assertIsNone(filtered.get_color())
@@ -0,0 +1,179 @@
+import socket
+import time
+import unittest
+
+import AutoColorTemp
+import Fleet
+
+
+class FakeGamma(object):
+
+	def __init__(self):
+		self.whites = []
+		self.restored = False
+
+	def adjust_white_point(self, white):
+		self.whites.append(white)
+
+	def restore(self):
+		self.restored = True
+
+
+class FakeHardware(object):
+
+	def __init__(self, colors):
+		self.colors = list(colors)
+
+	def get_color(self):
+		return self.colors.pop(0)
+
+	def close(self):
+		pass
+
+
+def _wait_for(condition, timeout=2.0):
+	finished = time.time() + timeout
+	while not condition() and time.time() < finished:
+		time.sleep(0.01)
+	return condition()
+
+
+class TestFleet(unittest.TestCase):
+
+	def setUp(self):
+		self.gamma = FakeGamma()
+		self.subscriber = Fleet.Subscriber(self.gamma, ('127.0.0.1', 0), timeout=0.1)
+
+	def tearDown(self):
+		self.subscriber.close()
+
+	def test_parse_address(self):
+		self.assertEqual(Fleet.parse_address(None), (Fleet.DEFAULT_GROUP, Fleet.DEFAULT_PORT))
+		self.assertEqual(Fleet.parse_address('10.0.0.5:5000'), ('10.0.0.5', 5000))
+		self.assertEqual(Fleet.parse_address('10.0.0.5'), ('10.0.0.5', Fleet.DEFAULT_PORT))
+		self.assertEqual(Fleet.parse_address(':5000'), (Fleet.DEFAULT_GROUP, 5000))
+		self.assertRaises(ValueError, Fleet.parse_address, 'host:abc')
+		self.assertRaises(ValueError, Fleet.parse_address, 'host:70000')
+
+	def test_pack_unpack(self):
+		data = Fleet.pack(7, 42, 1000.0, 3400.0, (1.0, 0.75, 0.5))
+		self.assertEqual(len(data), Fleet.MESSAGE_SIZE)
+		self.assertEqual(Fleet.unpack(data), (7, 42, 1000.0, 3400.0, (1.0, 0.75, 0.5)))
+		self.assertIsNone(Fleet.unpack(b'junk'))
+		self.assertIsNone(Fleet.unpack(b'XXXX' + data[4:]))
+
+	def test_publisher_to_subscriber(self):
+		publisher = Fleet.Publisher(self.subscriber.address, min_interval=0.0, heartbeat=0)
+		try:
+			publisher.publish(3400.0, (1.0, 0.75, 0.5))
+			self.assertTrue(self.subscriber.update())
+		finally:
+			publisher.close()
+		self.assertEqual(self.gamma.whites, [(1.0, 0.75, 0.5)])
+		self.assertEqual(self.subscriber.temp, 3400.0)
+		# Nothing more was sent.
+		self.assertFalse(self.subscriber.update())
+
+	def test_publisher_coalesces_bursts(self):
+		publisher = Fleet.Publisher(self.subscriber.address, min_interval=0.5, heartbeat=0)
+		try:
+			publisher.publish(6500.0, (1.0, 1.0, 1.0))
+			self.assertTrue(_wait_for(lambda: publisher.sent == 1))
+			# A burst within the interval only sends the newest update, once the
+			# interval is up.
+			for temp in range(3000, 3100):
+				publisher.publish(float(temp), (1.0, 0.5, 0.25))
+			self.assertTrue(_wait_for(lambda: publisher.sent == 2))
+			time.sleep(0.1)
+			self.assertEqual(publisher.sent, 2)
+			self.assertEqual(publisher.coalesced, 99)
+		finally:
+			publisher.close()
+		# Both were waiting so the subscriber only applies the newest.
+		self.assertTrue(self.subscriber.update())
+		self.assertEqual(self.subscriber.temp, 3099.0)
+		self.assertEqual(self.subscriber.received, 2)
+		self.assertEqual(len(self.gamma.whites), 1)
+
+	def test_heartbeat(self):
+		publisher = Fleet.Publisher(self.subscriber.address, min_interval=0.0, heartbeat=0.05)
+		try:
+			publisher.publish(4000.0, (1.0, 0.8, 0.6))
+			self.assertTrue(_wait_for(lambda: publisher.sent >= 3))
+		finally:
+			publisher.close()
+		self.assertTrue(self.subscriber.update())
+		for received, sent in zip(self.subscriber.white, (1.0, 0.8, 0.6)):
+			self.assertAlmostEqual(received, sent, places=5)
+
+	def test_heartbeat_is_not_applied_again(self):
+		publisher = Fleet.Publisher(self.subscriber.address, min_interval=0.0, heartbeat=0.05)
+		try:
+			publisher.publish(4000.0, (1.0, 0.8, 0.6))
+			self.assertTrue(self.subscriber.update())
+			self.assertTrue(_wait_for(lambda: publisher.sent >= 2))
+			self.assertFalse(self.subscriber.update())
+		finally:
+			publisher.close()
+		self.assertEqual(len(self.gamma.whites), 1)
+		self.assertGreater(self.subscriber.unchanged, 0)
+
+	def test_subscriber_coalesces_and_drops_stale(self):
+		sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		try:
+			for sequence in (5, 6, 4, 7):
+				sender.sendto(Fleet.pack(1, sequence, 0.0, 1000.0 * sequence, (1.0, 1.0, 1.0)), self.subscriber.address)
+			time.sleep(0.05)
+			self.assertTrue(self.subscriber.update())
+			self.assertEqual(self.subscriber.temp, 7000.0)
+			self.assertEqual(self.subscriber.received, 4)
+			self.assertEqual(self.subscriber.stale, 1)
+			self.assertEqual(self.subscriber.coalesced, 2)
+			self.assertEqual(len(self.gamma.whites), 1)
+			# Older update from the same publisher is ignored, a restarted
+			# publisher with a new ID is followed.
+			sender.sendto(Fleet.pack(1, 3, 0.0, 3000.0, (1.0, 1.0, 1.0)), self.subscriber.address)
+			self.assertFalse(self.subscriber.update())
+			sender.sendto(Fleet.pack(2, 1, 0.0, 2000.0, (1.0, 1.0, 1.0)), self.subscriber.address)
+			self.assertTrue(self.subscriber.update())
+			self.assertEqual(self.subscriber.temp, 2000.0)
+			# Sequence numbers wrap around.
+			self.subscriber._last = (2, 0xFFFFFFFF) + self.subscriber._last[2:]
+			sender.sendto(Fleet.pack(2, 0, 0.0, 2100.0, (1.0, 1.0, 1.0)), self.subscriber.address)
+			self.assertTrue(self.subscriber.update())
+		finally:
+			sender.close()
+
+	def test_auto_color_temp_publishes(self):
+		local = FakeGamma()
+		publisher = Fleet.Publisher(self.subscriber.address, min_interval=0.0, heartbeat=0)
+		main = AutoColorTemp.AutoColorTemp(FakeHardware([(1.0, 0.8, 0.6)]), local, publisher=publisher)
+		main.update()
+		main.close()
+		self.assertTrue(self.subscriber.update())
+		self.assertEqual(len(local.whites), 1)
+		self.assertAlmostEqual(self.subscriber.temp, main.last_temp, places=0)
+		for received, applied in zip(self.gamma.whites[0], local.whites[0]):
+			self.assertAlmostEqual(received, applied, places=5)
+
+	def test_multicast(self):
+		gamma = FakeGamma()
+		try:
+			subscriber = Fleet.Subscriber(gamma, (Fleet.DEFAULT_GROUP, 0), timeout=0.5)
+		except (IOError, OSError) as e:
+			self.skipTest('Multicast not available: {0}'.format(e))
+		try:
+			publisher = Fleet.Publisher(subscriber.address, min_interval=0.0, heartbeat=0)
+			publisher.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton('127.0.0.1'))
+			publisher.publish(5000.0, (1.0, 0.9, 0.8))
+			publisher.close()
+			if not subscriber.update():
+				self.skipTest('Multicast not routed on this host.')
+			self.assertEqual(subscriber.temp, 5000.0)
+		finally:
+			subscriber.close()
+		self.assertTrue(gamma.restored)
+
+
+if __name__ == '__main__':
+	unittest.main()
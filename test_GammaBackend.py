@@ -0,0 +1,128 @@
+import os
+import sys
+import unittest
+try:
+	from unittest import mock
+except ImportError:
+	import mock
+
+import GammaBackend
+import Simulated
+
+
+class FakeOutput(object):
+	def __init__(self, name, ramp_size):
+		self.name = name
+		self.ramp_size = ramp_size
+		self.ramp = None
+		self.restored = False
+
+	def set_ramp(self, ramp):
+		self.ramp = ramp
+
+	def restore(self):
+		self.restored = True
+
+
+class FakeBackend(GammaBackend.GammaBackend):
+	name = 'fake'
+	per_output = True
+
+	def __init__(self):
+		super(FakeBackend, self).__init__()
+		self.outputs = [FakeOutput('left', 256), FakeOutput('right', 1024)]
+		self.flushes = 0
+
+	def flush(self):
+		self.flushes += 1
+
+
+class FakeEntryPoint(object):
+	name = 'plugin'
+
+	def __init__(self):
+		self.loaded = False
+
+	def load(self):
+		self.loaded = True
+		return FakeBackend
+
+
+class TestGammaBackend(unittest.TestCase):
+
+	def setUp(self):
+		registry = dict(GammaBackend._registry)
+		self.addCleanup(setattr, GammaBackend, '_registry', registry)
+		self.addCleanup(setattr, GammaBackend, '_entry_points_loaded', GammaBackend._entry_points_loaded)
+
+	def test_shared_ramp_pipeline(self):
+		gamma = FakeBackend()
+		gamma.set_gamma(('2.2', 2.2, 2))
+
+		gamma.adjust_white_point((1.0, 0.5, 0.25))
+
+		self.assertEqual(gamma.gamma, (2.2, 2.2, 2.0))
+		self.assertEqual(gamma.ramp_sizes, [256, 1024])
+		self.assertEqual(gamma.outputs[1].ramp.size, 1024)
+		self.assertEqual(gamma.outputs[1].ramp.red[-1], 65535)
+		self.assertEqual(gamma.flushes, 1)
+
+	def test_per_output_white_and_restore(self):
+		gamma = FakeBackend()
+
+		gamma.adjust_white_point({'right': (0.5, 0.5, 0.5)})
+		gamma.restore('right')
+
+		self.assertIsNone(gamma.outputs[0].ramp)
+		self.assertEqual(gamma.outputs[1].ramp.green[-1], 32767)
+		self.assertEqual([o.restored for o in gamma.outputs], [False, True])
+
+	def test_bad_gamma(self):
+		with self.assertRaises(ValueError):
+			FakeBackend().set_gamma((2.2, 2.2))
+
+	def test_default_backend_for_platform(self):
+		with mock.patch.dict(os.environ, {'DISPLAY': ':0'}):
+			self.assertEqual(GammaBackend.default_name('Linux'), 'x11')
+		with mock.patch.dict(os.environ, {'DISPLAY': ''}):
+			self.assertEqual(GammaBackend.default_name('Linux'), 'drm')
+		self.assertEqual(GammaBackend.default_name('Windows'), 'win32')
+		self.assertEqual(GammaBackend.default_name('Darwin'), 'macosx')
+		with self.assertRaises(RuntimeError):
+			GammaBackend.default_name('Plan9')
+
+	def test_backends_are_imported_lazily(self):
+		sys.modules.pop('Win32Gamma', None)
+		GammaBackend.default_name('Windows')
+
+		self.assertNotIn('Win32Gamma', sys.modules)
+		self.assertIs(GammaBackend.get('simulated'), Simulated.SimulatedGamma)
+
+	def test_entry_point_plugins(self):
+		entry_point = FakeEntryPoint()
+		GammaBackend._entry_points_loaded = False
+		with mock.patch('importlib.metadata.entry_points') as entry_points:
+			entry_points.return_value.select.return_value = [entry_point]
+			self.assertIn('plugin', GammaBackend.names())
+
+		self.assertFalse(entry_point.loaded)
+		self.assertIsInstance(GammaBackend.create('plugin'), FakeBackend)
+		self.assertTrue(entry_point.loaded)
+
+	def test_unknown_backend(self):
+		GammaBackend._entry_points_loaded = True
+		with self.assertRaises(ValueError):
+			GammaBackend.get('nonexistent')
+
+	def test_per_output_calibration(self):
+		import Calibration
+		gamma = FakeBackend()
+		halve = Calibration.Calibration([0.0, 0.5], [0.0, 0.5], [0.0, 0.5])
+
+		gamma.set_calibration(halve, 'right')
+		gamma.adjust_white_point((1.0, 1.0, 1.0))
+
+		self.assertEqual(gamma.outputs[0].ramp.red[-1], 65535)
+		self.assertEqual(gamma.outputs[1].ramp.red[-1], 32767)
+		with self.assertRaises(ValueError):
+			gamma.set_calibration(halve, 'missing')
@@ -0,0 +1,59 @@
+import unittest
+
+import AutoColorTemp
+import GammaRamp
+
+
+class TestRampBuilder(unittest.TestCase):
+
+	def test_build_matches_gamma_table_gen(self):
+		builder = GammaRamp.RampBuilder(quantum=1.0/65536.0)
+		white = (1.0, 0.75, 0.5)
+		gamma = (2.2, '1.8', 1.0)
+
+		ramp = builder.build(256, white, gamma)
+
+		for c, channel in enumerate((ramp.red, ramp.green, ramp.blue)):
+			expected = [int(GammaRamp.USHORT_MAX*value) for value in AutoColorTemp.gamma_table_gen(256, white[c], gamma[c])]
+			# Allow a count of difference from white point quantization.
+			for value, exp in zip(channel, expected):
+				self.assertLessEqual(abs(value - exp), 1)
+
+	def test_channels_are_back_to_back_in_buffer(self):
+		ramp = GammaRamp.RampBuilder().build(4, (1.0, 0.5, 0.25), (1.0, 1.0, 1.0))
+
+		self.assertEqual(len(ramp.buffer), 12)
+		self.assertEqual(list(ramp.buffer[0:4]), list(ramp.red))
+		self.assertEqual(list(ramp.buffer[4:8]), list(ramp.green))
+		self.assertEqual(list(ramp.buffer[8:12]), list(ramp.blue))
+		self.assertEqual(ramp.red[3], GammaRamp.USHORT_MAX)
+		self.assertEqual(ramp.blue[0], 0)
+
+	def test_nearby_white_points_share_cached_ramp(self):
+		builder = GammaRamp.RampBuilder(quantum=1.0/256.0)
+		gamma = (1.0, 1.0, 1.0)
+
+		first = builder.build(256, (1.0, 0.5, 0.25), gamma)
+		second = builder.build(256, (1.0, 0.5001, 0.25), gamma)
+		other = builder.build(256, (1.0, 0.6, 0.25), gamma)
+
+		self.assertIs(first, second)
+		self.assertIsNot(first, other)
+
+	def test_least_recently_used_ramp_is_evicted(self):
+		builder = GammaRamp.RampBuilder(cache_size=2)
+		gamma = (1.0, 1.0, 1.0)
+
+		first = builder.build(16, (1.0, 1.0, 1.0), gamma)
+		second = builder.build(16, (0.5, 0.5, 0.5), gamma)
+		# Touch the first ramp so the second is the oldest.
+		builder.build(16, (1.0, 1.0, 1.0), gamma)
+		builder.build(16, (0.25, 0.25, 0.25), gamma)
+
+		self.assertIs(first, builder.build(16, (1.0, 1.0, 1.0), gamma))
+		self.assertIsNot(second, builder.build(16, (0.5, 0.5, 0.5), gamma))
+
+	def test_curve_is_computed_once(self):
+		builder = GammaRamp.RampBuilder()
+
+		self.assertIs(builder.curve(256, 2.2), builder.curve(256, '2.2'))
@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+try:
+	from urllib.request import urlopen
+except ImportError:
+	from urllib2 import urlopen
+
+import AutoColorTemp
+import Metrics
+import Pipeline
+import Simulated
+import Supervisor
+
+
+class TestMetrics(unittest.TestCase):
+
+	def setUp(self):
+		Metrics.registry.reset()
+		Metrics.registry.enabled = True
+
+	def tearDown(self):
+		Metrics.registry.enabled = False
+		Metrics.registry.reset()
+
+	def test_disabled_registry_records_nothing(self):
+		metrics = Metrics.Registry()
+
+		with metrics.time('test_seconds'):
+			pass
+		metrics.inc('test_total')
+		metrics.set('test_gauge', 1.0)
+
+		self.assertEqual(metrics.to_dict(), {'counters': {}, 'gauges': {}, 'histograms': {}})
+
+	def test_histogram_buckets(self):
+		histogram = Metrics.Histogram((1.0, 2.0))
+
+		for value in (0.5, 1.5, 1.8, 3.0):
+			histogram.observe(value)
+
+		self.assertEqual(histogram.counts, [1, 2, 1])
+		self.assertEqual(histogram.count, 4)
+		self.assertAlmostEqual(histogram.sum, 6.8)
+
+	def test_prometheus_format(self):
+		metrics = Metrics.Registry(enabled=True)
+		metrics.inc('updates_total', 2)
+		metrics.set('temp_kelvin', 6500)
+		metrics.histograms['test_seconds'] = Metrics.Histogram((1.0,))
+		metrics.histograms['test_seconds'].observe(0.5)
+
+		text = metrics.to_prometheus()
+
+		self.assertIn('autocolortemp_updates_total 2\n', text)
+		self.assertIn('autocolortemp_temp_kelvin 6500.0\n', text)
+		self.assertIn('autocolortemp_test_seconds_bucket{le="1.0"} 1\n', text)
+		self.assertIn('autocolortemp_test_seconds_bucket{le="+Inf"} 1\n', text)
+		self.assertIn('autocolortemp_test_seconds_count 1\n', text)
+
+	def test_update_is_instrumented(self):
+		hardware = Simulated.SimulatedHardware(samples=[(1.0, 1.0, 1.0), (1.0, 1.0, 1.0), (1.0, 0.0, 0.0)])
+		main = AutoColorTemp.AutoColorTemp(hardware, Simulated.SimulatedGamma(), deadband=100.0)
+
+		for i in range(3):
+			main.update()
+
+		counters = Metrics.registry.counters
+		self.assertEqual(counters['updates_applied_total'], 1)
+		self.assertEqual(counters['updates_skipped_total'], 1)
+		self.assertEqual(counters['updates_out_of_range_total'], 1)
+		for name in ('get_color_seconds', 'rgb_to_temp_seconds', 'temp_to_white_seconds', 'adjust_white_point_seconds'):
+			self.assertGreater(Metrics.registry.histograms[name].count, 0, name)
+
+	def test_failed_updates_are_counted(self):
+		class BrokenHardware(object):
+			def get_color(self):
+				raise RuntimeError('Sensor unplugged.')
+			def close(self):
+				pass
+
+		main = AutoColorTemp.AutoColorTemp(BrokenHardware(), Simulated.SimulatedGamma())
+		self.assertRaises(RuntimeError, main.update)
+		self.assertRaises(RuntimeError, Pipeline.Pipeline(main, 0.01).run)
+		supervised = Supervisor.SupervisedHardware(BrokenHardware)
+		self.addCleanup(supervised.close)
+		self.assertIsNone(AutoColorTemp.AutoColorTemp(supervised, Simulated.SimulatedGamma()).update())
+		self.assertEqual(Metrics.registry.counters['updates_failed_total'], 3)
+
+	def test_failed_probe_and_reading_count_one_update(self):
+		class BrokenHardware(object):
+			def light_changed(self):
+				raise RuntimeError('Sensor unplugged.')
+			def get_color(self):
+				raise RuntimeError('Sensor unplugged.')
+			def close(self):
+				pass
+
+		supervised = Supervisor.SupervisedHardware(BrokenHardware)
+		self.addCleanup(supervised.close)
+		self.assertIsNone(AutoColorTemp.AutoColorTemp(supervised, Simulated.SimulatedGamma()).update())
+		self.assertEqual(Metrics.registry.counters['updates_failed_total'], 1)
+		self.assertEqual(Metrics.registry.counters['hardware_failures_total'], 2)
+
+	def test_metrics_server(self):
+		Metrics.registry.inc('updates_total')
+		server = Metrics.MetricsServer(0)
+		try:
+			body = urlopen('http://127.0.0.1:{0}/metrics'.format(server.port)).read().decode('utf-8')
+		finally:
+			server.close()
+
+		self.assertIn('autocolortemp_updates_total 1', body)
+
+	def test_json_dumper(self):
+		directory = tempfile.mkdtemp()
+		try:
+			path = os.path.join(directory, 'metrics.json')
+			dumper = Metrics.JsonDumper(path, interval=60.0)
+			Metrics.registry.inc('updates_total')
+			dumper.close()
+
+			with open(path) as f:
+				self.assertEqual(json.load(f)['counters'], {'updates_total': 1})
+		finally:
+			shutil.rmtree(directory)
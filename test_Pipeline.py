@@ -0,0 +1,59 @@
+import time
+import unittest
+
+import AutoColorTemp
+import Pipeline
+
+
+class CountingHardware(object):
+	def __init__(self, colors, error=None):
+		self.colors = colors
+		self.error = error
+		self.count = 0
+
+	def get_color(self):
+		if self.error is not None and self.count >= len(self.colors):
+			raise self.error
+		color = self.colors[self.count % len(self.colors)]
+		self.count += 1
+		return color
+
+	def close(self):
+		pass
+
+
+class SlowGamma(object):
+	def __init__(self, latency):
+		self.latency = latency
+		self.whites = []
+
+	def adjust_white_point(self, white):
+		time.sleep(self.latency)
+		self.whites.append(white)
+
+	def restore(self):
+		pass
+
+
+class TestPipeline(unittest.TestCase):
+
+	def test_slow_gamma_drops_stale_samples(self):
+		colors = [(1.0, 0.5, 0.0), (0.8, 0.8, 1.0)]
+		hardware = CountingHardware(colors)
+		gamma = SlowGamma(0.1)
+		pipeline = Pipeline.Pipeline(AutoColorTemp.AutoColorTemp(hardware, gamma), 0.005)
+
+		pipeline.start()
+		time.sleep(0.5)
+		pipeline.stop()
+
+		# Sampling kept its own pace while gamma updates lagged behind.
+		self.assertGreater(hardware.count, 4*len(gamma.whites))
+		self.assertGreater(len(gamma.whites), 0)
+		self.assertGreater(pipeline.dropped_whites + pipeline.dropped_samples, 0)
+
+	def test_run_raises_stage_error(self):
+		hardware = CountingHardware([(1.0, 0.5, 0.0)], error=RuntimeError('Sensor unplugged.'))
+		pipeline = Pipeline.Pipeline(AutoColorTemp.AutoColorTemp(hardware, SlowGamma(0.0)), 0.01)
+
+		self.assertRaises(RuntimeError, pipeline.run)
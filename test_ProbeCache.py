@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import ProbeCache
+
+
+class TestProbeCache(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+		self.path = os.path.join(self.directory, 'nested', 'probe.json')
+
+	def test_save_and_load(self):
+		cache = ProbeCache.ProbeCache(self.path)
+		cache.set('x11-crtcs :0 0', {'stamps': [0, 1], 'crtcs': [[1, 'DP-1', 256]]})
+		cache.save()
+
+		loaded = ProbeCache.ProbeCache(self.path)
+
+		self.assertEqual(loaded.get('x11-crtcs :0 0'), {'stamps': [0, 1], 'crtcs': [[1, 'DP-1', 256]]})
+		self.assertFalse(loaded.dirty)
+
+	def test_corrupt_file_is_empty(self):
+		os.makedirs(os.path.dirname(self.path))
+		with open(self.path, 'w') as f:
+			f.write('{not json')
+
+		cache = ProbeCache.ProbeCache(self.path)
+
+		self.assertEqual(cache.get('anything', 'default'), 'default')
+
+	def test_unchanged_cache_is_not_written(self):
+		cache = ProbeCache.ProbeCache(self.path)
+		cache.save()
+
+		self.assertFalse(os.path.exists(self.path))
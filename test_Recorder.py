@@ -0,0 +1,88 @@
+import math
+import os
+import shutil
+import tempfile
+import unittest
+try:
+	from unittest import mock
+except ImportError:
+	import mock
+
+import AutoColorTemp
+import Recorder
+import Simulated
+
+
+class TestRecorder(unittest.TestCase):
+
+	def setUp(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.path = os.path.join(directory, 'readings.log')
+
+	def test_record_and_read(self):
+		recorder = Recorder.Recorder(self.path)
+		recorder.record(100.0, (0.5, 0.25, 0.125), (10, 20, 30, 40), 6500.0, (1.0, 0.9, 0.8), 0.01)
+		recorder.record(101.0, (0.5, 0.5, 0.5))
+		recorder.close()
+
+		records = Recorder.read(self.path)
+
+		self.assertEqual(os.path.getsize(self.path), Recorder.HEADER_SIZE + 2 * Recorder.RECORD_SIZE)
+		self.assertEqual(records.dtype.itemsize, Recorder.RECORD_SIZE)
+		self.assertEqual(list(records['time']), [100.0, 101.0])
+		self.assertEqual(list(records['counts'][0]), [10, 20, 30, 40])
+		self.assertEqual(list(records['counts'][1]), [0, 0, 0, 0])
+		self.assertAlmostEqual(records['kelvin'][0], 6500.0)
+		self.assertTrue(math.isnan(records['kelvin'][1]))
+		self.assertTrue(all(math.isnan(w) for w in records['white'][1]))
+		self.assertEqual(Recorder.replay_samples(records), [(0.5, 0.25, 0.125), (0.5, 0.5, 0.5)])
+
+	def test_append_drops_partial_record(self):
+		recorder = Recorder.Recorder(self.path)
+		recorder.record(100.0, (0.5, 0.5, 0.5))
+		recorder.close()
+		# Simulate a crash part way through writing a record.
+		with open(self.path, 'ab') as f:
+			f.write(b'\x00' * 7)
+
+		self.assertEqual(len(Recorder.read(self.path)), 1)
+
+		recorder = Recorder.Recorder(self.path)
+		recorder.record(101.0, (0.5, 0.5, 0.5))
+		recorder.close()
+
+		self.assertEqual(list(Recorder.read(self.path)['time']), [100.0, 101.0])
+
+	def test_rejects_other_files(self):
+		with open(self.path, 'wb') as f:
+			f.write(b'not a measurement log')
+
+		with self.assertRaises(ValueError):
+			Recorder.read(self.path)
+		with mock.patch('Recorder.open', create=True, side_effect=open) as opened:
+			with self.assertRaises(ValueError):
+				Recorder.Recorder(self.path)
+		# Only opened to read the header, not left open to append.
+		self.assertNotIn(mock.call(self.path, 'ab'), opened.call_args_list)
+
+	def test_empty_log(self):
+		Recorder.Recorder(self.path).close()
+
+		self.assertEqual(len(Recorder.read(self.path)), 0)
+
+	def test_update_records_readings(self):
+		hardware = Simulated.SimulatedHardware(samples=[(1.0, 1.0, 1.0), (1.0, 1.0, 1.0)])
+		main = AutoColorTemp.AutoColorTemp(hardware, Simulated.SimulatedGamma(), deadband=100.0,
+			recorder=Recorder.Recorder(self.path))
+
+		main.update()
+		main.update()
+		main.close()
+		records = Recorder.read(self.path)
+
+		self.assertEqual(len(records), 2)
+		self.assertAlmostEqual(records['kelvin'][0], main.last_temp, delta=0.01)
+		self.assertAlmostEqual(records['white'][0][0], main.last_white[0], places=6)
+		# The second reading is within the deadband so no white point is applied.
+		self.assertTrue(math.isnan(records['white'][1][0]))
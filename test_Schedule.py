@@ -0,0 +1,78 @@
+import calendar
+import unittest
+
+import AutoColorTemp
+import Schedule
+import Simulated
+
+
+class TestSchedule(unittest.TestCase):
+
+	def test_parse_and_interpolate(self):
+		schedule = Schedule.Schedule.parse('07:00=6500, 21:00=2700')
+
+		self.assertAlmostEqual(schedule.temp_at(7*3600), 6500.0)
+		self.assertAlmostEqual(schedule.temp_at(21*3600), 2700.0)
+		# Halfway in mireds, not kelvin.
+		middle = 1e6 / ((1e6/6500.0 + 1e6/2700.0) / 2.0)
+		self.assertAlmostEqual(schedule.temp_at(14*3600), middle)
+		# Wraps around midnight.
+		self.assertAlmostEqual(schedule.temp_at(2*3600), schedule.temp_at(26*3600 % 86400))
+		self.assertAlmostEqual(schedule.temp_at(0), 1e6 / (1e6/2700.0 + (1e6/6500.0 - 1e6/2700.0) * 3.0/10.0))
+
+	def test_bad_schedule(self):
+		with self.assertRaises(ValueError):
+			Schedule.Schedule.parse('7am=6500')
+		with self.assertRaises(ValueError):
+			Schedule.Schedule.parse('07:00=100')
+		with self.assertRaises(ValueError):
+			Schedule.Schedule.parse('25:75=6500')
+		with self.assertRaises(ValueError):
+			Schedule.Schedule.parse('07:60=6500')
+
+	def test_next_change(self):
+		class Steps(Schedule.KelvinSource):
+			def temp(self, timestamp):
+				return 6500.0 if timestamp < 1000.5 else 2700.0
+
+		wait = Steps().next_change(0.0, resolution=60.0, horizon=3600.0)
+		self.assertTrue(1000.5 <= wait <= 1001.5, wait)
+		self.assertEqual(Steps().next_change(2000.0, horizon=3600.0), 3600.0)
+
+	def test_sun_elevation(self):
+		# Solar noon near the June solstice in Greenwich, and midnight.
+		noon = calendar.timegm((2024, 6, 21, 12, 2, 0))
+		midnight = calendar.timegm((2024, 6, 21, 0, 2, 0))
+
+		self.assertAlmostEqual(Schedule.sun_elevation(noon, 51.48, 0.0), 90.0 - 51.48 + 23.44, delta=0.5)
+		self.assertAlmostEqual(Schedule.sun_elevation(midnight, 51.48, 0.0), -(90.0 - 51.48 - 23.44), delta=0.5)
+
+	def test_sun_schedule(self):
+		sun = Schedule.SunSchedule(51.48, 0.0, day=6500.0, night=2700.0)
+
+		self.assertAlmostEqual(sun.temp(calendar.timegm((2024, 6, 21, 12, 0, 0))), 6500.0)
+		self.assertAlmostEqual(sun.temp(calendar.timegm((2024, 6, 21, 0, 0, 0))), 2700.0)
+		dusk = sun.temp(calendar.timegm((2024, 6, 21, 20, 30, 0)))
+		self.assertTrue(2700.0 < dusk < 6500.0, dusk)
+
+	def test_scheduler_sleeps_until_change(self):
+		now = [calendar.timegm((2024, 6, 21, 12, 0, 0))]
+		gamma = Simulated.SimulatedGamma()
+		main = AutoColorTemp.AutoColorTemp(None, gamma)
+		scheduler = Schedule.Scheduler(main, Schedule.SunSchedule(51.48, 0.0), clock=lambda: now[0])
+
+		wait = scheduler.update()
+
+		self.assertAlmostEqual(main.last_temp, 6500.0)
+		self.assertEqual(gamma.updates, 1)
+		# Nothing changes around midday, so it sleeps the maximum.
+		self.assertEqual(wait, scheduler.max_sleep)
+
+		now[0] = calendar.timegm((2024, 6, 21, 20, 30, 0))
+		wait = scheduler.update()
+
+		self.assertEqual(gamma.updates, 2)
+		self.assertLess(wait, 600.0)
+
+		scheduler.close()
+		self.assertTrue(gamma.restore_called)
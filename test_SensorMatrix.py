@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import AutoColorTemp
+import SensorMatrix
+
+
+class TestSensorMatrix(unittest.TestCase):
+
+	def test_ir_reject(self):
+		# Clear sees 200 less than the sum of the others, so 100 of infrared.
+		self.assertEqual(SensorMatrix.ir_reject((500, 400, 300, 1000)), (400.0, 300.0, 200.0, 900.0))
+		self.assertEqual(SensorMatrix.ir_reject((400, 300, 200, 1000)), (400.0, 300.0, 200.0, 1000.0))
+
+	def test_dn40(self):
+		counts = (400, 300, 200, 900)
+		lux = (0.136*400 + 300 - 0.444*200) / (700.0 / 310.0)
+		self.assertAlmostEqual(SensorMatrix.dn40_lux(counts, 0.7, 1), lux)
+		self.assertAlmostEqual(SensorMatrix.dn40_lux(counts, 0.7, 4), lux / 4.0)
+		self.assertAlmostEqual(SensorMatrix.dn40_temp(counts), 3810.0*200.0/400.0 + 1391.0)
+		self.assertRaises(ZeroDivisionError, SensorMatrix.dn40_temp, (0, 0, 0, 0))
+		# All of red is infrared.
+		self.assertRaises(ZeroDivisionError, SensorMatrix.dn40_temp, (100, 300, 200, 400))
+
+	def test_temp(self):
+		matrix = SensorMatrix.SensorMatrix()
+		counts = (1200, 1000, 800, 3000)
+		X, Y, Z = matrix.xyz(counts)
+		self.assertAlmostEqual(matrix.temp(counts), AutoColorTemp.xy_to_temp(X/(X+Y+Z), Y/(X+Y+Z)))
+		# Redder light is warmer.
+		self.assertLess(matrix.temp((1500, 1000, 600, 3100)), matrix.temp((1000, 1000, 1000, 3000)))
+
+	def test_temp_falls_back_to_dn40(self):
+		matrix = SensorMatrix.SensorMatrix()
+		counts = (1000, 100, 1000, 2100)
+		self.assertLessEqual(sum(matrix.xyz(counts)), 0.0)
+
+		self.assertAlmostEqual(matrix.temp(counts), SensorMatrix.dn40_temp(counts))
+
+	def test_bad_matrix(self):
+		self.assertRaises(ValueError, SensorMatrix.SensorMatrix, ((1, 0, 0), (0, 1, 0)))
+
+	def test_fit_recovers_matrix(self):
+		expected = numpy.array(((0.5, 0.3, 0.1), (0.2, 0.7, 0.1), (0.0, 0.1, 0.9)))
+		counts = [(r, g, b, r + g + b) for r, g, b in ((1000, 800, 600), (500, 900, 1200), (2000, 1000, 300), (700, 700, 700))]
+		references = [numpy.dot(expected, c[:3]) for c in counts]
+
+		matrix = SensorMatrix.SensorMatrix.fit(counts, references)
+
+		numpy.testing.assert_allclose(matrix.matrix, expected, atol=1e-9)
+		self.assertRaises(ValueError, SensorMatrix.SensorMatrix.fit, counts[:2], references[:2])
+
+	def test_save_and_load(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		path = os.path.join(directory, 'matrix.txt')
+		matrix = SensorMatrix.SensorMatrix(((0.5, 0.3, 0.1), (0.2, 0.7, 0.1), (0.0, 0.1, 0.9)))
+
+		matrix.save(path)
+
+		self.assertEqual(SensorMatrix.SensorMatrix.load(path).matrix, matrix.matrix)
+		with open(path, 'a') as f:
+			f.write('1 2\n')
+		self.assertRaises(ValueError, SensorMatrix.SensorMatrix.load, path)
+
+
+if __name__ == '__main__':
+	unittest.main()
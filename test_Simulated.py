@@ -0,0 +1,66 @@
+import unittest
+
+import AutoColorTemp
+import Calibration
+import benchmark
+import Simulated
+
+
+class TestSimulated(unittest.TestCase):
+
+	def test_hardware_replays_samples(self):
+		hardware = Simulated.SimulatedHardware(samples=[(1.0, 0.5, 0.0), (0.5, 0.5, 0.5)])
+
+		colors = [hardware.get_color() for _ in range(3)]
+
+		self.assertEqual(colors, [(1.0, 0.5, 0.0), (0.5, 0.5, 0.5), (1.0, 0.5, 0.0)])
+
+	def test_hardware_follows_curve(self):
+		now = [0.0]
+		hardware = Simulated.SimulatedHardware(curve=Simulated.daylight_curve(period=100.0), clock=lambda: now[0])
+
+		warm = hardware.get_color()
+		now[0] = 50.0
+		cool = hardware.get_color()
+
+		# Cooler light has relatively more blue.
+		self.assertLess(warm[2], cool[2])
+		self.assertEqual(hardware.reads, 2)
+
+	def test_hardware_noise_is_repeatable(self):
+		first = Simulated.SimulatedHardware(samples=[(0.5, 0.5, 0.5)], noise=0.05, seed=1)
+		second = Simulated.SimulatedHardware(samples=[(0.5, 0.5, 0.5)], noise=0.05, seed=1)
+
+		color = first.get_color()
+
+		self.assertNotEqual(color, (0.5, 0.5, 0.5))
+		self.assertEqual(color, second.get_color())
+
+	def test_gamma_records_ramps(self):
+		gamma = Simulated.SimulatedGamma(ramp_size=1024, history=2)
+		main = AutoColorTemp.AutoColorTemp(Simulated.SimulatedHardware(samples=[(1.0, 0.5, 0.0), (0.8, 0.8, 1.0)]), gamma)
+
+		for _ in range(3):
+			main.update()
+		main.close()
+
+		self.assertEqual(gamma.updates, 3)
+		self.assertEqual(len(gamma.history), 2)
+		self.assertEqual(gamma.history[-1][2].size, 1024)
+		self.assertEqual(gamma.white, gamma.history[-1][1])
+		self.assertTrue(gamma.restore_called)
+
+	def test_gamma_calibration_of_unknown_output(self):
+		gamma = Simulated.SimulatedGamma()
+		halve = Calibration.Calibration([0.0, 0.5], [0.0, 0.5], [0.0, 0.5])
+
+		self.assertRaises(ValueError, gamma.set_calibration, halve, 'HDMI-1')
+		gamma.set_calibration(halve)
+		self.assertIs(gamma.calibrations[None], halve)
+
+	def test_benchmark_reports_every_stage(self):
+		results = benchmark.run_benchmark(benchmark.CONFIGURATIONS[0], iterations=5)
+
+		for stage in benchmark.STAGES + ['update']:
+			self.assertGreater(results[stage], 0.0)
+		self.assertGreater(results['updates_per_second'], 0.0)
@@ -0,0 +1,200 @@
+import threading
+import time
+import unittest
+try:
+	from unittest import mock
+except ImportError:
+	import mock
+
+import AutoColorTemp
+import Supervisor
+
+
+class FlakyHardware(object):
+	"""Fake hardware which returns a color, raises, or hangs until closed."""
+
+	def __init__(self, mode='ok'):
+		self.mode = mode
+		self.last_counts = (1, 2, 3, 4)
+		self.closed = threading.Event()
+
+	def get_color(self):
+		if self.mode == 'hang':
+			self.closed.wait(5.0)
+			raise RuntimeError('Port closed.')
+		if self.mode == 'error':
+			raise RuntimeError('Received no data from serial readline().')
+		return (1.0, 0.5, 0.0)
+
+	def close(self):
+		self.closed.set()
+
+
+class Factory(object):
+	"""Creates hardware in the given modes in turn, raising for None."""
+
+	def __init__(self, *modes):
+		self.modes = list(modes)
+		self.created = []
+		self.times = []
+
+	def __call__(self):
+		self.times.append(time.time())
+		mode = self.modes.pop(0) if len(self.modes) > 1 else self.modes[0]
+		if mode is None:
+			raise IOError('No such device.')
+		hardware = FlakyHardware(mode)
+		self.created.append(hardware)
+		return hardware
+
+
+class MockGammaAdjust(object):
+	def __init__(self):
+		self.whites = []
+
+	def adjust_white_point(self, white):
+		self.whites.append(white)
+
+	def restore(self):
+		pass
+
+
+def _wait_for(condition, timeout=2.0):
+	finished = time.time() + timeout
+	while not condition() and time.time() < finished:
+		time.sleep(0.01)
+	return condition()
+
+
+class TestSupervisedHardware(unittest.TestCase):
+
+	def supervise(self, factory, **kwargs):
+		kwargs.setdefault('backoff', 0.01)
+		supervised = Supervisor.SupervisedHardware(factory, **kwargs)
+		self.addCleanup(supervised.close)
+		return supervised
+
+	def test_passes_through_readings(self):
+		supervised = self.supervise(Factory('ok'))
+
+		self.assertTrue(supervised.connected)
+		self.assertEqual(supervised.get_color(), (1.0, 0.5, 0.0))
+		self.assertEqual(supervised.last_counts, (1, 2, 3, 4))
+		self.assertTrue(supervised.light_changed())
+
+	def test_calls_share_one_worker_thread(self):
+		threads = set()
+		factory = Factory('ok')
+		supervised = self.supervise(factory)
+		hardware = factory.created[0]
+		get_color = hardware.get_color
+		def record():
+			threads.add(threading.current_thread())
+			return get_color()
+		hardware.get_color = record
+
+		for _ in range(5):
+			supervised.get_color()
+
+		self.assertEqual(len(threads), 1)
+		self.assertIsNot(threads.pop(), threading.current_thread())
+
+	def test_deadline_from_hardware(self):
+		bounded = FlakyHardware()
+		bounded.max_read_seconds = 2.8
+
+		self.assertAlmostEqual(self.supervise(lambda: bounded)._worker.deadline, 2.8 + Supervisor.DEADLINE_MARGIN)
+		self.assertEqual(self.supervise(FlakyHardware)._worker.deadline, Supervisor.DEFAULT_DEADLINE)
+		# A deadline shorter than the hardware can take is used, with a warning.
+		with mock.patch.object(Supervisor.log, 'warning') as warning:
+			self.assertEqual(self.supervise(lambda: bounded, deadline=1.0)._worker.deadline, 1.0)
+		self.assertTrue(warning.called)
+
+	def test_sample_shares_one_deadline(self):
+		class SlowHardware(FlakyHardware):
+			def light_changed(self):
+				time.sleep(0.4)
+				return True
+			def get_color(self):
+				time.sleep(0.4)
+				return FlakyHardware.get_color(self)
+
+		supervised = self.supervise(SlowHardware, deadline=0.5, backoff=10.0)
+
+		started = time.time()
+		self.assertIsNone(AutoColorTemp.sample(supervised))
+
+		# The reading only gets what the light check left of the deadline.
+		self.assertLess(time.time() - started, 0.7)
+		self.assertFalse(supervised.connected)
+
+	def test_missed_deadline_reconnects(self):
+		factory = Factory('hang', 'ok')
+		supervised = self.supervise(factory, deadline=0.1)
+
+		started = time.time()
+		self.assertIsNone(supervised.get_color())
+
+		self.assertLess(time.time() - started, 1.0)
+		# The stuck hardware is closed, which frees its thread, and replaced.
+		self.assertTrue(factory.created[0].closed.is_set())
+		self.assertTrue(_wait_for(lambda: supervised.connected))
+		self.assertEqual(supervised.get_color(), (1.0, 0.5, 0.0))
+		self.assertEqual(supervised.reconnects, 1)
+
+	def test_repeated_failures_reconnect(self):
+		factory = Factory('error', 'ok')
+		supervised = self.supervise(factory, max_failures=3)
+
+		self.assertIsNone(supervised.get_color())
+		self.assertIsNone(supervised.get_color())
+		self.assertTrue(supervised.connected)
+		self.assertEqual(supervised.failures, 2)
+		self.assertIsNone(supervised.get_color())
+
+		self.assertTrue(_wait_for(lambda: supervised.connected))
+		self.assertEqual(supervised.get_color(), (1.0, 0.5, 0.0))
+		self.assertEqual(supervised.failures, 0)
+		self.assertEqual(len(factory.created), 2)
+
+	def test_exponential_backoff(self):
+		factory = Factory(None, None, None, None, None, 'ok')
+		with mock.patch.object(Supervisor.random, 'uniform', return_value=1.0):
+			supervised = self.supervise(factory, backoff=0.05, max_backoff=0.2)
+			self.assertFalse(supervised.connected)
+			self.assertIsNone(supervised.get_color())
+			self.assertTrue(_wait_for(lambda: supervised.connected, 5.0))
+
+		gaps = [b - a for a, b in zip(factory.times, factory.times[1:])]
+		for gap, expected in zip(gaps, (0.05, 0.1, 0.2, 0.2, 0.2)):
+			self.assertGreaterEqual(gap, expected * 0.9)
+			self.assertLess(gap, expected + 0.1)
+
+	def test_close_stops_reconnecting(self):
+		factory = Factory(None)
+		supervised = self.supervise(factory, backoff=0.05)
+
+		supervised.close()
+		attempts = len(factory.times)
+		time.sleep(0.2)
+
+		self.assertEqual(len(factory.times), attempts)
+
+	def test_display_holds_while_disconnected(self):
+		factory = Factory('ok', None)
+		supervised = self.supervise(factory, max_failures=1, backoff=10.0)
+		gamma = MockGammaAdjust()
+		main = AutoColorTemp.AutoColorTemp(supervised, gamma)
+
+		main.update()
+		factory.created[0].mode = 'error'
+		main.update()
+		main.update()
+
+		self.assertFalse(supervised.connected)
+		self.assertEqual(len(gamma.whites), 1)
+		self.assertEqual(main.applied_updates, 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
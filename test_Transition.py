@@ -0,0 +1,137 @@
+import threading
+import time
+import unittest
+
+import GammaRamp
+import Transition
+
+
+class RecordingGamma(object):
+	def __init__(self):
+		self.whites = []
+		self.restore_called = False
+
+	def adjust_white_point(self, white):
+		self.whites.append(white)
+
+	def restore(self):
+		self.restore_called = True
+
+
+class RampGamma(RecordingGamma):
+	"""Builds a ramp for each white point like a real backend."""
+
+	def __init__(self):
+		super(RampGamma, self).__init__()
+		self.builder = GammaRamp.RampBuilder(cache_size=1024)
+		self.misses = 0
+
+	def adjust_white_point(self, white):
+		before = len(self.builder._ramps)
+		self.builder.build(256, white, (1.0, 1.0, 1.0))
+		self.misses += len(self.builder._ramps) - before
+		super(RampGamma, self).adjust_white_point(white)
+
+
+class SlowGamma(RecordingGamma):
+	"""Takes a while to apply each white point, like a slow driver."""
+
+	def __init__(self):
+		super(SlowGamma, self).__init__()
+		self.writing = threading.Event()
+
+	def adjust_white_point(self, white):
+		self.writing.set()
+		time.sleep(0.2)
+		super(SlowGamma, self).adjust_white_point(white)
+
+
+class TestGammaTransition(unittest.TestCase):
+
+	def setUp(self):
+		self.gamma = RecordingGamma()
+		self.transition = Transition.GammaTransition(self.gamma, duration=0.2, fps=100.0)
+		self.addCleanup(self.transition.stop)
+
+	def wait_for_white(self, white, timeout=2.0):
+		end = time.time() + timeout
+		while time.time() < end:
+			if self.gamma.whites and self.gamma.whites[-1] == white:
+				return
+			time.sleep(0.01)
+		self.fail('White point {0} never applied.'.format(white))
+
+	def test_first_white_point_is_applied_immediately(self):
+		self.transition.adjust_white_point((1.0, 1.0, 1.0))
+
+		self.assertEqual(self.gamma.whites, [(1.0, 1.0, 1.0)])
+
+	def test_fades_to_target(self):
+		self.transition.adjust_white_point((1.0, 1.0, 1.0))
+		self.transition.adjust_white_point((1.0, 0.5, 0.0))
+		self.wait_for_white((1.0, 0.5, 0.0))
+
+		blues = [white[2] for white in self.gamma.whites]
+		# Several intermediate frames that move steadily towards the target.
+		self.assertGreater(len(blues), 5)
+		for previous, current in zip(blues, blues[1:]):
+			self.assertLessEqual(current, previous)
+
+	def test_retarget_starts_from_current_white_point(self):
+		self.transition.adjust_white_point((1.0, 1.0, 1.0))
+		self.transition.adjust_white_point((1.0, 1.0, 0.0))
+		time.sleep(0.1)
+		self.transition.adjust_white_point((1.0, 1.0, 1.0))
+		self.wait_for_white((1.0, 1.0, 1.0))
+
+		blues = [white[2] for white in self.gamma.whites]
+		# The fade turned around part way, never reaching the first target.
+		self.assertGreater(min(blues), 0.0)
+		self.assertLess(min(blues), 1.0)
+
+	def test_restore_stops_transition(self):
+		self.transition.adjust_white_point((1.0, 1.0, 1.0))
+		self.transition.adjust_white_point((0.0, 0.0, 0.0))
+		self.transition.restore()
+		count = len(self.gamma.whites)
+		time.sleep(0.05)
+
+		self.assertTrue(self.gamma.restore_called)
+		self.assertEqual(len(self.gamma.whites), count)
+
+	def test_repeated_fade_reuses_ramps(self):
+		gamma = RampGamma()
+		transition = Transition.GammaTransition(gamma, duration=0.2, fps=50.0)
+		self.addCleanup(transition.stop)
+		start, target = (1.0, 1.0, 1.0), (1.0, 0.5, 0.0)
+		frames = transition._fade(start, target)
+		transition.adjust_white_point(start)
+		fades = []
+		for white in (target, start, target):
+			count = len(gamma.whites)
+			misses = gamma.misses
+			transition.adjust_white_point(white)
+			end = time.time() + 2.0
+			while gamma.whites[-1] != white and time.time() < end:
+				time.sleep(0.01)
+			fades.append((gamma.whites[count:], gamma.misses - misses))
+
+		first, third = fades[0][0], fades[2][0]
+		# Frames come from the precomputed fade, so repeating it repeats them.
+		self.assertTrue(set(third) <= set(frames))
+		self.assertGreater(len(set(first[:-1]) & set(third[:-1])), 0)
+		self.assertLess(fades[2][1], len(third))
+
+	def test_slow_driver_does_not_block_callers(self):
+		gamma = SlowGamma()
+		transition = Transition.GammaTransition(gamma, duration=1.0, fps=30.0)
+		self.addCleanup(transition.stop)
+		transition.adjust_white_point((1.0, 1.0, 1.0))
+		gamma.writing.clear()
+		transition.adjust_white_point((1.0, 0.5, 0.0))
+		self.assertTrue(gamma.writing.wait(2.0))
+
+		# Retargeting while a frame is being written returns straight away.
+		started = time.time()
+		transition.adjust_white_point((1.0, 1.0, 0.5))
+		self.assertLess(time.time() - started, 0.1)
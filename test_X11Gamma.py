@@ -0,0 +1,158 @@
+from ctypes import *
+import os
+import unittest
+
+import ProbeCache
+import X11Gamma
+
+
+class FakeXlib(object):
+	def __init__(self, screens):
+		self.screens = screens
+		self.flushes = 0
+
+	def XOpenDisplay(self, name):
+		return 1
+
+	def XScreenCount(self, display):
+		return self.screens
+
+	def XRootWindow(self, display, screen):
+		return 100 + screen
+
+	def XFlush(self, display):
+		self.flushes += 1
+
+
+class FakeXrandr(object):
+	"""Fake XRandR with one CRTC per entry of crtcs, a dict of CRTC ID to
+	(output name, gamma ramp size) where output name is None for inactive CRTCs."""
+
+	def __init__(self, crtcs):
+		self.crtcs = crtcs
+		self.config_timestamp = 1
+		self.probes = 0
+		self.ramps = {}
+		self._keep = []
+
+	def _array(self, kind, values):
+		array = (kind * len(values))(*values)
+		self._keep.append(array)
+		return cast(array, POINTER(kind))
+
+	def XRRGetScreenResourcesCurrent(self, display, root):
+		ids = sorted(self.crtcs)
+		return pointer(X11Gamma.XRRScreenResources(configTimestamp=self.config_timestamp,
+			ncrtc=len(ids), crtcs=self._array(c_ulong, ids)))
+
+	def XRRGetCrtcInfo(self, display, resources, crtc):
+		name = self.crtcs[crtc][0]
+		if name is None:
+			return pointer(X11Gamma.XRRCrtcInfo(noutput=0))
+		return pointer(X11Gamma.XRRCrtcInfo(noutput=1, outputs=self._array(c_ulong, [crtc])))
+
+	def XRRGetOutputInfo(self, display, resources, output):
+		return pointer(X11Gamma.XRROutputInfo(name=self.crtcs[output][0].encode('ascii')))
+
+	def XRRGetCrtcGammaSize(self, display, crtc):
+		self.probes += 1
+		return self.crtcs[crtc][1]
+
+	def XRRGetCrtcGamma(self, display, crtc):
+		size = self.crtcs[crtc][1]
+		values = list(range(size))
+		return pointer(X11Gamma.XRRCrtcGamma(size, self._array(c_ushort, values),
+			self._array(c_ushort, values), self._array(c_ushort, values)))
+
+	def XRRSetCrtcGamma(self, display, crtc, gamma):
+		gamma = gamma._obj
+		self.ramps[crtc] = (gamma.red, gamma.green, gamma.blue, gamma.size)
+
+	def ramp(self, crtc):
+		red, green, blue, size = self.ramps[crtc]
+		return (red[:size], green[:size], blue[:size])
+
+	def XRRFreeGamma(self, gamma):
+		pass
+
+	def XRRFreeCrtcInfo(self, info):
+		pass
+
+	def XRRFreeOutputInfo(self, info):
+		pass
+
+	def XRRFreeScreenResources(self, resources):
+		pass
+
+
+class TestX11Declarations(unittest.TestCase):
+
+	def test_display_pointers_are_declared(self):
+		# Undeclared pointer arguments are truncated to 32-bit ints on 64-bit.
+		for library, names in ((X11Gamma.Xlib, ('XScreenCount', 'XRootWindow', 'XFlush')),
+			(X11Gamma.Xf86vm, ('XF86VidModeGetGammaRampSize', 'XF86VidModeGetGammaRamp', 'XF86VidModeSetGammaRamp'))):
+			for name in names:
+				self.assertEqual(getattr(library, name).argtypes[0], c_void_p, name)
+		self.assertEqual(X11Gamma.Xlib.XOpenDisplay.restype, c_void_p)
+
+
+class TestX11Gamma(unittest.TestCase):
+
+	def setUp(self):
+		self.xlib = FakeXlib(1)
+		self.xrandr = FakeXrandr({1: ('DP-1', 256), 2: ('HDMI-1', 1024), 3: (None, 256), 4: ('DP-2', 256)})
+		for name, fake in (('Xlib', self.xlib), ('Xrandr', self.xrandr)):
+			self.addCleanup(setattr, X11Gamma, name, getattr(X11Gamma, name))
+			setattr(X11Gamma, name, fake)
+
+	def test_finds_active_crtcs(self):
+		gamma = X11Gamma.X11Gamma()
+
+		self.assertEqual([o.name for o in gamma.outputs], ['DP-1', 'HDMI-1', 'DP-2'])
+		self.assertEqual([o.ramp_size for o in gamma.outputs], [256, 1024, 256])
+
+	def test_adjust_white_point_updates_all_outputs_in_one_flush(self):
+		gamma = X11Gamma.X11Gamma()
+
+		gamma.adjust_white_point((1.0, 0.5, 0.25))
+
+		self.assertEqual(sorted(self.xrandr.ramps), [1, 2, 4])
+		self.assertEqual(self.xlib.flushes, 1)
+		red, green, blue = self.xrandr.ramp(2)
+		self.assertEqual(len(red), 1024)
+		self.assertEqual(red[-1], 65535)
+		self.assertEqual(green[-1], 32767)
+		# Outputs with the same ramp size share the same ramp.
+		self.assertEqual(self.xrandr.ramp(1), self.xrandr.ramp(4))
+
+	def test_adjust_white_point_per_output(self):
+		gamma = X11Gamma.X11Gamma()
+
+		gamma.adjust_white_point({'DP-2': (0.5, 0.5, 0.5)})
+
+		self.assertEqual(sorted(self.xrandr.ramps), [4])
+		self.assertEqual(self.xrandr.ramp(4)[0][-1], 32767)
+
+	def test_restore_single_output(self):
+		gamma = X11Gamma.X11Gamma()
+
+		gamma.restore('HDMI-1')
+
+		self.assertEqual(sorted(self.xrandr.ramps), [2])
+		self.assertEqual(self.xrandr.ramp(2)[0], list(range(1024)))
+
+	def test_cache_skips_probing_until_configuration_changes(self):
+		cache = ProbeCache.ProbeCache(os.devnull)
+		X11Gamma.X11Gamma(cache=cache)
+		probes = self.xrandr.probes
+
+		gamma = X11Gamma.X11Gamma(cache=cache)
+
+		self.assertEqual(self.xrandr.probes, probes)
+		self.assertEqual([o.name for o in gamma.outputs], ['DP-1', 'HDMI-1', 'DP-2'])
+		self.assertEqual([o.ramp_size for o in gamma.outputs], [256, 1024, 256])
+
+		self.xrandr.config_timestamp += 1
+		X11Gamma.X11Gamma(cache=cache)
+
+		self.assertEqual(self.xrandr.probes, 2 * probes)